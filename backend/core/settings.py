@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'login.middleware.facial_timing_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -61,6 +62,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'core.urls'
 
+# Motor de sesiones: 'cached_db' (o 'signed_cookies') evita leer la tabla de sesiones en cada petición
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -102,6 +106,17 @@ else:
     }
 
 
+# Caché de Django. LocMemCache es por proceso; para compartir entre workers usar p.ej.
+# DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache y DJANGO_CACHE_LOCATION=redis://127.0.0.1:6379,
+# memcached (PyMemcacheCache) o FileBasedCache con un directorio local
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -147,7 +162,103 @@ AUTH_USER_MODEL = 'login.Usuario'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Almacenamiento y comparación de embeddings: 'float32', 'float16' o 'int8' (escala por dimensión).
+# En int8 cada usuario guarda además su escala (dims x float16): con 1-2 muestras por usuario
+# 'float16' ocupa lo mismo o menos; int8 rinde sobre todo en el índice (FACIAL_INDEX_DTYPE).
+# El ajuste de umbral para los modos cuantizados se mide con `manage.py calibrate_quantization`.
+FACIAL_EMBEDDING_DTYPE = os.environ.get('FACIAL_EMBEDDING_DTYPE', 'float32')
+FACIAL_QUANT_THRESHOLD_OFFSET = float(os.environ.get('FACIAL_QUANT_THRESHOLD_OFFSET', '0'))
+# Modo del índice 1:N (vacío = el de FACIAL_EMBEDDING_DTYPE); con muchos usuarios conviene 'int8'
+FACIAL_INDEX_DTYPE = os.environ.get('FACIAL_INDEX_DTYPE') or None
+
+# Caché en memoria de la galería de embeddings por usuario (login 1:1)
+FACIAL_GALLERY_CACHE_SIZE = int(os.environ.get('FACIAL_GALLERY_CACHE_SIZE', '2048'))
+FACIAL_GALLERY_CACHE_TTL = int(os.environ.get('FACIAL_GALLERY_CACHE_TTL', '300'))  # segundos
+# Caché compartida entre workers (alias de CACHES, '' = desactivada) con los embeddings
+# empaquetados por usuario y embeddings_version; las claves versionadas nunca quedan obsoletas
+FACIAL_EMBEDDING_CACHE = os.environ.get('FACIAL_EMBEDDING_CACHE', 'default')
+FACIAL_EMBEDDING_CACHE_TTL = int(os.environ.get('FACIAL_EMBEDDING_CACHE_TTL', '86400'))  # segundos
+
+# Pool de procesos para detección/codificación facial (0 = en el hilo de la petición)
+FACIAL_ENCODER_WORKERS = int(os.environ.get('FACIAL_ENCODER_WORKERS', '0'))
+FACIAL_ENCODER_QUEUE = int(os.environ.get('FACIAL_ENCODER_QUEUE', '8'))  # trabajos en espera
+FACIAL_ENCODER_TIMEOUT = float(os.environ.get('FACIAL_ENCODER_TIMEOUT', '10'))  # segundos por trabajo
+# Calentamiento al arrancar el servidor (core/wsgi.py, core/asgi.py; ver services.warmup): importa
+# numpy/cv2/face_recognition, codifica un frame sintético y arranca el pool antes de recibir tráfico
+FACIAL_WARMUP = os.environ.get('FACIAL_WARMUP', '1') == '1'
+FACIAL_ENCODE_MAX_BATCH = int(os.environ.get('FACIAL_ENCODE_MAX_BATCH', '20'))  # frames por lote en /api/encode/
+FACIAL_LOGIN_MAX_FRAMES = int(os.environ.get('FACIAL_LOGIN_MAX_FRAMES', '7'))  # frames por intento en /api/login/
+# Control de calidad previo a la detección (services.quality): nitidez (varianza del Laplaciano),
+# brillo y contraste medidos sobre una copia en grises de lado mayor FACIAL_QUALITY_MAX_SIDE
+FACIAL_QUALITY_GATE = os.environ.get('FACIAL_QUALITY_GATE', '1') == '1'
+FACIAL_QUALITY_MAX_SIDE = int(os.environ.get('FACIAL_QUALITY_MAX_SIDE', '200'))
+FACIAL_QUALITY_MIN_SHARPNESS = float(os.environ.get('FACIAL_QUALITY_MIN_SHARPNESS', '15'))
+FACIAL_QUALITY_MIN_BRIGHTNESS = float(os.environ.get('FACIAL_QUALITY_MIN_BRIGHTNESS', '40'))
+FACIAL_QUALITY_MAX_BRIGHTNESS = float(os.environ.get('FACIAL_QUALITY_MAX_BRIGHTNESS', '215'))
+FACIAL_QUALITY_MIN_CONTRAST = float(os.environ.get('FACIAL_QUALITY_MIN_CONTRAST', '12'))
+# Control de admisión por proceso de las vistas que codifican (services.admission): peticiones
+# en curso, cola de espera y plazo (s); sin cupo a tiempo -> 503 con Retry-After
+FACIAL_ADMISSION_ENABLED = os.environ.get('FACIAL_ADMISSION_ENABLED', '1') == '1'
+FACIAL_ADMISSION_MAX_CONCURRENT = int(os.environ.get('FACIAL_ADMISSION_MAX_CONCURRENT', str(os.cpu_count() or 2)))
+FACIAL_ADMISSION_QUEUE = int(os.environ.get('FACIAL_ADMISSION_QUEUE', '8'))
+FACIAL_ADMISSION_WAIT = float(os.environ.get('FACIAL_ADMISSION_WAIT', '2'))
+# Cubetas de tokens (un token por frame) por IP y por email; ráfaga 0 = sin límite -> 429
+FACIAL_RATE_IP_BURST = int(os.environ.get('FACIAL_RATE_IP_BURST', '60'))
+FACIAL_RATE_IP_PER_SECOND = float(os.environ.get('FACIAL_RATE_IP_PER_SECOND', '3'))
+FACIAL_RATE_EMAIL_BURST = int(os.environ.get('FACIAL_RATE_EMAIL_BURST', '20'))
+FACIAL_RATE_EMAIL_PER_SECOND = float(os.environ.get('FACIAL_RATE_EMAIL_PER_SECOND', '0.5'))
+FACIAL_RATE_MAX_KEYS = int(os.environ.get('FACIAL_RATE_MAX_KEYS', '10000'))
+# Cabecera META con la IP real detrás de un proxy de confianza (p.ej. 'HTTP_X_FORWARDED_FOR'); vacío = REMOTE_ADDR
+FACIAL_CLIENT_IP_HEADER = os.environ.get('FACIAL_CLIENT_IP_HEADER', '')
+# Lado mayor (px) de la copia reducida usada para la detección HOG (0 = resolución completa)
+FACIAL_DETECT_MAX_SIDE = int(os.environ.get('FACIAL_DETECT_MAX_SIDE', '640'))
+# Tamaño máximo (bytes) de un frame subido en binario (multipart o image/jpeg); mayor -> 413
+FACIAL_MAX_UPLOAD_BYTES = int(os.environ.get('FACIAL_MAX_UPLOAD_BYTES', str(4 * 1024 * 1024)))
+# Caché de embeddings por contenido del frame: 'local' (proceso), 'django' (CACHES, compartida) o '' (off)
+FACIAL_FRAME_CACHE = os.environ.get('FACIAL_FRAME_CACHE', 'local')
+FACIAL_FRAME_CACHE_ALIAS = os.environ.get('FACIAL_FRAME_CACHE_ALIAS', 'default')
+FACIAL_FRAME_CACHE_SIZE = int(os.environ.get('FACIAL_FRAME_CACHE_SIZE', '512'))  # entradas (solo 'local')
+FACIAL_FRAME_CACHE_TTL = int(os.environ.get('FACIAL_FRAME_CACHE_TTL', '60'))  # segundos
+# Archivo local de frames de enrolamiento (por contenido) para `manage.py reembed_users`; vacío = no se guardan
+FACIAL_FRAME_ARCHIVE_DIR = os.environ.get('FACIAL_FRAME_ARCHIVE_DIR') or None
+# Tiempos por etapa (cabecera Server-Timing) e histogramas en /metrics/
+FACIAL_METRICS_ENABLED = os.environ.get('FACIAL_METRICS_ENABLED', '1') == '1'
+FACIAL_SERVER_TIMING = os.environ.get('FACIAL_SERVER_TIMING', '1') == '1'
+
+# Identificación 1:N (/api/identify/)
+FACIAL_IDENTIFY_THRESHOLD = float(os.environ.get('FACIAL_IDENTIFY_THRESHOLD', '0.45'))
+FACIAL_IDENTIFY_TOP_K = int(os.environ.get('FACIAL_IDENTIFY_TOP_K', '5'))
+# Índice compartido en disco (memmap) generado con `manage.py build_face_index`.
+# Vacío = cada proceso construye su índice desde la BD.
+FACIAL_INDEX_DIR = os.environ.get('FACIAL_INDEX_DIR') or None
+FACIAL_INDEX_CHECK_INTERVAL = float(os.environ.get('FACIAL_INDEX_CHECK_INTERVAL', '5'))  # segundos
+# Índice desde la BD: los cambios se publican en FACIAL_EMBEDDING_CACHE y cada worker
+# reemplaza solo esas filas; con más usuarios cambiados que FACIAL_INDEX_MAX_INCREMENTAL
+# reconstruye en segundo plano. Sin caché compartida reconstruye cada FACIAL_INDEX_REFRESH.
+FACIAL_INDEX_MAX_INCREMENTAL = int(os.environ.get('FACIAL_INDEX_MAX_INCREMENTAL', '2000'))
+FACIAL_INDEX_REFRESH = float(os.environ.get('FACIAL_INDEX_REFRESH', '300'))  # segundos
+
 # Logging temporal para diagnóstico del reconocimiento facial
+# FACIAL_LOG_MODE: 'queue' escribe el archivo desde un hilo de fondo (la petición no espera
+# al disco); 'sync' usa el FileHandler directo. FACIAL_LOG_SAMPLING deja pasar 1 de cada N
+# mensajes DEBUG por tipo (prefijo del mensaje), p.ej. 'compute_embedding=10,encoder=10'.
+FACIAL_LOG_MODE = os.environ.get('FACIAL_LOG_MODE', 'queue')
+FACIAL_LOG_LEVEL = os.environ.get('FACIAL_LOG_LEVEL', 'DEBUG')
+FACIAL_LOG_SAMPLING = os.environ.get('FACIAL_LOG_SAMPLING', 'compute_embedding=10,encoder=10')
+FACIAL_LOG_QUEUE_SIZE = int(os.environ.get('FACIAL_LOG_QUEUE_SIZE', '10000'))  # registros; si se llena se descartan
+
+if FACIAL_LOG_MODE == 'queue':
+    _facial_file_handler = {
+        '()': 'login.log_handlers.QueueFileHandler',
+        'filename': str(BASE_DIR / 'facial_debug.log'),
+        'queue_size': FACIAL_LOG_QUEUE_SIZE,
+    }
+else:
+    _facial_file_handler = {
+        'class': 'logging.FileHandler',
+        'filename': str(BASE_DIR / 'facial_debug.log'),
+    }
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -156,11 +267,16 @@ LOGGING = {
             'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
         },
     },
+    'filters': {
+        'facial_sampling': {
+            '()': 'login.log_handlers.SamplingFilter',
+            'rates': FACIAL_LOG_SAMPLING,
+        },
+    },
     'handlers': {
         'facial_file': {
+            **_facial_file_handler,
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': str(BASE_DIR / 'facial_debug.log'),
             'formatter': 'verbose',
         },
         'console': {
@@ -172,7 +288,10 @@ LOGGING = {
     'loggers': {
         'facial': {
             'handlers': ['facial_file', 'console'],
-            'level': 'DEBUG',
+            'level': FACIAL_LOG_LEVEL,
+            # En el logger y no en el handler: un DEBUG descartado por muestreo no
+            # recorre los handlers ni se encola
+            'filters': ['facial_sampling'],
             'propagate': False,
         },
     },
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Carga librerías y modelos faciales antes de recibir tráfico (FACIAL_WARMUP)
+from login.services.warmup import warm_up_if_enabled  # noqa: E402
+
+warm_up_if_enabled()
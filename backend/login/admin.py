@@ -1,11 +1,60 @@
 from django.contrib import admin
-from .models.models import Usuario
+from django.contrib.admin.views.main import ChangeList
+
+from .models.models import EnrollmentSummary, Usuario
+from .services.embeddings import BIOMETRIC_FIELDS
+
+
+# Columnas pesadas (blobs y JSON biométricos) que el listado no muestra
+HEAVY_FIELDS = (*BIOMETRIC_FIELDS, "facial_data", "enrollment_frames")
+
+
+class LightChangeList(ChangeList):
+    """Listado que no lee las columnas biométricas (tampoco las acciones sobre la selección)."""
+
+    def get_queryset(self, request, exclude_parameters=None):
+        return super().get_queryset(request, exclude_parameters).defer(*HEAVY_FIELDS)
 
 
 @admin.register(Usuario)
 class UsuarioAdmin(admin.ModelAdmin):
     list_display = ("email", "dni", "nombres", "apellidos", "is_active", "is_staff")
-    search_fields = ("email", "dni", "nombres", "apellidos")
+    # Email por subcadena, como antes (recorre la tabla); DNI, apellidos y nombres por
+    # prefijo: "x%" usa los índices en MySQL/SQLite (colación sin mayúsculas). En
+    # PostgreSQL istartswith compara UPPER(col) y no los usa.
+    search_fields = ("email", "^dni", "^apellidos", "^nombres")
     readonly_fields = ("date_joined",)
+    list_per_page = 50
+    # Con una búsqueda, evita un segundo COUNT(*) sobre toda la tabla
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return LightChangeList
+
+
+@admin.register(EnrollmentSummary)
+class EnrollmentSummaryAdmin(admin.ModelAdmin):
+    """Resumen de enrolamiento de solo lectura, desde los metadatos que mantiene Usuario.save()."""
+
+    list_display = (
+        "email", "apellidos", "nombres", "embedding_count", "embedding_dims", "embedding_encoder",
+        "enrollment_updated_at",
+    )
+    fields = list_display + ("embeddings_version",)
+    readonly_fields = fields
+    search_fields = ("^email", "^apellidos")
+    list_per_page = 100
+    show_full_result_count = False
+    actions = None
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).only("id", *self.fields)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-# Register your models here.
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LoginConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'login'
+
+    def ready(self):
+        # Registra receptores que invalidan cachés de embeddings al guardar
+        from . import signals  # noqa: F401
@@ -0,0 +1,168 @@
+"""Datos sintéticos y BD temporal para benchmarks (sin servicios externos ni cámaras)."""
+import base64
+import contextlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import cv2
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def synthetic_image(seed, width=640, height=480):
+    """Imagen BGR con un óvalo tipo rostro (ojos, boca) sobre fondo con ruido."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(40, 200, size=(height, width, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), sigmaX=max(width / 160, 1))
+    cx = int(width * rng.uniform(0.4, 0.6))
+    cy = int(height * rng.uniform(0.4, 0.6))
+    fw = int(min(width, height) * rng.uniform(0.18, 0.28))
+    skin = tuple(int(c) for c in rng.integers(120, 220, size=3))
+    cv2.ellipse(img, (cx, cy), (fw, int(fw * 1.3)), 0, 0, 360, skin, -1)
+    eye = max(fw // 8, 2)
+    for dx in (-fw // 3, fw // 3):
+        cv2.circle(img, (cx + dx, cy - fw // 4), eye, (30, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + fw // 2), (fw // 3, max(fw // 10, 1)), 0, 0, 360, (40, 40, 120), -1)
+    return img
+
+
+def encode_jpeg(img, quality=90) -> bytes:
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError('No se pudo codificar JPEG')
+    return buf.tobytes()
+
+
+def to_data_url(img_bytes) -> str:
+    return 'data:image/jpeg;base64,' + base64.b64encode(img_bytes).decode('ascii')
+
+
+def synthetic_frame(seed, width=640, height=480) -> str:
+    """Frame sintético como data URL base64 (mismo formato que envía el front)."""
+    return to_data_url(encode_jpeg(synthetic_image(seed, width, height)))
+
+
+def background_image(seed, width=640, height=480):
+    """Fondo con textura y contraste realistas pero sin rostro: pasa el control de
+    calidad y llega hasta la detección (a diferencia de blank_frame).
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(40, 200, size=(height, width, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), sigmaX=max(width / 160, 1))
+    for _ in range(6):
+        color = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.rectangle(img, (x, y), (x + int(rng.integers(20, width // 3)), y + int(rng.integers(20, height // 3))), color, -1)
+    return img
+
+
+def jittered_jpeg(img, seed, quality=90) -> bytes:
+    """Variante del mismo frame con ruido leve: otros bytes (no la sirve la caché de
+    frames) pero el mismo contenido.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(-3, 4, size=img.shape, dtype=np.int16)
+    return encode_jpeg(np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8), quality)
+
+
+def blank_frame(width=640, height=480) -> str:
+    """Frame sin rostro (gris uniforme)."""
+    return to_data_url(encode_jpeg(np.full((height, width, 3), 128, dtype=np.uint8)))
+
+
+def synthetic_position(seed=0) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        'x': round(float(rng.uniform(0.4, 0.6)), 4),
+        'y': round(float(rng.uniform(0.4, 0.6)), 4),
+        'scale': round(float(rng.uniform(0.25, 0.35)), 4),
+    }
+
+
+def random_embeddings(identities, samples=1, dims=128, noise=0.03, seed=0):
+    """Embeddings con estructura de identidades: muestras = identidad + ruido.
+    Las normas (~1) y distancias intra/inter-identidad imitan a face_recognition.
+    Devuelve (matriz float32 [identities*samples x dims], etiquetas de identidad).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 1.0 / np.sqrt(dims), size=(identities, dims)).astype(np.float32)
+    matrix = np.repeat(centers, samples, axis=0)
+    matrix += rng.normal(0.0, noise, size=matrix.shape).astype(np.float32)
+    labels = np.repeat(np.arange(identities), samples)
+    return matrix, labels
+
+
+def summarize(values):
+    """Resumen de latencias en milisegundos (valores de entrada en segundos)."""
+    if not values:
+        return {'count': 0}
+    arr = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        'count': int(arr.size),
+        'mean_ms': round(float(arr.mean()), 3),
+        'p50_ms': round(float(np.percentile(arr, 50)), 3),
+        'p90_ms': round(float(np.percentile(arr, 90)), 3),
+        'p99_ms': round(float(np.percentile(arr, 99)), 3),
+        'max_ms': round(float(arr.max()), 3),
+    }
+
+
+@contextlib.contextmanager
+def temporary_database(verbosity=0):
+    """Crea una BD de prueba (como `manage.py test`) y la destruye al salir.
+    En SQLite usa un archivo temporal: la BD en memoria compartida no espera
+    bloqueos y falla con escrituras concurrentes.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous_test_name = test_settings.get('NAME')
+    tmpdir = None
+    if connection.vendor == 'sqlite' and not previous_test_name:
+        tmpdir = tempfile.mkdtemp(prefix='facial-bench-')
+        test_settings['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+        if tmpdir is not None:
+            test_settings['NAME'] = previous_test_name
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def seed_users(count, width=640, height=480, prefix='bench', seed=0):
+    """Crea `count` usuarios cuyo embedding registrado sale de su propio frame sintético.
+    Devuelve una lista de dicts {email, frame, position} para generar tráfico válido.
+    """
+    from ..models.models import Usuario
+    from ..services.embeddings import pack_embeddings
+    from ..services.encoder import compute_embedding
+
+    users, seeded = [], []
+    for i in range(count):
+        frame = synthetic_frame(seed + i, width, height)
+        emb = compute_embedding(frame)
+        if emb is None:
+            continue
+        position = synthetic_position(seed + i)
+        email = f'{prefix}{i}@example.invalid'
+        user = Usuario(
+            email=email,
+            dni=f'{prefix}{i}'[-20:],
+            nombres='Bench',
+            apellidos=str(i),
+            facial_data=emb.tobytes(),
+            facial_embeddings_bin=pack_embeddings(emb.reshape(1, -1)),
+            positions=[position],
+            position_data=position,
+        )
+        user.set_unusable_password()
+        user.refresh_enrollment_summary()
+        users.append(user)
+        seeded.append({'email': email, 'frame': frame, 'position': position, 'seed': seed + i})
+    Usuario.objects.bulk_create(users, batch_size=500)
+    return seeded
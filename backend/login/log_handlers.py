@@ -0,0 +1,140 @@
+"""Handlers de logging para el logger `facial` sin E/S de disco en la petición.
+
+QueueFileHandler encola el LogRecord tal cual (sin formatear) y un hilo de fondo
+lo formatea y escribe en el archivo; si la cola se llena se descartan registros
+en lugar de bloquear la petición. SamplingFilter deja pasar solo 1 de cada N
+mensajes DEBUG de cada tipo (prefijo antes de ':' como 'compute_embedding'); va en
+el logger `facial`, así un registro descartado no pasa por ningún handler.
+
+Con mensajes en estilo %-args (log.debug('x=%s', x)) un registro filtrado por
+nivel o por muestreo no se llega a formatear nunca.
+
+Se cargan desde settings.LOGGING antes de inicializar las apps: no importar
+modelos aquí.
+"""
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+
+class SamplingFilter(logging.Filter):
+    """Muestreo por tipo de mensaje: `rates` = {'compute_embedding': 10} (o el texto
+    'compute_embedding=10,encoder=5') deja pasar 1 de cada 10. Solo afecta a DEBUG;
+    INFO o superior siempre pasa.
+    """
+
+    def __init__(self, rates=None, name=''):
+        super().__init__(name)
+        if isinstance(rates, str):
+            rates = parse_sampling(rates)
+        self.rates = {key: int(n) for key, n in (rates or {}).items() if int(n) > 1}
+        self._counters = {key: itertools.count() for key in self.rates}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        msg = record.msg if isinstance(record.msg, str) else ''
+        key = msg.split(':', 1)[0]
+        rate = self.rates.get(key)
+        if rate is None:
+            return True
+        # next() sobre itertools.count es atómico bajo el GIL
+        return next(self._counters[key]) % rate == 0
+
+
+def parse_sampling(spec):
+    """'compute_embedding=10,encoder=5' -> {'compute_embedding': 10, 'encoder': 5}."""
+    rates = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            key, _, value = item.partition('=')
+            rates[key.strip()] = int(value)
+    return rates
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener cuyo centinela de cierre entra aunque la cola esté llena: espera
+    a que el hilo libere lugar y, si no avanza, descarta los registros más viejos.
+    """
+
+    def __init__(self, queue, handler, on_drop, timeout=1.0):
+        super().__init__(queue, handler, respect_handler_level=False)
+        self.on_drop = on_drop
+        self.timeout = timeout
+
+    def enqueue_sentinel(self):
+        try:
+            self.queue.put(self._sentinel, timeout=self.timeout)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.on_drop()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                time.sleep(0)
+
+
+class QueueFileHandler(logging.handlers.QueueHandler):
+    """Escritura a archivo en un hilo de fondo; el formateo también ocurre allí."""
+
+    def __init__(self, filename, queue_size=10000, encoding='utf-8'):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.filename = filename
+        self.encoding = encoding
+        self.dropped = 0
+        self._target = None
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Tras un fork (p.ej. gunicorn --preload) el hilo no existe en el hijo: se recrea
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._target is None:
+                self._target = logging.FileHandler(self.filename, encoding=self.encoding, delay=True)
+            self._target.setFormatter(self.formatter)
+            self._listener = _QueueListener(self.queue, self._target, self._count_drop)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Sin formatear aquí: el hilo de fondo resuelve msg % args y el traceback
+        return record
+
+    def _count_drop(self):
+        self.dropped += 1
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._count_drop()
+
+    def close(self):
+        # logging.shutdown() (atexit) llega aquí: se vacía la cola antes de salir; con la
+        # cola llena el centinela de stop() no bloquea (ver _QueueListener)
+        with self._start_lock:
+            listener, self._listener = self._listener, None
+            self._pid = None
+        if listener is not None:
+            listener.stop()
+        if self._target is not None:
+            self._target.close()
+        super().close()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from login.bench.synthetic import seed_users, summarize, temporary_database
+from login.services.admission import reset_admission
+
+
+class _ThreadSampler:
+    """Muestrea el número de hilos vivos para comparar el costo en hilos de cada modo."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara las APIs faciales síncronas (WSGI, un hilo por petición) con sus '
+        'variantes async (ASGI) bajo concurrencia, usando una BD temporal y frames sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Usuarios sintéticos a registrar.')
+        parser.add_argument('--requests', type=int, default=200, help='Peticiones por modo.')
+        parser.add_argument('--concurrency', type=int, default=32, help='Peticiones simultáneas.')
+        parser.add_argument('--endpoint', choices=['login', 'encode'], default='login')
+        parser.add_argument('--width', type=int, default=640)
+        parser.add_argument('--height', type=int, default=480)
+        parser.add_argument('--keep-rate-limits', action='store_true',
+                            help='Mantiene las cubetas por IP/email (todo el tráfico sale de una IP).')
+        parser.add_argument('--json', dest='json_path', default=None, help='Escribe resultados en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        # Todas las peticiones salen de una IP y repiten emails: sin esto se medirían 429
+        overrides = {} if options['keep_rate_limits'] else {'FACIAL_RATE_IP_BURST': 0, 'FACIAL_RATE_EMAIL_BURST': 0}
+        with temporary_database(), override_settings(**overrides):
+            seeded = seed_users(options['users'], options['width'], options['height'])
+            if not seeded:
+                self.stderr.write('No se pudo generar ningún usuario sintético con rostro')
+                return
+            bodies = []
+            for i in range(options['requests']):
+                sample = seeded[i % len(seeded)]
+                if options['endpoint'] == 'login':
+                    body = {'email': sample['email'], 'facial_frame': sample['frame'], 'position_data': sample['position']}
+                else:
+                    body = {'facial_frame': sample['frame']}
+                bodies.append(json.dumps(body))
+
+            # Cada modo empieza con las cubetas y contadores de admisión vacíos
+            results = {}
+            try:
+                reset_admission()
+                results['wsgi'] = self._run_sync(f"/api/{options['endpoint']}/", bodies, options['concurrency'])
+                reset_admission()
+                results['asgi'] = self._run_async(f"/api/async/{options['endpoint']}/", bodies, options['concurrency'])
+            finally:
+                reset_admission()
+
+        for mode, res in results.items():
+            lat = res['latency']
+            self.stdout.write(
+                f"{mode}: {res['throughput_rps']:.1f} req/s  p50={lat.get('p50_ms')}ms "
+                f"p99={lat.get('p99_ms')}ms  hilos_pico={res['peak_threads']}  estados={res['status']}"
+            )
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as fh:
+                json.dump({'options': {k: options[k] for k in ('users', 'requests', 'concurrency', 'endpoint', 'width', 'height',
+                                                              'keep_rate_limits')},
+                           'results': results}, fh, indent=2)
+
+    def _run_sync(self, path, bodies, concurrency):
+        def call(body):
+            # Cliente nuevo por petición: cada login abre su propia sesión
+            client = Client()
+            started = time.perf_counter()
+            response = client.post(path, body, content_type='application/json')
+            return response.status_code, time.perf_counter() - started
+
+        with _ThreadSampler() as sampler:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(call, bodies))
+            elapsed = time.perf_counter() - started
+        return self._report(outcomes, elapsed, sampler.peak)
+
+    def _run_async(self, path, bodies, concurrency):
+        async def run_all():
+            limit = asyncio.Semaphore(concurrency)
+
+            async def call(body):
+                async with limit:
+                    client = AsyncClient()
+                    started = time.perf_counter()
+                    response = await client.post(path, body, content_type='application/json')
+                    return response.status_code, time.perf_counter() - started
+
+            return await asyncio.gather(*(call(body) for body in bodies))
+
+        with _ThreadSampler() as sampler:
+            started = time.perf_counter()
+            outcomes = asyncio.run(run_all())
+            elapsed = time.perf_counter() - started
+        return self._report(outcomes, elapsed, sampler.peak)
+
+    @staticmethod
+    def _report(outcomes, elapsed, peak_threads):
+        status = {}
+        for code, _ in outcomes:
+            status[str(code)] = status.get(str(code), 0) + 1
+        return {
+            'throughput_rps': len(outcomes) / elapsed if elapsed else 0.0,
+            'elapsed_s': round(elapsed, 3),
+            'latency': summarize([lat for _, lat in outcomes]),
+            'peak_threads': peak_threads,
+            'status': status,
+        }
@@ -0,0 +1,104 @@
+import json
+import time
+from pathlib import Path
+
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+from login.bench.synthetic import summarize, synthetic_image
+from login.services import detection
+from login.services.lazy import available
+
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def _iou(a, b):
+    """IoU entre cajas (top, right, bottom, left)."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide latencia de detección HOG frente a tasa de aciertos para distintas '
+        'resoluciones de trabajo (FACIAL_DETECT_MAX_SIDE) y con/sin ROI de FaceMesh.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=None, help='Directorio con fotos reales (jpg/png). Sin él se usan frames sintéticos.')
+        parser.add_argument('--count', type=int, default=20, help='Frames sintéticos si no hay --images.')
+        parser.add_argument('--width', type=int, default=1280)
+        parser.add_argument('--height', type=int, default=720)
+        parser.add_argument('--sides', default='0,960,640,480,320', help='Lados máximos a probar (0 = completo).')
+        parser.add_argument('--json', dest='json_path', default=None, help='Escribe resultados en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        if not available(detection.face_recognition):
+            raise CommandError('face_recognition no está instalado: no hay detector HOG que medir')
+        frames = self._load_frames(options)
+        if not frames:
+            raise CommandError('No hay imágenes para medir')
+        sides = [int(s) for s in options['sides'].split(',') if s.strip()]
+
+        # Referencia: detección a resolución completa sin ROI
+        reference = [detection.detect_faces(rgb, max_side=0) for rgb in frames]
+        found = sum(bool(r) for r in reference)
+        self.stdout.write(f'{len(frames)} frames, {found} con rostro a resolución completa')
+
+        rows = []
+        for side in sides:
+            for use_roi in (False, True):
+                timings, hits, agree = [], 0, 0
+                for rgb, ref in zip(frames, reference):
+                    roi = self._roi_hint(ref, rgb) if use_roi else None
+                    if use_roi and roi is None:
+                        continue
+                    started = time.perf_counter()
+                    boxes = detection.detect_faces(rgb, roi=roi, max_side=side)
+                    timings.append(time.perf_counter() - started)
+                    if boxes:
+                        hits += 1
+                        if ref and _iou(boxes[0], ref[0]) >= 0.5:
+                            agree += 1
+                if not timings:
+                    continue
+                row = {
+                    'max_side': side,
+                    'roi': use_roi,
+                    'frames': len(timings),
+                    'hit_rate': round(hits / len(timings), 4),
+                    'agreement_with_full': round(agree / max(found, 1), 4),
+                    'latency': summarize(timings),
+                }
+                rows.append(row)
+                self.stdout.write(
+                    f"max_side={side or 'full':>5} roi={'sí' if use_roi else 'no'}  "
+                    f"p50={row['latency']['p50_ms']:.1f}ms p99={row['latency']['p99_ms']:.1f}ms  "
+                    f"aciertos={row['hit_rate']:.2%} coincide_con_full={row['agreement_with_full']:.2%}"
+                )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as fh:
+                json.dump({'frames': len(frames), 'reference_hits': found, 'results': rows}, fh, indent=2)
+
+    def _load_frames(self, options):
+        if options['images']:
+            paths = sorted(p for p in Path(options['images']).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+            images = [cv2.imread(str(p), cv2.IMREAD_COLOR) for p in paths]
+        else:
+            images = [synthetic_image(i, options['width'], options['height']) for i in range(options['count'])]
+        return [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images if img is not None]
+
+    @staticmethod
+    def _roi_hint(reference_boxes, rgb):
+        """Simula la caja de FaceMesh a partir de la detección de referencia."""
+        if not reference_boxes:
+            return None
+        top, right, bottom, left = reference_boxes[0]
+        h, w = rgb.shape[:2]
+        return (left / w, top / h, (right - left) / w, (bottom - top) / h)
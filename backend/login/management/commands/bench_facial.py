@@ -0,0 +1,167 @@
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from login.bench.synthetic import (
+    random_embeddings,
+    summarize,
+    synthetic_frame,
+    synthetic_position,
+    temporary_database,
+)
+from login.services import detection
+from login.services.lazy import available
+from login.services.embeddings import build_gallery, get_gallery, invalidate_gallery, pack_embeddings
+from login.services.encoder import compute_embedding_from_bytes, decode_b64
+from login.services.index import EmbeddingIndex
+from login.services.quantize import MODES
+
+
+# Orden en que se reportan las etapas
+STAGES = (
+    'b64_decode', 'imdecode', 'detect', 'encode', 'pipeline',
+    'gallery_build', 'compare', 'identify', 'position', 'db_get', 'db_save',
+)
+
+
+def _timed(fn, iterations, *args):
+    """Ejecuta fn(*args) `iterations` veces; devuelve (último resultado, segundos por llamada)."""
+    timings = []
+    result = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - started)
+    return result, timings
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmark del camino caliente del login facial, etapa por etapa '
+        '(base64, imdecode, detección, codificación, comparación, posición, BD), '
+        'con frames y embeddings sintéticos y una BD temporal. No requiere red ni cámara.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=640)
+        parser.add_argument('--height', type=int, default=480)
+        parser.add_argument('--iterations', type=int, default=50, help='Repeticiones por etapa.')
+        parser.add_argument('--samples', type=int, default=10, help='Muestras registradas por usuario (galería 1:1 y posiciones).')
+        parser.add_argument('--users', type=int, default=10000, help='Filas del índice para la etapa identify (1:N).')
+        parser.add_argument('--max-side', type=int, default=None, help='Lado máximo de detección (por defecto FACIAL_DETECT_MAX_SIDE).')
+        parser.add_argument('--dtype', choices=MODES, default=None,
+                            help='Modo de galería e índice (por defecto FACIAL_EMBEDDING_DTYPE).')
+        parser.add_argument('--json', dest='json_path', default=None, help='Escribe resultados en este archivo JSON.')
+        parser.add_argument('--baseline', default=None, help='JSON de una ejecución anterior para comparar p50.')
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+        from login.views import views
+
+        if options['iterations'] < 1 or options['samples'] < 1:
+            raise CommandError('--iterations y --samples deben ser >= 1')
+        iterations = options['iterations']
+        max_side = options['max_side'] if options['max_side'] is not None else getattr(settings, 'FACIAL_DETECT_MAX_SIDE', 0)
+        dtype = options['dtype'] or getattr(settings, 'FACIAL_EMBEDDING_DTYPE', 'float32')
+        timings = {}
+
+        # Etapas de imagen: un frame sintético con el formato del front (data URL base64)
+        b64 = synthetic_frame(0, options['width'], options['height'])
+        img_bytes, timings['b64_decode'] = _timed(decode_b64, iterations, b64)
+        # imdecode incluye la conversión BGR -> RGB que hace el pipeline
+        frame, timings['imdecode'] = _timed(
+            lambda: cv2.cvtColor(cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB),
+            iterations,
+        )
+        if available(detection.face_recognition):
+            boxes, timings['detect'] = _timed(detection.detect_faces, iterations, frame, None, max_side)
+            if boxes:
+                _, timings['encode'] = _timed(detection.face_recognition.face_encodings, iterations, frame, boxes[:1])
+        else:
+            self.stderr.write('face_recognition no está instalado: se omiten detect/encode (pipeline usa el fallback)')
+        _, timings['pipeline'] = _timed(compute_embedding_from_bytes, iterations, img_bytes, None, max_side)
+
+        # Comparación: embeddings con estructura de identidades en lugar de rostros reales
+        gallery, _ = random_embeddings(1, options['samples'], seed=1)
+        live = gallery[0] + np.float32(0.01)
+        positions = [synthetic_position(i) for i in range(options['samples'])]
+        # Peor caso de la validación: solo coincide la última posición registrada
+        live_pos = dict(positions[-1])
+
+        matrix, labels = random_embeddings(options['users'], 1, seed=2)
+        index = EmbeddingIndex.from_matrix(matrix, labels.astype(np.int64), dtype)
+        _, timings['identify'] = _timed(index.search, iterations, matrix[0], 5)
+
+        with temporary_database(), override_settings(FACIAL_EMBEDDING_DTYPE=dtype, FACIAL_INDEX_DTYPE=dtype):
+            from login.models.models import Usuario
+
+            user = Usuario(
+                email='bench@example.invalid',
+                dni='bench',
+                nombres='Bench',
+                apellidos='Facial',
+                facial_data=gallery[0].tobytes(),
+                facial_embeddings_bin=pack_embeddings(gallery),
+                positions=positions,
+                position_data=positions[0],
+            )
+            user.set_unusable_password()
+            user.save()
+
+            _, timings['gallery_build'] = _timed(build_gallery, iterations, user)
+            invalidate_gallery(user.pk)
+            get_gallery(user)
+            match, timings['compare'] = _timed(views._compare_to_collection, iterations, user, live)
+            position_ok, timings['position'] = _timed(views._validate_position_collection, iterations, user, live_pos)
+            if not (match and position_ok):
+                self.stderr.write(f'Aviso: compare={match} position={position_ok} (se esperaba coincidencia)')
+            user, timings['db_get'] = _timed(lambda: Usuario.objects.get(email='bench@example.invalid'), iterations)
+            _, timings['db_save'] = _timed(lambda: user.save(update_fields=['failed_attempts']), iterations)
+            invalidate_gallery(user.pk)
+
+        results = {stage: summarize(timings[stage]) for stage in STAGES if stage in timings}
+        report = {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'face_recognition': available(detection.face_recognition),
+            'options': {
+                'width': options['width'], 'height': options['height'], 'iterations': iterations,
+                'samples': options['samples'], 'users': options['users'], 'max_side': max_side, 'dtype': dtype,
+            },
+            'stages': results,
+        }
+
+        baseline = self._load_baseline(options['baseline'])
+        for stage, res in results.items():
+            line = f"{stage:<14} p50={res['p50_ms']:9.3f}ms  p90={res['p90_ms']:9.3f}ms  p99={res['p99_ms']:9.3f}ms"
+            previous = baseline.get(stage, {}).get('p50_ms')
+            if previous:
+                line += f'  vs base {res["p50_ms"] / previous:5.2f}x'
+            self.stdout.write(line)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, indent=2)
+
+    @staticmethod
+    def _load_baseline(path):
+        if not path:
+            return {}
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh).get('stages', {})
@@ -0,0 +1,52 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from login.services.index import build_index_from_db, write_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera una nueva generación del índice de embeddings (.npy + mapa de ids) '
+        'para identificación 1:N. Los workers la abren con memmap y la detectan sin reiniciar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='Directorio del índice (por defecto FACIAL_INDEX_DIR).',
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=2,
+            help='Cantidad de generaciones a conservar en disco (mínimo 1).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Usuarios leídos por bloque desde la BD.',
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'FACIAL_INDEX_DIR', None)
+        if not output:
+            raise CommandError('Indique --output o configure FACIAL_INDEX_DIR')
+        if options['keep'] < 1:
+            raise CommandError('--keep debe ser >= 1')
+
+        started = time.perf_counter()
+        index = build_index_from_db(chunk_size=options['chunk_size'])
+        built = time.perf_counter()
+        generation = write_index(Path(output), index, keep=options['keep'])
+        written = time.perf_counter()
+
+        users = len(set(index.user_ids.tolist()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice generación {generation}: {len(index)} embeddings de {users} usuarios '
+            f'en {output} (lectura BD {built - started:.2f}s, escritura {written - built:.2f}s)'
+        ))
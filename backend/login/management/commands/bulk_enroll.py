@@ -0,0 +1,268 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from login.models.models import Usuario
+from login.services.embeddings import invalidate_gallery, pack_embeddings
+from login.services.encoder import _warm_worker, encode_image_files, encoder_signature
+from login.services.frame_archive import get_frame_archive
+from login.services.index import update_index_users
+
+
+REQUIRED_COLUMNS = ('email', 'dni', 'nombres', 'apellidos')
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+# Campos que se reescriben al re-enrolar un usuario existente
+UPDATE_FIELDS = [
+    'dni', 'nombres', 'apellidos', 'facial_data', 'facial_embeddings_bin',
+    'facial_embeddings', 'positions', 'position_data', 'failed_attempts',
+    'embedding_encoder', 'embeddings_version', 'enrollment_frames', *Usuario.SUMMARY_FIELDS,
+]
+
+
+def _split_images(value, base):
+    paths = [p.strip() for p in (value or '').replace('|', ';').split(';') if p.strip()]
+    return [str((base / p) if not os.path.isabs(p) else Path(p)) for p in paths]
+
+
+def read_manifest(path):
+    """CSV con email, dni, nombres, apellidos e images (rutas separadas por ';',
+    relativas al CSV). Columna opcional positions: lista JSON alineada con images.
+    """
+    base = Path(path).resolve().parent
+    with open(path, newline='', encoding='utf-8-sig') as fh:
+        reader = csv.DictReader(fh)
+        missing = [c for c in REQUIRED_COLUMNS + ('images',) if c not in (reader.fieldnames or [])]
+        if missing:
+            raise CommandError(f'Faltan columnas en el manifiesto: {", ".join(missing)}')
+        for row in reader:
+            yield {
+                **{c: (row.get(c) or '').strip() for c in REQUIRED_COLUMNS},
+                'images': _split_images(row.get('images'), base),
+                'positions': json.loads(row['positions']) if row.get('positions') else None,
+            }
+
+
+def read_directory(path):
+    """Una subcarpeta por persona con person.json ({email, dni, nombres, apellidos,
+    positions opcional}) y sus fotos.
+    """
+    for folder in sorted(p for p in Path(path).iterdir() if p.is_dir()):
+        info_path = folder / 'person.json'
+        if not info_path.exists():
+            continue
+        with open(info_path, encoding='utf-8') as fh:
+            info = json.load(fh)
+        yield {
+            **{c: str(info.get(c) or '').strip() for c in REQUIRED_COLUMNS},
+            'images': [str(p) for p in sorted(folder.iterdir()) if p.suffix.lower() in IMAGE_SUFFIXES],
+            'positions': info.get('positions'),
+        }
+
+
+class Checkpoint:
+    """Archivo de texto con una línea `email<TAB>estado` por persona procesada.
+    Se escribe después de cada transacción, así una ejecución interrumpida continúa
+    desde el primer lote no confirmado. Solo los estados `ok:` cuentan como hechos;
+    los errores quedan como reporte y se reintentan en la siguiente ejecución.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    email, _, status = line.rstrip('\n').partition('\t')
+                    if status.startswith('ok:'):
+                        self.done.add(email)
+
+    def record(self, outcomes):
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            for email, status in outcomes:
+                fh.write(f'{email}\t{status}\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.done.update(email for email, status in outcomes if status.startswith('ok:'))
+
+
+class Command(BaseCommand):
+    help = (
+        'Enrolamiento masivo desde un export de fotos (CSV o directorio): codifica en un pool '
+        'de procesos, escribe con bulk_create/bulk_update por lotes transaccionales y puede '
+        'reanudarse con un archivo de checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--manifest', help='CSV: email,dni,nombres,apellidos,images[,positions].')
+        source.add_argument('--directory', help='Directorio con una subcarpeta (person.json + fotos) por persona.')
+        parser.add_argument('--checkpoint', default=None, help='Archivo de checkpoint (por defecto <fuente>.checkpoint).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=200, help='Personas por transacción.')
+        parser.add_argument('--position', default=None,
+                            help='Posición JSON para muestras sin positions (las fotos de RR.HH. no traen pose). '
+                                 'Obligatoria si la fuente no trae positions.')
+        parser.add_argument('--max-side', type=int, default=None, help='Lado máximo de detección (por defecto FACIAL_DETECT_MAX_SIDE).')
+
+    def handle(self, *args, **options):
+        source = options['manifest'] or options['directory']
+        people = list(read_manifest(source) if options['manifest'] else read_directory(source))
+        checkpoint = Checkpoint(options['checkpoint'] or f'{source.rstrip(os.sep)}.checkpoint')
+        default_position = json.loads(options['position']) if options['position'] else None
+        max_side = options['max_side'] if options['max_side'] is not None else getattr(settings, 'FACIAL_DETECT_MAX_SIDE', 0)
+
+        pending, skipped = [], 0
+        seen = set()
+        for person in people:
+            person['email'] = Usuario.objects.normalize_email(person['email'])
+            if person['email'] in checkpoint.done:
+                skipped += 1
+                continue
+            if person['email'] in seen:
+                self.stderr.write(f"{person['email']}: repetido en la fuente, se usa la primera fila")
+                continue
+            seen.add(person['email'])
+            pending.append(person)
+        self.stdout.write(f'{len(people)} personas en la fuente, {skipped} ya en el checkpoint, {len(pending)} por procesar')
+        if not pending:
+            return
+        if default_position is None and not any(person.get('positions') for person in pending):
+            raise CommandError(
+                'La fuente no trae positions: indique --position con la pose de las fotos '
+                '(sin posición registrada el login facial no aceptaría a estos usuarios)'
+            )
+
+        chunk_size = max(options['chunk_size'], 1)
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        totals = {'created': 0, 'updated': 0, 'failed': 0, 'images': 0}
+        self.signature = encoder_signature(max_side)
+        self.archive = get_frame_archive()
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(
+            max_workers=max(options['workers'], 1),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_worker,
+        ) as executor:
+            submit = lambda chunk: [executor.submit(encode_image_files, p['images'], max_side) for p in chunk]
+            futures = submit(chunks[0])
+            for index, chunk in enumerate(chunks):
+                encoded = [f.result() for f in futures]
+                # El pool codifica el lote siguiente mientras este se escribe en la BD
+                if index + 1 < len(chunks):
+                    futures = submit(chunks[index + 1])
+                outcomes = self._write_chunk(chunk, encoded, default_position, totals)
+                checkpoint.record(outcomes)
+                totals['images'] += sum(len(p['images']) for p in chunk)
+                elapsed = time.perf_counter() - started
+                done = sum(len(c) for c in chunks[:index + 1])
+                self.stdout.write(f'lote {index + 1}/{len(chunks)}: {done} personas, {done / elapsed:.1f} personas/s')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Enrolamiento terminado en {elapsed:.1f}s: creados={totals['created']} actualizados={totals['updated']} "
+            f"fallidos={totals['failed']}  {len(pending) / elapsed:.1f} personas/s, {totals['images'] / elapsed:.1f} imágenes/s"
+        ))
+
+    def _write_chunk(self, chunk, encoded, default_position, totals):
+        """Crea/actualiza los usuarios del lote en una transacción; devuelve [(email, estado)]."""
+        outcomes = []
+        ready = []
+        for person, embeddings in zip(chunk, encoded):
+            missing = [c for c in REQUIRED_COLUMNS if not person[c]]
+            valid = [(i, emb) for i, emb in enumerate(embeddings) if emb is not None]
+            if missing:
+                outcomes.append((person['email'], f'error:faltan {",".join(missing)}'))
+            elif not valid:
+                outcomes.append((person['email'], 'error:sin rostro'))
+            else:
+                ready.append((person, valid))
+
+        with transaction.atomic():
+            emails = [p['email'] for p, _ in ready]
+            existing = (Usuario.objects.filter(email__in=emails)
+                        .only('id', 'email', 'dni', 'positions', 'position_data', 'embeddings_version').in_bulk(field_name='email'))
+            dni_owner = dict(Usuario.objects.filter(dni__in=[p['dni'] for p, _ in ready]).values_list('dni', 'email'))
+            to_create, to_update = [], []
+            for person, valid in ready:
+                owner = dni_owner.get(person['dni'])
+                if owner is not None and owner != person['email']:
+                    outcomes.append((person['email'], f'error:dni en uso por {owner}'))
+                    continue
+                positions = self._positions(person.get('positions'), valid, default_position)
+                user = existing.get(person['email']) or Usuario(email=person['email'])
+                # Sin ninguna posición registrada el login facial siempre la rechazaría
+                if not positions and not user.positions:
+                    outcomes.append((person['email'], 'error:sin positions (use --position)'))
+                    continue
+                dni_owner[person['dni']] = person['email']
+                matrix = np.stack([emb for _, emb in valid]).astype(np.float32)
+                user.dni = person['dni']
+                user.nombres = person['nombres']
+                user.apellidos = person['apellidos']
+                user.facial_data = matrix[0].tobytes()
+                user.facial_embeddings_bin = pack_embeddings(matrix)
+                user.facial_embeddings = []
+                # Sin posiciones nuevas, un usuario existente conserva las registradas
+                if positions or user.pk is None:
+                    user.positions = positions
+                    user.position_data = positions[0] if positions else None
+                user.failed_attempts = 0
+                user.embedding_encoder = self.signature
+                user.embeddings_version += 1
+                user.refresh_enrollment_summary()
+                user.enrollment_frames = self._archive(person, valid, default_position)
+                if user.pk is None:
+                    user.set_unusable_password()
+                    to_create.append(user)
+                else:
+                    to_update.append(user)
+                outcomes.append((person['email'], f'ok:{len(valid)}'))
+            Usuario.objects.bulk_create(to_create, batch_size=500)
+            Usuario.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=500)
+
+        # bulk_* no emite post_save: se invalidan a mano las galerías cacheadas y las filas del índice
+        for user in to_update:
+            invalidate_gallery(user.pk)
+        pks = [user.pk for user in to_create + to_update]
+        # Sin pks tras bulk_create (p.ej. MySQL) el índice se reconstruye entero
+        update_index_users(None if None in pks else pks)
+        failed = [o for o in outcomes if o[1].startswith('error')]
+        for email, status in failed:
+            self.stderr.write(f'{email}: {status[6:]}')
+        totals['created'] += len(to_create)
+        totals['updated'] += len(to_update)
+        totals['failed'] += len(failed)
+        return outcomes
+
+    def _archive(self, person, valid, default_position):
+        """Archiva las fotos con rostro (si FACIAL_FRAME_ARCHIVE_DIR está configurado)."""
+        if self.archive is None:
+            return []
+        entries = []
+        for i, emb in valid:
+            # Misma posición que se registró para la muestra (ver _positions)
+            position = (self._positions(person.get('positions'), [(i, emb)], default_position) or [None])[0]
+            with open(person['images'][i], 'rb') as fh:
+                entries.append({'frame': self.archive.store(fh.read()), 'position': position})
+        return entries
+
+    @staticmethod
+    def _positions(positions, valid, default_position):
+        """Posición de cada muestra válida: la del manifiesto (alineada con images) o la por defecto."""
+        result = []
+        for i, _ in valid:
+            if isinstance(positions, list) and i < len(positions) and positions[i]:
+                result.append(positions[i])
+            elif default_position is not None:
+                result.append(default_position)
+        return result
@@ -0,0 +1,163 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from login.bench.synthetic import random_embeddings
+from login.services.embeddings import build_gallery, min_distance, pack_embeddings, unpack_embeddings
+from login.services.index import EmbeddingIndex
+from login.services.quantize import MODES, quantize
+
+
+def _galleries_from_db(limit):
+    """(probes, galerías) de usuarios con >= 2 muestras: la primera hace de frame vivo."""
+    from login.models.models import Usuario
+
+    probes, galleries = [], []
+    queryset = Usuario.objects.only('id', 'facial_embeddings_bin', 'facial_embeddings').order_by('pk')
+    for user in queryset.iterator(chunk_size=2000):
+        matrix = build_gallery(user, 'float32')
+        if matrix is None or len(matrix) < 2:
+            continue
+        probes.append(matrix[0])
+        galleries.append(matrix[1:])
+        if len(probes) >= limit:
+            break
+    return probes, galleries
+
+
+def _galleries_synthetic(identities, samples, seed):
+    matrix, _ = random_embeddings(identities, samples + 1, seed=seed)
+    blocks = matrix.reshape(identities, samples + 1, -1)
+    return list(blocks[:, 0]), list(blocks[:, 1:])
+
+
+def _stats(values):
+    arr = np.asarray(values, dtype=np.float64)
+    return {
+        'mean': round(float(arr.mean()), 5),
+        'p5': round(float(np.percentile(arr, 5)), 5),
+        'p50': round(float(np.percentile(arr, 50)), 5),
+        'p95': round(float(np.percentile(arr, 95)), 5),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cuánto cambian las distancias de coincidencia y no coincidencia al guardar y comparar '
+        'embeddings en float16 o int8 frente a float32, y recomienda FACIAL_QUANT_THRESHOLD_OFFSET. '
+        'Usa las galerías de la BD (usuarios con >= 2 muestras) o embeddings sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=('auto', 'db', 'synthetic'), default='auto',
+                            help='auto: la BD si tiene al menos 20 usuarios con >= 2 muestras.')
+        parser.add_argument('--identities', type=int, default=1000, help='Identidades (máximo en la BD).')
+        parser.add_argument('--samples', type=int, default=5, help='Muestras registradas por identidad sintética.')
+        parser.add_argument('--pairs', type=int, default=20000, help='Pares de no coincidencia muestreados.')
+        parser.add_argument('--thresholds', default='0.45,0.55,0.6', help='Umbrales a evaluar (coma).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help='Escribe resultados en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        thresholds = [float(t) for t in options['thresholds'].split(',') if t.strip()]
+        source = options['source']
+        probes, galleries = [], []
+        if source in ('auto', 'db'):
+            probes, galleries = _galleries_from_db(options['identities'])
+            if source == 'db' and len(probes) < 2:
+                raise CommandError('La BD no tiene al menos 2 usuarios con 2 o más muestras')
+            if len(probes) < 20:
+                probes, galleries = [], []
+        if not probes:
+            source = 'synthetic'
+            probes, galleries = _galleries_synthetic(options['identities'], options['samples'], options['seed'])
+        else:
+            source = 'db'
+        n = len(probes)
+        rng = np.random.default_rng(options['seed'])
+        owners = rng.integers(0, n, size=options['pairs'])
+        others = (owners + rng.integers(1, n, size=options['pairs'])) % n
+
+        # Referencia float32 y cada modo pasando por el formato empaquetado, como en producción
+        results = {}
+        reference = None
+        for mode in MODES:
+            stored = [quantize(unpack_embeddings(pack_embeddings(g, mode)).astype(np.float32), mode) for g in galleries]
+            blob_bytes = np.mean([len(pack_embeddings(g, mode)) / len(g) for g in galleries])
+            match = np.array([min_distance(stored[i], probes[i]) for i in range(n)])
+            nonmatch = np.array([min_distance(stored[j], probes[i]) for i, j in zip(owners, others)])
+            top1, search_s = self._rank1(galleries, probes, mode)
+            if reference is None:
+                reference = {'match': match, 'nonmatch': nonmatch, 'top1': top1}
+            results[mode] = self._compare(mode, match, nonmatch, top1, reference, thresholds, blob_bytes)
+            results[mode]['index_search_ms'] = round(search_s * 1000, 3)
+
+        self.stdout.write(f'Fuente: {source}, {n} identidades, {len(owners)} pares de no coincidencia')
+        for mode, res in results.items():
+            self.stdout.write(
+                f"{mode:<8} bytes/muestra={res['bytes_per_sample']:7.1f}  "
+                f"Δ coincidencia media={res['match_shift']['mean']:+.5f} p95|Δ|={res['match_abs_shift_p95']:.5f}  "
+                f"Δ no coincidencia media={res['nonmatch_shift']['mean']:+.5f}  "
+                f"top-1 1:N igual={res['rank1_agreement'] * 100:.2f}% ({res['index_search_ms']:.2f}ms)  offset sugerido={res['suggested_offset']:+.4f}"
+            )
+            for thr in res['thresholds']:
+                self.stdout.write(
+                    f"         thr={thr['threshold']:.2f}  FRR={thr['frr'] * 100:6.2f}%  FAR={thr['far'] * 100:6.3f}%  "
+                    f"decisiones distintas a float32={thr['flips']} (con offset: {thr['flips_with_offset']})"
+                )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as fh:
+                json.dump({'source': source, 'identities': n, 'pairs': len(owners), 'modes': results}, fh, indent=2)
+
+    @staticmethod
+    def _rank1(galleries, probes, mode):
+        """Usuario top-1 del índice 1:N (escala int8 común a todo el índice) para cada probe
+        y la mediana del tiempo por búsqueda.
+        """
+        matrix = np.vstack(galleries).astype(np.float32)
+        ids = np.repeat(np.arange(len(galleries)), [len(g) for g in galleries]).astype(np.int64)
+        index = EmbeddingIndex.from_matrix(matrix, ids, mode)
+        top1, timings = [], []
+        for probe in probes:
+            started = time.perf_counter()
+            top1.append(index.search(probe, k=1)[0][0])
+            timings.append(time.perf_counter() - started)
+        return np.array(top1), float(np.median(timings))
+
+    @staticmethod
+    def _compare(mode, match, nonmatch, top1, reference, thresholds, blob_bytes):
+        d_match = match - reference['match']
+        d_nonmatch = nonmatch - reference['nonmatch']
+        # El offset se estima con los pares cercanos a los umbrales, donde importan las decisiones
+        ref_all = np.concatenate([reference['match'], reference['nonmatch']])
+        deltas = np.concatenate([d_match, d_nonmatch])
+        near = np.zeros(len(ref_all), dtype=bool)
+        for thr in thresholds:
+            near |= np.abs(ref_all - thr) < 0.05
+        offset = float(np.median(deltas[near] if near.any() else deltas)) if mode != 'float32' else 0.0
+        per_threshold = []
+        for thr in thresholds:
+            accept_ref = ref_all < thr
+            accept = np.concatenate([match, nonmatch]) < thr
+            accept_offset = np.concatenate([match, nonmatch]) < thr + offset
+            per_threshold.append({
+                'threshold': thr,
+                'frr': float((match >= thr).mean()),
+                'far': float((nonmatch < thr).mean()),
+                'flips': int((accept != accept_ref).sum()),
+                'flips_with_offset': int((accept_offset != accept_ref).sum()),
+            })
+        return {
+            'bytes_per_sample': float(blob_bytes),
+            'match_shift': _stats(d_match),
+            'nonmatch_shift': _stats(d_nonmatch),
+            'match_abs_shift_p95': round(float(np.percentile(np.abs(d_match), 95)), 5),
+            'match': _stats(match),
+            'nonmatch': _stats(nonmatch),
+            'rank1_agreement': float((top1 == reference['top1']).mean()),
+            'suggested_offset': round(offset, 4) + 0.0,
+            'thresholds': per_threshold,
+        }
@@ -0,0 +1,350 @@
+import asyncio
+import contextlib
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from login.bench.synthetic import (
+    background_image,
+    jittered_jpeg,
+    seed_users,
+    summarize,
+    synthetic_image,
+    temporary_database,
+    to_data_url,
+)
+from login.services.admission import reset_admission
+
+
+KINDS = ('valid', 'noface', 'mismatch')
+ENDPOINTS = ('login', 'encode')
+# Ruta de cada endpoint según el destino (asgi usa las vistas async)
+PATHS = {'client': '/api/{}/', 'asgi': '/api/async/{}/', 'http': '/api/{}/'}
+USER_PREFIX = 'loadtest'
+
+
+def _parse_mix(text):
+    """'valid=70,noface=15,mismatch=15' -> probabilidades en el orden de KINDS."""
+    weights = dict.fromkeys(KINDS, 0.0)
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        kind, _, value = part.partition('=')
+        if kind.strip() not in weights:
+            raise CommandError(f'Tipo de tráfico desconocido en --mix: {kind!r} (válidos: {", ".join(KINDS)})')
+        weights[kind.strip()] = float(value)
+    total = sum(weights.values())
+    if total <= 0:
+        raise CommandError('--mix debe tener algún peso positivo')
+    return np.array([weights[k] / total for k in KINDS])
+
+
+class _HttpTransport:
+    """Peticiones HTTP contra el servidor de `url`: una conexión nueva por petición o,
+    con keepalive, una persistente por hilo. El runserver de Django responde en varias
+    escrituras y con keep-alive cada petición espera ~40 ms de ACK retardado, que no
+    es costo de la aplicación.
+    """
+
+    def __init__(self, url, timeout, keepalive=False):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise CommandError(f'--url debe ser http(s)://host:puerto, no {url!r}')
+        self._cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._base = parts.path.rstrip('/')
+        self._timeout = timeout
+        self._keepalive = keepalive
+        self._local = threading.local()
+
+    def post(self, path, body):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._cls(self._netloc, timeout=self._timeout)
+        try:
+            conn.request('POST', self._base + path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if not self._keepalive:
+                conn.close()
+                self._local.conn = None
+            return response.status
+        except (OSError, http.client.HTTPException):
+            # La conexión no se reutiliza tras un error; la petición cuenta como error de transporte
+            conn.close()
+            self._local.conn = None
+            return 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga de /api/login/ y /api/encode/: registra N usuarios sintéticos y envía '
+        'tráfico concurrente que mezcla frames válidos, sin rostro y de otro usuario. Reporta '
+        'throughput, percentiles de latencia y tasas de error por endpoint para cada nivel de '
+        'concurrencia. Destinos: el cliente de pruebas de Django (client), la aplicación ASGI '
+        'en proceso (asgi) o un servidor en marcha (--url). Sin servicios externos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=('client', 'asgi', 'http'), default='client',
+                            help='client: vistas síncronas en hilos; asgi: vistas async; http: servidor en --url.')
+        parser.add_argument('--url', default=None, help='Servidor para --target http (p.ej. http://127.0.0.1:8000).')
+        parser.add_argument('--users', type=int, default=20, help='Usuarios sintéticos a registrar.')
+        parser.add_argument('--requests', type=int, default=200, help='Peticiones medidas por nivel de concurrencia.')
+        parser.add_argument('--concurrency', default='1,4,16',
+                            help='Niveles de concurrencia separados por coma; cada uno es una corrida.')
+        parser.add_argument('--warmup', type=int, default=10, help='Peticiones previas sin medir (pool, modelos, cachés).')
+        parser.add_argument('--encode-share', type=float, default=0.3, help='Fracción del tráfico a /api/encode/.')
+        parser.add_argument('--mix', default='valid=70,noface=15,mismatch=15',
+                            help='Pesos del tráfico: valid, noface (fondo sin rostro), mismatch (frame de otro usuario).')
+        parser.add_argument('--repeat-frames', action='store_true',
+                            help='Reutiliza el mismo frame por usuario (mide la caché de frames); '
+                                 'por defecto cada petición lleva un frame distinto.')
+        parser.add_argument('--keep-rate-limits', action='store_true',
+                            help='Mantiene las cubetas por IP/email (todo el tráfico sale de una IP).')
+        parser.add_argument('--slo-p99-ms', type=float, default=1000.0, help='p99 máximo de login para considerar un nivel sostenible.')
+        parser.add_argument('--max-error-rate', type=float, default=0.01, help='Tasa máxima de errores + rechazos (429/503).')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Tiempo máximo por petición HTTP (s).')
+        parser.add_argument('--keepalive', action='store_true',
+                            help='--target http: reutiliza una conexión por hilo (por defecto, una por petición).')
+        parser.add_argument('--keep-users', action='store_true', help='--target http: no borra los usuarios sembrados.')
+        parser.add_argument('--width', type=int, default=640)
+        parser.add_argument('--height', type=int, default=480)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help='Escribe resultados en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        target = 'http' if options['url'] else options['target']
+        if target == 'http' and not options['url']:
+            raise CommandError('--target http requiere --url')
+        try:
+            levels = [int(c) for c in options['concurrency'].split(',') if c.strip()]
+        except ValueError:
+            raise CommandError('--concurrency debe ser una lista de enteros')
+        if not levels or min(levels) < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency y --requests deben ser >= 1')
+        mix = _parse_mix(options['mix'])
+
+        with self._environment(target, options):
+            seeded = seed_users(options['users'], options['width'], options['height'], prefix=USER_PREFIX, seed=options['seed'])
+            if not seeded or (mix[KINDS.index('mismatch')] > 0 and len(seeded) < 2):
+                raise CommandError('No se pudieron generar suficientes usuarios sintéticos con rostro')
+            self.stdout.write(f'Destino: {target}  usuarios={len(seeded)}  niveles={levels}')
+            rng = np.random.default_rng(options['seed'])
+            send = self._sender(target, options)
+            if options['warmup']:
+                self._run(send, target, self._plan(seeded, options['warmup'], rng, mix, options), 1)
+            results = []
+            for concurrency in levels:
+                plan = self._plan(seeded, options['requests'], rng, mix, options)
+                outcomes, elapsed = self._run(send, target, plan, concurrency)
+                level = self._report(outcomes, elapsed, concurrency)
+                results.append(level)
+                self._print_level(level)
+
+        sustainable = self._sustainable(results, options['slo_p99_ms'], options['max_error_rate'])
+        if sustainable is None:
+            self.stdout.write(self.style.WARNING(
+                f"Ningún nivel cumple p99 de login <= {options['slo_p99_ms']:.0f}ms con errores <= {options['max_error_rate']:.1%}"
+            ))
+        else:
+            login = sustainable['endpoints'].get('login', {})
+            self.stdout.write(self.style.SUCCESS(
+                f"Capacidad sostenida: {login.get('throughput_rps', 0):.1f} logins/s "
+                f"({sustainable['throughput_rps']:.1f} req/s en total) con concurrencia {sustainable['concurrency']} "
+                f"(p99 login={login.get('latency', {}).get('p99_ms')}ms)"
+            ))
+        if options['json_path']:
+            keys = ('target', 'url', 'users', 'requests', 'warmup', 'encode_share', 'mix', 'repeat_frames', 'keepalive',
+                    'keep_rate_limits', 'slo_p99_ms', 'max_error_rate', 'width', 'height', 'seed')
+            with open(options['json_path'], 'w', encoding='utf-8') as fh:
+                json.dump({
+                    'options': {**{k: options[k] for k in keys}, 'target': target, 'concurrency': levels},
+                    'levels': results,
+                    'sustainable_concurrency': sustainable['concurrency'] if sustainable else None,
+                }, fh, indent=2)
+
+    @contextlib.contextmanager
+    def _environment(self, target, options):
+        """BD temporal para los destinos en proceso; para http, la BD configurada (la del
+        servidor) con los usuarios sembrados borrados al terminar.
+        """
+        if target == 'http':
+            from login.models.models import Usuario
+
+            seeded = Usuario.objects.filter(email__startswith=USER_PREFIX, email__endswith='@example.invalid')
+            seeded.delete()
+            self.stdout.write('Aviso: las cubetas por IP/email del servidor siguen activas '
+                              '(arránquelo con FACIAL_RATE_IP_BURST=0 FACIAL_RATE_EMAIL_BURST=0 para medir capacidad).')
+            try:
+                yield
+            finally:
+                if not options['keep_users']:
+                    seeded.delete()
+            return
+        overrides = {} if options['keep_rate_limits'] else {'FACIAL_RATE_IP_BURST': 0, 'FACIAL_RATE_EMAIL_BURST': 0}
+        with temporary_database(), override_settings(**overrides):
+            reset_admission()
+            try:
+                yield
+            finally:
+                reset_admission()
+
+    def _plan(self, seeded, count, rng, mix, options):
+        """Lista de (endpoint, tipo, cuerpo JSON) con frames pre-codificados (no se miden)."""
+        width, height = options['width'], options['height']
+        plan = []
+        for n in range(count):
+            endpoint = 'encode' if rng.random() < options['encode_share'] else 'login'
+            kind = KINDS[int(rng.choice(len(KINDS), p=mix))]
+            if endpoint == 'encode' and kind == 'mismatch':
+                # /api/encode/ no conoce al usuario: un frame ajeno es un frame válido
+                kind = 'valid'
+            owner = int(rng.integers(len(seeded)))
+            user = seeded[owner]
+            if kind == 'valid':
+                source = user
+            elif kind == 'mismatch':
+                source = seeded[(owner + int(rng.integers(1, len(seeded)))) % len(seeded)]
+            else:
+                source = None
+            if source is not None and options['repeat_frames']:
+                frame = source['frame']
+            elif source is not None:
+                frame = to_data_url(jittered_jpeg(synthetic_image(source['seed'], width, height), int(rng.integers(2**31))))
+            else:
+                frame_seed = int(rng.integers(8)) if options['repeat_frames'] else int(rng.integers(2**31))
+                frame = to_data_url(jittered_jpeg(background_image(frame_seed, width, height), frame_seed))
+            body = {'facial_frame': frame}
+            if endpoint == 'login':
+                body.update(email=user['email'], position_data=user['position'])
+            plan.append((endpoint, kind, json.dumps(body)))
+        return plan
+
+    def _sender(self, target, options):
+        if target == 'http':
+            transport = _HttpTransport(options['url'], options['timeout'], options['keepalive'])
+            return transport.post
+        if target == 'client':
+            def send(path, body):
+                # Cliente nuevo por petición: cada login abre su propia sesión
+                return Client().post(path, body, content_type='application/json').status_code
+            return send
+
+        async def asend(path, body):
+            response = await AsyncClient().post(path, body, content_type='application/json')
+            return response.status_code
+        return asend
+
+    def _run(self, send, target, plan, concurrency):
+        """Ejecuta el plan con `concurrency` peticiones en curso; devuelve
+        ([(endpoint, tipo, estado, segundos)], segundos totales).
+        """
+        path = PATHS[target]
+
+        def call(item):
+            endpoint, kind, body = item
+            started = time.perf_counter()
+            try:
+                status = send(path.format(endpoint), body)
+            except Exception:
+                status = 0
+            return endpoint, kind, status, time.perf_counter() - started
+
+        if target == 'asgi':
+            async def run_all():
+                limit = asyncio.Semaphore(concurrency)
+
+                async def acall(item):
+                    endpoint, kind, body = item
+                    async with limit:
+                        started = time.perf_counter()
+                        try:
+                            status = await send(path.format(endpoint), body)
+                        except Exception:
+                            status = 0
+                        return endpoint, kind, status, time.perf_counter() - started
+
+                return await asyncio.gather(*(acall(item) for item in plan))
+
+            started = time.perf_counter()
+            outcomes = asyncio.run(run_all())
+            return outcomes, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(call, plan))
+        return outcomes, time.perf_counter() - started
+
+    @staticmethod
+    def _rates(outcomes):
+        statuses = {}
+        for _, _, status, _ in outcomes:
+            key = str(status) if status else 'error'
+            statuses[key] = statuses.get(key, 0) + 1
+        total = len(outcomes) or 1
+        # Errores: 5xx (salvo 503) y fallos de transporte; rechazos: 429/503 del control de admisión
+        errors = sum(1 for _, _, s, _ in outcomes if s == 0 or (s >= 500 and s != 503))
+        shed = sum(1 for _, _, s, _ in outcomes if s in (429, 503))
+        return statuses, errors / total, shed / total
+
+    def _report(self, outcomes, elapsed, concurrency):
+        level = {
+            'concurrency': concurrency,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': len(outcomes) / elapsed if elapsed else 0.0,
+            'endpoints': {},
+        }
+        for endpoint in ENDPOINTS:
+            rows = [o for o in outcomes if o[0] == endpoint]
+            if not rows:
+                continue
+            statuses, error_rate, shed_rate = self._rates(rows)
+            level['endpoints'][endpoint] = {
+                'throughput_rps': len(rows) / elapsed if elapsed else 0.0,
+                'latency': summarize([o[3] for o in rows]),
+                'status': statuses,
+                'error_rate': round(error_rate, 4),
+                'shed_rate': round(shed_rate, 4),
+                'kinds': {
+                    kind: {'latency': summarize([o[3] for o in rows if o[1] == kind]),
+                           'status': self._rates([o for o in rows if o[1] == kind])[0]}
+                    for kind in KINDS if any(o[1] == kind for o in rows)
+                },
+            }
+        return level
+
+    def _print_level(self, level):
+        self.stdout.write(f"concurrencia={level['concurrency']}: {level['throughput_rps']:.1f} req/s en {level['elapsed_s']}s")
+        for endpoint, res in level['endpoints'].items():
+            lat = res['latency']
+            self.stdout.write(
+                f"  {endpoint:<7} {res['throughput_rps']:7.1f} req/s  p50={lat['p50_ms']}ms p90={lat['p90_ms']}ms "
+                f"p99={lat['p99_ms']}ms  errores={res['error_rate']:.1%} rechazos={res['shed_rate']:.1%}  estados={res['status']}"
+            )
+            for kind, sub in res['kinds'].items():
+                self.stdout.write(f"    {kind:<9} p50={sub['latency']['p50_ms']}ms p99={sub['latency']['p99_ms']}ms  estados={sub['status']}")
+
+    @staticmethod
+    def _sustainable(levels, slo_p99_ms, max_error_rate):
+        """Nivel de mayor throughput de login que cumple el p99 y la tasa de errores + rechazos."""
+        best = None
+        for level in levels:
+            login = level['endpoints'].get('login')
+            if login is None:
+                continue
+            if login['latency']['p99_ms'] > slo_p99_ms:
+                continue
+            if any(res['error_rate'] + res['shed_rate'] > max_error_rate for res in level['endpoints'].values()):
+                continue
+            if best is None or login['throughput_rps'] > best['endpoints']['login']['throughput_rps']:
+                best = level
+        return best
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from login.models.models import Usuario
+from login.services.embeddings import invalidate_gallery, pack_embeddings
+from login.services.encoder import _warm_worker, encode_archived_frames, encoder_signature
+from login.services.index import update_index_users
+from login.services.positions import user_positions
+
+
+# Columnas necesarias para recalcular; los blobs de embeddings no se leen
+FIELDS = ('id', 'email', 'enrollment_frames', 'positions', 'position_data', 'embedding_encoder', 'embeddings_version')
+
+
+def _row_position(entry, stored, i):
+    """Posición de la muestra i: la del frame archivado, o la registrada en la misma
+    posición (la última si hay menos), o None si el usuario no tiene ninguna.
+    """
+    if entry.get('position'):
+        return entry['position']
+    if not stored:
+        return None
+    return stored[min(i, len(stored) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los embeddings de los usuarios con el codificador actual a partir de los '
+        'frames de enrolamiento archivados (FACIAL_FRAME_ARCHIVE_DIR). Recorre la BD por '
+        'bloques, codifica en un pool de procesos y reemplaza cada usuario con un '
+        'compare-and-swap sobre embeddings_version.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=100, help='Usuarios por transacción.')
+        parser.add_argument('--max-side', type=int, default=None, help='Lado máximo de detección (por defecto FACIAL_DETECT_MAX_SIDE).')
+        parser.add_argument('--force', action='store_true',
+                            help='Recalcula también los usuarios ya codificados con el codificador actual.')
+        parser.add_argument('--dry-run', action='store_true', help='Codifica y reporta sin escribir en la BD.')
+
+    def handle(self, *args, **options):
+        root = getattr(settings, 'FACIAL_FRAME_ARCHIVE_DIR', None)
+        if not root:
+            raise CommandError('FACIAL_FRAME_ARCHIVE_DIR no está configurado: no hay frames archivados')
+        max_side = options['max_side'] if options['max_side'] is not None else getattr(settings, 'FACIAL_DETECT_MAX_SIDE', 0)
+        signature = encoder_signature(max_side)
+        chunk_size = max(options['chunk_size'], 1)
+
+        queryset = Usuario.objects.exclude(enrollment_frames=[]).order_by('pk').only(*FIELDS)
+        if not options['force']:
+            queryset = queryset.exclude(embedding_encoder=signature)
+        self.stdout.write(f'Codificador actual: {signature}')
+
+        totals = {'swapped': 0, 'conflict': 0, 'no_face': 0, 'frames': 0, 'users': 0}
+        started = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=max(options['workers'], 1),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_worker,
+        ) as executor:
+            submit = lambda chunk: [
+                executor.submit(encode_archived_frames, root, user.enrollment_frames, max_side) for user in chunk
+            ]
+            pending = None
+            for chunk in self._chunks(queryset, chunk_size):
+                futures = submit(chunk)
+                # El pool codifica este bloque mientras se escribe el anterior
+                if pending is not None:
+                    self._swap_chunk(*pending, signature, options['dry_run'], totals)
+                pending = (chunk, futures)
+            if pending is not None:
+                self._swap_chunk(*pending, signature, options['dry_run'], totals)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedding terminado en {elapsed:.1f}s: usuarios={totals['users']} reemplazados={totals['swapped']} "
+            f"conflictos={totals['conflict']} sin_rostro={totals['no_face']}  "
+            f"{totals['frames'] / elapsed if elapsed else 0:.1f} frames/s"
+            + (' (dry-run)' if options['dry_run'] else '')
+        ))
+
+    @staticmethod
+    def _chunks(queryset, chunk_size):
+        chunk = []
+        for user in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(user)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _swap_chunk(self, chunk, futures, signature, dry_run, totals):
+        """Reemplaza los embeddings del bloque; un usuario re-enrolado entretanto no se toca."""
+        swapped = []
+        with transaction.atomic():
+            for user, future in zip(chunk, futures):
+                embeddings = future.result()
+                totals['users'] += 1
+                totals['frames'] += len(embeddings)
+                valid = [(i, entry, emb) for i, (entry, emb) in enumerate(zip(user.enrollment_frames, embeddings))
+                         if emb is not None]
+                if not valid:
+                    # Se conservan los embeddings anteriores
+                    totals['no_face'] += 1
+                    self.stderr.write(f'{user.email}: ningún frame archivado produjo embedding')
+                    continue
+                if dry_run:
+                    continue
+                matrix = np.stack([emb for _, _, emb in valid]).astype(np.float32)
+                # Una posición por fila: la del frame archivado o, si no la tiene, la registrada
+                stored = user_positions(user)
+                frames = [{**entry, 'position': _row_position(entry, stored, i)} for i, entry, _ in valid]
+                positions = [entry['position'] for entry in frames if entry['position'] is not None]
+                # Compare-and-swap: solo si nadie cambió los embeddings desde que se leyó el usuario
+                fields = {
+                    'facial_data': matrix[0].tobytes(),
+                    'facial_embeddings_bin': pack_embeddings(matrix),
+                    'facial_embeddings': [],
+                    'embedding_encoder': signature,
+                    'embeddings_version': F('embeddings_version') + 1,
+                    'embedding_count': matrix.shape[0],
+                    'embedding_dims': matrix.shape[1],
+                    'enrollment_updated_at': timezone.now(),
+                    # Solo quedan los frames que produjeron embedding, alineados con las filas
+                    'enrollment_frames': frames,
+                    'positions': positions,
+                    'position_data': positions[0] if positions else None,
+                }
+                updated = Usuario.objects.filter(pk=user.pk, embeddings_version=user.embeddings_version).update(**fields)
+                if updated:
+                    swapped.append(user.pk)
+                else:
+                    totals['conflict'] += 1
+                    self.stderr.write(f'{user.email}: cambió durante el re-embedding, se omite')
+        # update() no emite post_save: se invalidan a mano las galerías cacheadas y las filas del índice
+        for pk in swapped:
+            invalidate_gallery(pk)
+        update_index_users(swapped)
+        totals['swapped'] += len(swapped)
@@ -0,0 +1,48 @@
+"""Middleware de tiempos por etapa del pipeline facial (ver services.metrics)."""
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .services import metrics
+
+
+def _finish(request, response, timings, started):
+    total = time.perf_counter() - started
+    match = getattr(request, 'resolver_match', None)
+    metrics.observe('facial_request_seconds', match.url_name if match and match.url_name else 'other', total)
+    if timings and getattr(settings, 'FACIAL_SERVER_TIMING', True):
+        timings['total'] = total
+        response['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+
+@sync_and_async_middleware
+def facial_timing_middleware(get_response):
+    """Abre el registro de tiempos de cada petición, agrega la duración total al
+    histograma por vista y devuelve las etapas en la cabecera Server-Timing.
+    Con FACIAL_METRICS_ENABLED = False no hace nada.
+    """
+    if not getattr(settings, 'FACIAL_METRICS_ENABLED', True):
+        return get_response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            token = metrics.begin()
+            try:
+                response = await get_response(request)
+            finally:
+                timings = metrics.end(token)
+            return _finish(request, response, timings, started)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            token = metrics.begin()
+            try:
+                response = get_response(request)
+            finally:
+                timings = metrics.end(token)
+            return _finish(request, response, timings, started)
+    return middleware
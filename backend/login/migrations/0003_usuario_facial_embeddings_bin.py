@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login', '0002_usuario_facial_embeddings_usuario_failed_attempts_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='facial_embeddings_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
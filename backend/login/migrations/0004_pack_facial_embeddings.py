@@ -0,0 +1,70 @@
+import struct
+
+from django.db import migrations, transaction
+
+
+CHUNK_SIZE = 500
+
+# Formato v1 de services.embeddings congelado aquí: la migración siempre escribe float32
+# sin pérdida, sin depender de FACIAL_EMBEDDING_DTYPE ni de cambios futuros del módulo
+_HEADER = struct.Struct('<4sBBHI4x')  # magic, versión, dtype (0 = float32), dims, muestras
+
+
+def pack_float32(matrix):
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    count, dims = matrix.shape
+    return _HEADER.pack(b'FEMB', 1, 0, dims, count) + matrix.astype('<f4').tobytes()
+
+
+def pack_existing(apps, schema_editor):
+    """Empaqueta facial_embeddings (JSON) o facial_data (un embedding) por bloques."""
+    # Importado aquí: el grafo de migraciones se carga en cada migrate/runserver
+    import numpy as np
+
+    Usuario = apps.get_model('login', 'Usuario')
+    pending = (
+        Usuario.objects.using(schema_editor.connection.alias)
+        .filter(facial_embeddings_bin__isnull=True)
+        .only('id', 'facial_embeddings', 'facial_data')
+        .order_by('pk')
+    )
+    last_pk = 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        packed = []
+        for user in chunk:
+            if user.facial_embeddings:
+                try:
+                    matrix = np.array(user.facial_embeddings, dtype=np.float32)
+                except ValueError:
+                    # Muestras de longitud distinta: no se pueden apilar, se dejan en JSON
+                    continue
+            elif user.facial_data:
+                matrix = np.frombuffer(bytes(user.facial_data), dtype=np.float32)
+            else:
+                continue
+            user.facial_embeddings_bin = pack_float32(matrix)
+            packed.append(user)
+        if packed:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                Usuario.objects.using(schema_editor.connection.alias).bulk_update(
+                    packed, ['facial_embeddings_bin'], batch_size=CHUNK_SIZE
+                )
+
+
+class Migration(migrations.Migration):
+
+    # Cada bloque se confirma por separado para no bloquear la tabla completa
+    atomic = False
+
+    dependencies = [
+        ('login', '0003_usuario_facial_embeddings_bin'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login', '0004_pack_facial_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='embedding_encoder',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='embeddings_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='enrollment_frames',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
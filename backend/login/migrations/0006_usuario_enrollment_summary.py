@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('login', '0005_usuario_enrollment_frames'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentSummary',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'resumen de enrolamiento',
+                'verbose_name_plural': 'resúmenes de enrolamiento',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('login.usuario',),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='embedding_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='embedding_dims',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='enrollment_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['apellidos'], name='usuario_apellidos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['nombres'], name='usuario_nombres_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+import struct
+
+from django.db import migrations, transaction
+
+
+CHUNK_SIZE = 500
+
+# Cabecera v1 de services.embeddings congelada aquí (como en 0004): la migración no
+# depende de cambios futuros del formato ni del módulo
+_HEADER = struct.Struct('<4sBBHI4x')  # magic, versión, dtype, dims, muestras
+
+
+def embeddings_shape(blob=None, legacy=None, single=None):
+    """(muestras, dims) leyendo solo la cabecera del blob; si no hay blob, de la lista
+    JSON legada o del embedding único (float32).
+    """
+    if blob and len(blob) >= _HEADER.size:
+        magic, version, _code, dims, count = _HEADER.unpack_from(memoryview(blob))
+        if magic == b'FEMB' and version == 1:
+            return count, dims
+    if legacy:
+        return len(legacy), len(legacy[0]) if isinstance(legacy[0], (list, tuple)) else 0
+    if single:
+        return 1, len(single) // 4
+    return 0, 0
+
+
+def fill_summary(apps, schema_editor):
+    """Calcula embedding_count y embedding_dims de las filas existentes por bloques.
+    enrollment_updated_at queda vacío: no se sabe cuándo se enroló cada usuario.
+    """
+    Usuario = apps.get_model('login', 'Usuario')
+    pending = (
+        Usuario.objects.using(schema_editor.connection.alias)
+        .only('id', 'facial_embeddings_bin', 'facial_embeddings', 'facial_data')
+        .order_by('pk')
+    )
+    last_pk = 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        filled = []
+        for user in chunk:
+            shape = embeddings_shape(user.facial_embeddings_bin, user.facial_embeddings, user.facial_data)
+            if shape != (0, 0):
+                user.embedding_count, user.embedding_dims = shape
+                filled.append(user)
+        if filled:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                Usuario.objects.using(schema_editor.connection.alias).bulk_update(
+                    filled, ['embedding_count', 'embedding_dims'], batch_size=CHUNK_SIZE
+                )
+
+
+class Migration(migrations.Migration):
+
+    # Cada bloque se confirma por separado para no bloquear la tabla completa
+    atomic = False
+
+    dependencies = [
+        ('login', '0006_usuario_enrollment_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,3 @@
 
-from .models import Usuario  # re-export
+from .models import EnrollmentSummary, Usuario  # re-export
 
@@ -1,3 +1,5 @@
+import copy
+
 from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser,
@@ -6,6 +8,8 @@ from django.contrib.auth.models import (
 )
 from django.utils import timezone
 
+from ..services.embeddings import embeddings_shape
+
 
 class UsuarioManager(BaseUserManager):
     """Manager para el modelo de usuario personalizado basado en email."""
@@ -46,6 +50,10 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     Usuario autenticable por reconocimiento facial.
     - facial_data: embeddings/encoding facial en binario (ej. numpy.ndarray.tobytes())
     - position_data: JSON con coordenadas 3D relativas (ej. puntos clave de FaceMesh)
+    - facial_embeddings_bin: todas las muestras empaquetadas en binario (reemplaza a facial_embeddings)
+    - enrollment_frames: referencias a los frames de enrolamiento archivados (re-embedding)
+    - embedding_count / embedding_dims / enrollment_updated_at: resumen del enrolamiento,
+      mantenido en save() para listarlo sin leer los blobs
     """
 
     nombres = models.CharField(max_length=150)
@@ -58,9 +66,24 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     position_data = models.JSONField(null=True, blank=True)
 
     # Nuevos campos: múltiples muestras para reducir falsos negativos/positivos
-    facial_embeddings = models.JSONField(default=list, blank=True)
+    facial_embeddings = models.JSONField(default=list, blank=True)  # legado (JSON)
     positions = models.JSONField(default=list, blank=True)
 
+    # Embeddings empaquetados (cabecera versionada + float32), ver services.embeddings
+    facial_embeddings_bin = models.BinaryField(null=True, blank=True, editable=False)
+    # Codificador (y parámetros) con que se calcularon los embeddings, ver encoder.encoder_signature
+    embedding_encoder = models.CharField(max_length=64, blank=True, default='')
+    # Se incrementa al guardar embeddings o posiciones (ver save); es parte de la clave de la
+    # caché compartida de embeddings y el compare-and-swap de reembed_users
+    embeddings_version = models.PositiveIntegerField(default=0, editable=False)
+    # Frames de enrolamiento archivados ([{frame: digest, position: {...}}], ver services.frame_archive)
+    enrollment_frames = models.JSONField(default=list, blank=True, editable=False)
+    # Resumen barato del enrolamiento (ver refresh_enrollment_summary): muestras, dimensiones
+    # y fecha del último cambio biométrico
+    embedding_count = models.PositiveIntegerField(default=0, editable=False)
+    embedding_dims = models.PositiveSmallIntegerField(default=0, editable=False)
+    enrollment_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+
     failed_attempts = models.IntegerField(default=0)
 
     is_active = models.BooleanField(default=True)
@@ -72,6 +95,100 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["dni", "nombres", "apellidos"]
 
+    # Campos biométricos: cambiar cualquiera incrementa embeddings_version
+    VERSIONED_FIELDS = frozenset({
+        "facial_embeddings_bin", "facial_embeddings", "facial_data", "positions", "position_data",
+    })
+    # Campos cuyo cambio se detecta comparando con los valores leídos de la BD (ver from_db)
+    TRACKED_FIELDS = VERSIONED_FIELDS | {"is_active"}
+    # Se recalculan junto con embeddings_version
+    SUMMARY_FIELDS = ("embedding_count", "embedding_dims", "enrollment_updated_at")
+
+    class Meta:
+        # Búsqueda por prefijo del admin (^apellidos, ^nombres) en MySQL/SQLite; dni ya es único
+        indexes = [
+            models.Index(fields=["apellidos"], name="usuario_apellidos_idx"),
+            models.Index(fields=["nombres"], name="usuario_nombres_idx"),
+        ]
+
     def __str__(self):
         return f"{self.nombres} {self.apellidos} <{self.email}>"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded(
+            (name, value) for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS
+        )
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # También lo usan los campos diferidos al cargarse
+        super().refresh_from_db(using, fields, from_queryset)
+        names = self.TRACKED_FIELDS if fields is None else self.TRACKED_FIELDS.intersection(fields)
+        deferred = self.get_deferred_fields()
+        self._remember_loaded((name, getattr(self, name)) for name in names if name not in deferred)
+
+    def _remember_loaded(self, items):
+        # Copia: las listas JSON podrían modificarse en el lugar antes de save()
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        for name, value in items:
+            loaded[name] = bytes(value) if isinstance(value, memoryview) else copy.deepcopy(value)
+
+    def changed_fields(self, candidates=None):
+        """Campos de TRACKED_FIELDS (o de `candidates`) cuyo valor difiere del leído de la BD.
+        En un usuario nuevo, los campos biométricos con valor. Un campo cargado que no
+        se leyó a través de from_db/refresh_from_db cuenta como cambiado.
+        """
+        names = self.TRACKED_FIELDS if candidates is None else self.TRACKED_FIELDS.intersection(candidates)
+        deferred = self.get_deferred_fields()
+        loaded = self.__dict__.get("_loaded_values", {})
+        changed = set()
+        for name in names:
+            if name in deferred:
+                continue
+            value = getattr(self, name)
+            if self._state.adding:
+                if name in self.VERSIONED_FIELDS and value:
+                    changed.add(name)
+            elif name not in loaded or value != loaded[name]:
+                changed.add(name)
+        return changed
+
+    def refresh_enrollment_summary(self):
+        """Recalcula muestras y dimensiones (solo la cabecera del blob) y la fecha de cambio
+        (None sin muestras). Para escrituras que no pasan por save() (bulk_create/bulk_update).
+        """
+        self.embedding_count, self.embedding_dims = embeddings_shape(
+            self.facial_embeddings_bin, self.facial_embeddings, self.facial_data,
+        )
+        self.enrollment_updated_at = timezone.now() if self.embedding_count else None
+
+    def save(self, *args, **kwargs):
+        # Solo un cambio real de campos biométricos publica una nueva versión: editar el
+        # nombre en el admin o crear un usuario sin muestras no invalida cachés ni el índice.
+        # Los receptores de post_save leen los cambios en _saved_changes.
+        update_fields = kwargs.get("update_fields")
+        changed = self.changed_fields(update_fields)
+        if self.VERSIONED_FIELDS.intersection(changed):
+            self.embeddings_version = (self.embeddings_version or 0) + 1
+            self.refresh_enrollment_summary()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "embeddings_version", *self.SUMMARY_FIELDS}
+        self._saved_changes = changed
+        super().save(*args, **kwargs)
+        deferred = self.get_deferred_fields()
+        self._remember_loaded(
+            (name, getattr(self, name)) for name in self.TRACKED_FIELDS.intersection(update_fields or self.TRACKED_FIELDS)
+            if name not in deferred
+        )
+
+
+class EnrollmentSummary(Usuario):
+    """Vista de solo lectura del enrolamiento en el admin (ver admin.EnrollmentSummaryAdmin)."""
+
+    class Meta:
+        proxy = True
+        verbose_name = "resumen de enrolamiento"
+        verbose_name_plural = "resúmenes de enrolamiento"
+
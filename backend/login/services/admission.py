@@ -0,0 +1,352 @@
+"""Control de admisión para las vistas que codifican rostros.
+
+Una ráfaga de logins encolaba decenas de codificaciones detrás de otras hasta
+que todas vencían. Aquí, por proceso:
+
+- Un límite de peticiones pesadas en curso (FACIAL_ADMISSION_MAX_CONCURRENT)
+  con una cola corta (FACIAL_ADMISSION_QUEUE) y un plazo de espera
+  (FACIAL_ADMISSION_WAIT): sin cupo a tiempo se responde 503 con Retry-After
+  de inmediato, en lugar de aceptar trabajo que no llegará a terminar.
+- Cubetas de tokens por IP y por email: cada petición gasta un token por frame
+  y las cubetas se rellenan a ritmo constante, de modo que un solo cliente no
+  agota la CPU. Sin tokens se responde 429 con el tiempo hasta el siguiente.
+
+Se aplica con el decorador `admission_control` (vistas síncronas y async) y
+solo a peticiones POST; las cubetas se revisan antes de esperar cupo.
+"""
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+
+
+class Rejected(Exception):
+    """La petición no se admite; se responde `status` con Retry-After."""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    """Petición en la cola del limitador; `grant()` le entrega el cupo y la despierta."""
+
+    __slots__ = ('granted', '_event', '_loop', '_future')
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def grant(self) -> bool:
+        if self._loop is None:
+            self.granted = True
+            self._event.set()
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # Event loop cerrado: la petición ya no existe
+            return False
+        self.granted = True
+        return True
+
+    def _wake(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+
+    async def await_grant(self, timeout):
+        try:
+            await asyncio.wait_for(self._future, timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ConcurrencyLimiter:
+    """Semáforo con cola FIFO acotada: como máximo `limit` en curso y `queue` esperando
+    a lo sumo `wait` segundos. Las vistas síncronas (hilos) y async (event loop)
+    comparten la cola; al liberar, el cupo pasa directamente al primero que espera.
+    """
+
+    def __init__(self, limit, queue, wait):
+        self.limit = max(limit, 1)
+        self.queue = max(queue, 0)
+        self.wait = wait
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _busy(self):
+        metrics.incr('shed_busy')
+        return Rejected(503, 1, 'busy')
+
+    def _enqueue(self, loop=None):
+        """None si hay cupo libre (ya tomado); si no, el _Waiter encolado."""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return None
+            if len(self._waiters) >= self.queue:
+                raise self._busy()
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _give_up(self, waiter) -> bool:
+        """Tras el plazo: True si el cupo llegó a tiempo; si no, sale de la cola."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            return False
+
+    def acquire(self):
+        waiter = self._enqueue()
+        if waiter is None:
+            return
+        waiter.wait(self.wait)
+        if not self._give_up(waiter):
+            raise self._busy()
+
+    async def aacquire(self):
+        """Versión async: espera en la misma cola FIFO sin bloquear el event loop."""
+        waiter = self._enqueue(asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await waiter.await_grant(self.wait)
+        except BaseException:
+            # Cancelada (p.ej. el cliente cortó): si el cupo ya era suyo, se devuelve
+            if self._give_up(waiter):
+                self.release()
+            raise
+        if not self._give_up(waiter):
+            raise self._busy()
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                if self._waiters.popleft().grant():
+                    return
+            self.active -= 1
+
+    def info(self):
+        return {'limit': self.limit, 'active': self.active, 'waiting': self.waiting, 'queue': self.queue}
+
+
+class TokenBuckets:
+    """Cubetas de tokens por clave (LRU acotado): `burst` tokens, `rate` por segundo."""
+
+    def __init__(self, burst, rate, max_keys=10000):
+        self.burst = float(burst)
+        self.rate = float(rate)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # clave -> (tokens, instante)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1) -> float:
+        """Gasta `cost` tokens; devuelve 0 si se admitió o los segundos hasta tenerlos.
+        Un costo mayor que la ráfaga se recorta a la ráfaga (nunca quedaría admitido).
+        """
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate if self.rate > 0 else float('inf')
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+_limiter = None
+_buckets = None
+_state_lock = threading.Lock()
+
+
+def _enabled():
+    return getattr(settings, 'FACIAL_ADMISSION_ENABLED', True)
+
+
+def get_limiter() -> ConcurrencyLimiter:
+    global _limiter
+    if _limiter is None:
+        with _state_lock:
+            if _limiter is None:
+                _limiter = ConcurrencyLimiter(
+                    getattr(settings, 'FACIAL_ADMISSION_MAX_CONCURRENT', os.cpu_count() or 2),
+                    getattr(settings, 'FACIAL_ADMISSION_QUEUE', 8),
+                    getattr(settings, 'FACIAL_ADMISSION_WAIT', 2.0),
+                )
+    return _limiter
+
+
+def get_buckets() -> dict:
+    """{'ip': TokenBuckets | None, 'email': TokenBuckets | None} según settings (ráfaga 0 = sin límite)."""
+    global _buckets
+    if _buckets is None:
+        with _state_lock:
+            if _buckets is None:
+                max_keys = getattr(settings, 'FACIAL_RATE_MAX_KEYS', 10000)
+                _buckets = {}
+                for scope, burst, rate in (
+                    ('ip', 'FACIAL_RATE_IP_BURST', 'FACIAL_RATE_IP_PER_SECOND'),
+                    ('email', 'FACIAL_RATE_EMAIL_BURST', 'FACIAL_RATE_EMAIL_PER_SECOND'),
+                ):
+                    burst = getattr(settings, burst, 0)
+                    _buckets[scope] = TokenBuckets(burst, getattr(settings, rate, 0), max_keys) if burst > 0 else None
+    return _buckets
+
+
+def reset_admission():
+    """Olvida el limitador y las cubetas (p.ej. tras cambiar settings en pruebas)."""
+    global _limiter, _buckets
+    with _state_lock:
+        _limiter = None
+        _buckets = None
+
+
+def admission_info():
+    return get_limiter().info() if _enabled() else {'enabled': False}
+
+
+def request_json(request):
+    """Cuerpo JSON de la petición, decodificado una sola vez (lo reutiliza la vista).
+    Lanza ValueError si el JSON es inválido.
+    """
+    data = getattr(request, '_facial_json', None)
+    if data is None:
+        data = json.loads(request.body.decode('utf-8')) if request.body else request.POST
+        request._facial_json = data
+    return data
+
+
+def client_ip(request) -> str:
+    """IP del cliente: REMOTE_ADDR, o la primera de FACIAL_CLIENT_IP_HEADER detrás de un proxy."""
+    header = getattr(settings, 'FACIAL_CLIENT_IP_HEADER', '')
+    if header and request.META.get(header):
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _identity(request):
+    """(email | None, frames) sin leer el cuerpo de los envíos binarios."""
+    if request.content_type == 'application/json':
+        try:
+            data = request_json(request)
+        except ValueError:
+            # La vista responde 'JSON inválido'
+            return None, 1
+    elif request.content_type == 'multipart/form-data' or request.method == 'POST' and request.POST:
+        data = request.POST
+        uploads = len(request.FILES.getlist('facial_frames')) + len(request.FILES.getlist('frames'))
+        if uploads:
+            return data.get('email'), uploads
+    else:
+        data = request.GET
+    email = data.get('email') if hasattr(data, 'get') else None
+    frames = data.get('facial_frames') if isinstance(data, dict) else None
+    return email, len(frames) if isinstance(frames, list) and frames else 1
+
+
+def _check_rate(request):
+    buckets = get_buckets()
+    if not buckets['ip'] and not buckets['email']:
+        return
+    email, cost = _identity(request)
+    for scope, key in (('ip', client_ip(request)), ('email', (email or '').strip().lower())):
+        if not key or buckets[scope] is None:
+            continue
+        wait = buckets[scope].take(key, cost)
+        if wait > 0:
+            metrics.incr(f'rate_limited_{scope}')
+            logging.getLogger('facial').info('admission: límite por %s alcanzado (%s)', scope, key)
+            raise Rejected(429, max(math.ceil(wait), 1), f'rate_{scope}')
+
+
+_MESSAGES = {
+    429: 'Demasiadas solicitudes, intente más tarde',
+    503: 'Servidor ocupado, intente nuevamente',
+}
+
+
+def rejected_response(exc: Rejected):
+    response = JsonResponse({'ok': False, 'error': _MESSAGES[exc.status], 'code': exc.reason}, status=exc.status)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def admission_control(view=None, *, on_reject=None):
+    """Limita las peticiones POST de una vista pesada: cubetas por IP/email y luego cupo
+    de concurrencia del proceso. Funciona con vistas síncronas y async.
+    `on_reject(request, exc)` arma la respuesta de rechazo (por defecto JSON, ver
+    rejected_response); se usa como @admission_control o @admission_control(on_reject=...).
+    """
+    if view is None:
+        return functools.partial(admission_control, on_reject=on_reject)
+    reject = on_reject or (lambda request, exc: rejected_response(exc))
+
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'POST' or not _enabled():
+                return await view(request, *args, **kwargs)
+            limiter = get_limiter()
+            started = time.perf_counter()
+            try:
+                _check_rate(request)
+                await limiter.aacquire()
+            except Rejected as e:
+                return reject(request, e)
+            metrics.record('admission', time.perf_counter() - started)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                limiter.release()
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST' or not _enabled():
+                return view(request, *args, **kwargs)
+            limiter = get_limiter()
+            started = time.perf_counter()
+            try:
+                _check_rate(request)
+                limiter.acquire()
+            except Rejected as e:
+                return reject(request, e)
+            metrics.record('admission', time.perf_counter() - started)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                limiter.release()
+    return wrapper
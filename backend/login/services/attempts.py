@@ -0,0 +1,65 @@
+"""Contabilidad del login facial: intentos fallidos y último acceso.
+
+Los intentos fallidos se cuentan con un UPDATE atómico (F() + 1, con tope) en
+lugar de leer-modificar-escribir, así dos intentos concurrentes no se pisan. En
+un login exitoso, failed_attempts = 0 y last_login se escriben en un único
+UPDATE: el receptor de user_logged_in que guarda last_login se omite para estas
+instancias (ver signals.SKIP_LAST_LOGIN).
+"""
+from django.contrib.auth import alogin, login as auth_login
+from django.db.models import F
+from django.utils import timezone
+
+from ..models.models import Usuario
+
+
+# Tope de la tolerancia adaptativa por intentos fallidos
+MAX_FAILED_ATTEMPTS = 5
+
+# Columnas que usa el camino de login. Embeddings y posiciones quedan diferidos: salen de
+# la caché por embeddings_version (services.embeddings) y solo se leen si esta falla
+LOGIN_FIELDS = (
+    'id', 'email', 'password', 'is_active', 'last_login', 'failed_attempts', 'embeddings_version',
+)
+
+# Atributo de instancia que indica al receptor de user_logged_in que no guarde last_login
+SKIP_LAST_LOGIN = '_facial_skip_last_login'
+
+_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+def _failure_queryset(user):
+    # Con el tope alcanzado el filtro no coincide y no hay escritura
+    return Usuario.objects.filter(pk=user.pk, failed_attempts__lt=MAX_FAILED_ATTEMPTS)
+
+
+def record_failure(user):
+    """Suma un intento fallido de forma atómica (máximo MAX_FAILED_ATTEMPTS)."""
+    _failure_queryset(user).update(failed_attempts=F('failed_attempts') + 1)
+
+
+async def arecord_failure(user):
+    await _failure_queryset(user).aupdate(failed_attempts=F('failed_attempts') + 1)
+
+
+def login_success(request, user):
+    """Abre la sesión y guarda failed_attempts = 0 y last_login en un solo UPDATE."""
+    setattr(user, SKIP_LAST_LOGIN, True)
+    try:
+        auth_login(request, user, backend=_BACKEND)
+    finally:
+        delattr(user, SKIP_LAST_LOGIN)
+    now = timezone.now()
+    Usuario.objects.filter(pk=user.pk).update(failed_attempts=0, last_login=now)
+    user.failed_attempts, user.last_login = 0, now
+
+
+async def alogin_success(request, user):
+    setattr(user, SKIP_LAST_LOGIN, True)
+    try:
+        await alogin(request, user, backend=_BACKEND)
+    finally:
+        delattr(user, SKIP_LAST_LOGIN)
+    now = timezone.now()
+    await Usuario.objects.filter(pk=user.pk).aupdate(failed_attempts=0, last_login=now)
+    user.failed_attempts, user.last_login = 0, now
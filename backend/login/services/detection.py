@@ -0,0 +1,79 @@
+"""Etapa de detección de rostros a resolución reducida y con región de interés.
+
+HOG sobre un frame 720p/1080p completo domina el costo del pipeline. Aquí se
+detecta sobre una copia reducida (lado mayor <= max_side) y, si el cliente envía
+en position_data la caja del rostro de FaceMesh, solo dentro de esa región.
+Las cajas resultantes se llevan de vuelta a coordenadas del frame completo, que
+es el que se usa para calcular el embedding.
+
+Sin dependencias de Django: se ejecuta dentro de los procesos del pool.
+"""
+from .lazy import cv2, face_recognition, np
+
+
+# Margen alrededor de la caja de FaceMesh (fracción del ancho/alto de la caja)
+ROI_MARGIN = 0.25
+
+
+def roi_from_position(position):
+    """Extrae la caja normalizada {x, y, w, h} (0..1) de position_data['box'], o None."""
+    if not isinstance(position, dict):
+        return None
+    box = position.get('box')
+    if not isinstance(box, dict):
+        return None
+    try:
+        x, y, w, h = (float(box[k]) for k in ('x', 'y', 'w', 'h'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > 1.0001 or y + h > 1.0001:
+        return None
+    return (x, y, w, h)
+
+
+def _roi_pixels(roi, width, height):
+    x, y, w, h = roi
+    left = max(int((x - w * ROI_MARGIN) * width), 0)
+    top = max(int((y - h * ROI_MARGIN) * height), 0)
+    right = min(int((x + w * (1 + ROI_MARGIN)) * width), width)
+    bottom = min(int((y + h * (1 + ROI_MARGIN)) * height), height)
+    if right - left < 16 or bottom - top < 16:
+        return None
+    return left, top, right, bottom
+
+
+def _detect_scaled(rgb, max_side):
+    """face_locations sobre una copia reducida; cajas en coordenadas de `rgb`."""
+    h, w = rgb.shape[:2]
+    scale = 1.0
+    work = rgb
+    if max_side and max(h, w) > max_side:
+        scale = max_side / float(max(h, w))
+        work = cv2.resize(rgb, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+    boxes = face_recognition.face_locations(work, model='hog')
+    if scale == 1.0:
+        return boxes
+    inv = 1.0 / scale
+    return [
+        (
+            max(int(top * inv), 0),
+            min(int(right * inv), w),
+            min(int(bottom * inv), h),
+            max(int(left * inv), 0),
+        )
+        for top, right, bottom, left in boxes
+    ]
+
+
+def detect_faces(rgb, roi=None, max_side=0):
+    """Cajas (top, right, bottom, left) en coordenadas del frame completo.
+    Con `roi` busca primero dentro de la región; si no encuentra, en el frame entero.
+    """
+    if roi is not None:
+        region = _roi_pixels(roi, rgb.shape[1], rgb.shape[0])
+        if region is not None:
+            left, top, right, bottom = region
+            boxes = _detect_scaled(rgb[top:bottom, left:right], max_side)
+            if boxes:
+                return [(t + top, r + left, b + top, l + left) for t, r, b, l in boxes]
+    return _detect_scaled(rgb, max_side)
@@ -0,0 +1,262 @@
+"""Almacenamiento y galería de embeddings faciales por usuario.
+
+Los embeddings se guardan empaquetados en binario (cabecera versionada + float32,
+float16 o int8 según FACIAL_EMBEDDING_DTYPE, ver services.quantize) y se leen con
+np.frombuffer. Cada usuario se convierte una sola vez en una matriz contigua
+(muestras x 128) en el mismo modo, que se guarda en memoria del proceso; la
+comparación contra el embedding vivo se hace con una única operación vectorizada.
+En la misma entrada de caché se guardan sus posiciones normalizadas (ver
+services.positions).
+
+Entre la caché del proceso y la BD hay una caché compartida entre workers (alias
+FACIAL_EMBEDDING_CACHE de CACHES: memcached, redis, archivos...) con los embeddings
+empaquetados en float32 y las posiciones, bajo la clave pk + embeddings_version.
+Usuario.save() incrementa la versión al cambiar datos biométricos, así que una
+entrada nunca queda obsoleta: cada worker ve la versión nueva en la fila del
+usuario y deja de usar la anterior. El login solo lee las columnas biométricas
+de la BD cuando falla la caché compartida.
+"""
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+from .lazy import np
+from .positions import poses_from_list, user_positions
+from .quantize import MODES, QuantizedMatrix, dequantize, int8_scale, quantize, quantize_int8
+
+
+# Dimensiones usadas por face_recognition para la distancia euclidiana
+EMBEDDING_DIMS = 128
+
+# Formato binario empaquetado: cabecera fija de 16 bytes + datos (muestras x dims)
+#   magic(4s) version(B) dtype(B) dims(H) count(I) reservado(4x), little-endian
+# En int8 la cabecera va seguida de la escala por dimensión (dims x float16). En una
+# galería de 1-3 muestras una escala float32 ocupaba tanto como las propias muestras;
+# el código 2 (escala float32) ya no se escribe, pero se sigue leyendo.
+PACK_MAGIC = b'FEMB'
+PACK_VERSION = 1
+_HEADER = struct.Struct('<4sBBHI4x')
+_DTYPE_CODES = {'float32': 0, 'float16': 1, 'int8': 3}
+_CODE_DTYPES = {0: 'float32', 1: 'float16', 2: 'int8', 3: 'int8'}
+_SCALE_DTYPES = {2: '<f4', 3: '<f2'}
+
+# Columnas que leen las galerías y posiciones; en el login quedan diferidas (.only())
+BIOMETRIC_FIELDS = ('facial_embeddings_bin', 'facial_embeddings', 'positions', 'position_data')
+
+_lock = threading.Lock()
+_galleries = OrderedDict()  # pk -> (expira_en, embeddings_version, {'gallery': matriz, 'poses': Poses})
+
+
+def _cache_limits():
+    max_entries = getattr(settings, 'FACIAL_GALLERY_CACHE_SIZE', 2048)
+    ttl = getattr(settings, 'FACIAL_GALLERY_CACHE_TTL', 300)
+    return max_entries, ttl
+
+
+def embedding_dtype():
+    """Modo de almacenamiento y comparación configurado (FACIAL_EMBEDDING_DTYPE)."""
+    mode = getattr(settings, 'FACIAL_EMBEDDING_DTYPE', 'float32')
+    if mode not in MODES:
+        raise ValueError(f'FACIAL_EMBEDDING_DTYPE desconocido: {mode!r}')
+    return mode
+
+
+def match_threshold(base) -> float:
+    """Umbral de distancia ajustado al modo cuantizado (FACIAL_QUANT_THRESHOLD_OFFSET)."""
+    if embedding_dtype() == 'float32':
+        return base
+    return base + getattr(settings, 'FACIAL_QUANT_THRESHOLD_OFFSET', 0.0)
+
+
+def pack_embeddings(embeddings, dtype=None) -> bytes:
+    """Empaqueta una colección de embeddings (lista o matriz) en el formato binario.
+    `dtype` por defecto es FACIAL_EMBEDDING_DTYPE.
+    """
+    dtype = dtype or embedding_dtype()
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.ndim != 2:
+        raise ValueError('Se esperaba una matriz muestras x dims')
+    count, dims = matrix.shape
+    header = _HEADER.pack(PACK_MAGIC, PACK_VERSION, _DTYPE_CODES[dtype], dims, count)
+    if dtype == 'int8':
+        scale = _half_scale(int8_scale(matrix))
+        q, _ = quantize_int8(matrix, scale.astype(np.float32))
+        return header + scale.tobytes() + q.tobytes()
+    return header + np.ascontiguousarray(matrix, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+
+
+def _half_scale(scale):
+    """Escala en float16, redondeada hacia arriba para que ningún valor se sature."""
+    half = scale.astype('<f2')
+    low = half.astype(np.float32) < scale
+    half[low] = np.nextafter(half[low], np.float16(np.inf))
+    return half
+
+
+def unpack_embeddings(blob):
+    """Lee el formato binario; devuelve matriz muestras x dims. float32/float16 se leen
+    sin copiar (np.frombuffer); int8 se devuelve descuantizado a float32.
+    """
+    if blob is None:
+        return None
+    buf = memoryview(blob)
+    if len(buf) < _HEADER.size:
+        raise ValueError('Blob de embeddings truncado')
+    magic, version, code, dims, count = _HEADER.unpack_from(buf)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        raise ValueError(f'Formato de embeddings no soportado: {magic!r} v{version}')
+    name = _CODE_DTYPES[code]
+    if name == 'int8':
+        scale_dtype = np.dtype(_SCALE_DTYPES[code])
+        scale = np.frombuffer(buf, dtype=scale_dtype, count=dims, offset=_HEADER.size).astype(np.float32)
+        q = np.frombuffer(buf, dtype=np.int8, count=dims * count, offset=_HEADER.size + scale_dtype.itemsize * dims)
+        return dequantize(q.reshape(count, dims), scale)
+    dtype = np.dtype(name).newbyteorder('<')
+    return np.frombuffer(buf, dtype=dtype, count=dims * count, offset=_HEADER.size).reshape(count, dims)
+
+
+def embeddings_shape(blob=None, legacy=None, single=None):
+    """(muestras, dims) sin decodificar los embeddings: del blob empaquetado lee solo la
+    cabecera; si no hay blob, de la lista JSON legada o del embedding único (float32).
+    """
+    if blob and len(blob) >= _HEADER.size:
+        magic, version, _code, dims, count = _HEADER.unpack_from(memoryview(blob))
+        if magic == PACK_MAGIC and version == PACK_VERSION:
+            return count, dims
+    if legacy:
+        return len(legacy), len(legacy[0]) if isinstance(legacy[0], (list, tuple)) else 0
+    if single:
+        return 1, len(single) // 4
+    return 0, 0
+
+
+def user_embeddings(user):
+    """Matriz de embeddings del usuario desde el campo empaquetado.
+    Cae a la lista JSON para filas aún no migradas. facial_data no se lee: la
+    migración 0004 ya lo empaquetó en facial_embeddings_bin.
+    """
+    if user.facial_embeddings_bin:
+        return unpack_embeddings(user.facial_embeddings_bin)
+    if user.facial_embeddings:
+        return np.array(user.facial_embeddings, dtype=np.float32)
+    return None
+
+
+def build_gallery(user, mode=None):
+    """Convierte los embeddings del usuario en una matriz contigua (muestras x 128) en el
+    modo `mode` (por defecto FACIAL_EMBEDDING_DTYPE): ndarray float32/float16 o
+    QuantizedMatrix en int8.
+    """
+    matrix = user_embeddings(user)
+    if matrix is None or matrix.ndim != 2 or not matrix.shape[0]:
+        return None
+    return quantize(np.asarray(matrix[:, :EMBEDDING_DIMS], dtype=np.float32), mode or embedding_dtype())
+
+
+def _entry(matrix, positions):
+    """Entrada de caché a partir de la matriz float32 y la lista de posiciones."""
+    gallery = None
+    if matrix is not None and matrix.ndim == 2 and matrix.shape[0]:
+        gallery = quantize(np.asarray(matrix[:, :EMBEDDING_DIMS], dtype=np.float32), embedding_dtype())
+    return {'gallery': gallery, 'poses': poses_from_list(positions)}
+
+
+def shared_cache():
+    """Caché de Django compartida entre workers (None si FACIAL_EMBEDDING_CACHE está vacío)."""
+    alias = getattr(settings, 'FACIAL_EMBEDDING_CACHE', 'default')
+    if not alias:
+        return None
+    from django.core.cache import caches
+    return caches[alias]
+
+
+def shared_key(pk, version) -> str:
+    return f'facial:emb:{pk}:{version}'
+
+
+def _load_biometrics(user):
+    """Carga en una sola consulta las columnas biométricas que .only() dejó diferidas."""
+    deferred = user.get_deferred_fields().intersection(BIOMETRIC_FIELDS)
+    if deferred:
+        user.refresh_from_db(fields=sorted(deferred))
+
+
+def _load_entry(user, version):
+    """Entrada del usuario desde la caché compartida o, si falta, desde la BD (y la publica)."""
+    cache = shared_cache()
+    key = shared_key(user.pk, version)
+    if cache is not None:
+        try:
+            payload = cache.get(key)
+        except Exception as e:
+            logging.getLogger('facial').warning('embeddings: caché compartida no disponible: %s', e)
+            payload, cache = None, None
+        if payload is not None:
+            metrics.incr('embedding_cache_hit')
+            blob, positions = payload
+            return _entry(unpack_embeddings(blob) if blob else None, positions)
+        metrics.incr('embedding_cache_miss')
+    _load_biometrics(user)
+    matrix = user_embeddings(user)
+    positions = user_positions(user)
+    if cache is not None:
+        blob = pack_embeddings(matrix, 'float32') if matrix is not None and matrix.size else None
+        try:
+            cache.set(key, (blob, positions), getattr(settings, 'FACIAL_EMBEDDING_CACHE_TTL', 86400))
+        except Exception as e:
+            logging.getLogger('facial').warning('embeddings: no se pudo guardar en la caché compartida: %s', e)
+    return _entry(matrix, positions)
+
+
+def _user_entry(user):
+    """{'gallery', 'poses'} del usuario: caché del proceso, luego la compartida, luego la BD."""
+    if user.pk is None:
+        return _entry(user_embeddings(user), user_positions(user))
+    version = user.embeddings_version
+    max_entries, ttl = _cache_limits()
+    now = time.monotonic()
+    with _lock:
+        entry = _galleries.get(user.pk)
+        if entry is not None and entry[0] > now and entry[1] == version:
+            _galleries.move_to_end(user.pk)
+            return entry[2]
+    values = _load_entry(user, version)
+    with _lock:
+        _galleries[user.pk] = (now + ttl, version, values)
+        _galleries.move_to_end(user.pk)
+        while len(_galleries) > max_entries:
+            _galleries.popitem(last=False)
+    return values
+
+
+def get_gallery(user):
+    """Matriz de embeddings del usuario (None si no tiene colección), vía las cachés."""
+    return _user_entry(user)['gallery']
+
+
+def get_poses(user):
+    """Posiciones registradas del usuario como matrices float64 (misma entrada que la galería)."""
+    return _user_entry(user)['poses']
+
+
+def invalidate_gallery(pk):
+    """Descarta la galería y posiciones cacheadas de un usuario (p.ej. tras re-registro)."""
+    with _lock:
+        _galleries.pop(pk, None)
+
+
+def min_distance(gallery, live_emb) -> float:
+    """Distancia euclidiana mínima entre el embedding vivo y cualquier muestra."""
+    live = np.asarray(live_emb, dtype=np.float32)[:EMBEDDING_DIMS]
+    if isinstance(gallery, QuantizedMatrix):
+        return float(np.sqrt(max(float(gallery.sq_distances(live).min()), 0.0)))
+    # float16 - float32 se calcula en float32
+    diffs = gallery - live
+    return float(np.sqrt(np.einsum('ij,ij->i', diffs, diffs)).min())
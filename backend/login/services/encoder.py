@@ -0,0 +1,658 @@
+"""Cálculo de embeddings faciales y pool acotado de procesos codificadores.
+
+La detección HOG de dlib y face_encodings son CPU intensivas. Con
+FACIAL_ENCODER_WORKERS > 0 se ejecutan en procesos "calientes" (modelos ya
+cargados) con una cola acotada: si no hay cupo se falla de inmediato
+(EncoderBusy -> 503) y cada trabajo tiene un tiempo máximo (EncoderTimeout).
+Con FACIAL_ENCODER_WORKERS = 0 se calcula en el hilo de la petición.
+Antes de codificar se consulta la caché por contenido (services.frame_cache) y,
+en el proceso de la petición, el control de calidad (services.quality): un frame
+borroso o mal expuesto se rechaza sin ocupar el pool.
+
+Este módulo no debe importar modelos de Django: los procesos del pool lo
+importan sin inicializar Django.
+"""
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from .detection import detect_faces, roi_from_position
+from .frame_archive import FrameArchive
+from .frame_cache import cache_key, get_frame_cache
+from .lazy import available, cv2, face_recognition, np
+from .quality import PoorQualityFrame, Thresholds, check_quality
+from . import metrics
+
+
+class EncoderBusy(Exception):
+    """No hay cupo en la cola del pool de codificación."""
+
+    retry_after = 1
+
+
+class EncoderTimeout(Exception):
+    """El trabajo de codificación excedió FACIAL_ENCODER_TIMEOUT."""
+
+    retry_after = 1
+
+
+def decode_b64(b64_str) -> Optional[bytes]:
+    """Decodifica un data URL / base64 a bytes de imagen (None si es inválido)."""
+    if not b64_str:
+        logging.getLogger('facial').debug('compute_embedding: b64_str vacío')
+        return None
+    try:
+        header, encoded = b64_str.split(',') if ',' in b64_str else ('', b64_str)
+        return base64.b64decode(encoded)
+    except Exception as e:
+        logging.getLogger('facial').debug('compute_embedding: base64 inválido %s', e)
+        return None
+
+
+def compute_embedding_timed(img_bytes, roi=None, max_side=0):
+    """Embedding del primer rostro con los tiempos de cada etapa y el motivo del fallo.
+    La detección corre a resolución reducida (`max_side`, 0 = completa) y dentro de
+    `roi` si se indica; el embedding se calcula siempre sobre el frame completo.
+    Devuelve (embedding | None, {etapa: segundos}, motivo) con motivo None si hubo
+    embedding, 'invalid' si la imagen no se pudo leer o 'no_face'.
+    """
+    log = logging.getLogger('facial')
+    timings = {}
+    if not img_bytes:
+        return None, timings, 'invalid'
+    if not available(np):
+        log.debug('compute_embedding: numpy no disponible')
+        return None, timings, 'invalid'
+    try:
+        started = time.perf_counter()
+        image = np.frombuffer(img_bytes, dtype=np.uint8)
+        frame = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        if frame is None:
+            log.debug('compute_embedding: cv2.imdecode devolvió None')
+            return None, timings, 'invalid'
+        if available(face_recognition):
+            # Copia RGB contigua: la vista [:, :, ::-1] obliga a cv2/dlib a copiar de nuevo
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            timings['imdecode'] = time.perf_counter() - started
+            started = time.perf_counter()
+            boxes = detect_faces(rgb, roi=roi, max_side=max_side)
+            timings['detect'] = time.perf_counter() - started
+            log.debug('compute_embedding: boxes=%d roi=%s max_side=%s', len(boxes), roi is not None, max_side)
+            if not boxes:
+                return None, timings, 'no_face'
+            # Solo se usa el primer rostro: no se codifican los demás
+            started = time.perf_counter()
+            encs = face_recognition.face_encodings(rgb, boxes[:1])
+            timings['encode'] = time.perf_counter() - started
+            log.debug('compute_embedding: encs=%d', len(encs))
+            if not encs:
+                return None, timings, 'no_face'
+            return np.array(encs[0], dtype=np.float32), timings, None
+        else:
+            timings['imdecode'] = time.perf_counter() - started
+            started = time.perf_counter()
+            # Fallback: usar promedio de píxeles de la región central como "huella" rudimentaria
+            h, w = frame.shape[:2]
+            cx, cy = w // 2, h // 2
+            crop = frame[max(cy-100,0):cy+100, max(cx-100,0):cx+100]
+            if crop.size == 0:
+                log.debug('compute_embedding: crop vacío en fallback')
+                return None, timings, 'no_face'
+            emb = cv2.resize(crop, (16, 16)).astype('float32').reshape(-1)
+            emb = emb / (np.linalg.norm(emb) + 1e-6)
+            timings['encode'] = time.perf_counter() - started
+            return emb, timings, None
+    except Exception as e:
+        logging.getLogger('facial').exception('compute_embedding: excepción %s', e)
+        return None, timings, 'invalid'
+
+
+def compute_embedding_from_bytes(img_bytes, roi=None, max_side=0) -> Optional['np.ndarray']:
+    """Embedding del primer rostro (ver compute_embedding_timed)."""
+    return compute_embedding_timed(img_bytes, roi, max_side)[0]
+
+
+def compute_embedding(b64_str, roi=None, max_side=0) -> Optional['np.ndarray']:
+    return compute_embedding_from_bytes(decode_b64(b64_str), roi, max_side)
+
+
+def encode_image_files(paths, max_side=0):
+    """Embeddings de imágenes en disco (enrolamiento masivo), alineados con `paths`.
+    None para archivos ilegibles o sin rostro.
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as fh:
+                img_bytes = fh.read()
+        except OSError as e:
+            logging.getLogger('facial').warning('encoder: no se pudo leer %s: %s', path, e)
+            results.append(None)
+            continue
+        results.append(compute_embedding_from_bytes(img_bytes, None, max_side))
+    return results
+
+
+def encode_archived_frames(root, entries, max_side=0):
+    """Embeddings de frames del archivo de enrolamiento (re-embedding), alineados con
+    `entries` ({frame, position}). None para frames ausentes o sin rostro.
+    """
+    archive = FrameArchive(root)
+    results = []
+    for entry in entries:
+        img_bytes = archive.load(entry.get('frame') or '')
+        if img_bytes is None:
+            logging.getLogger('facial').warning('encoder: frame %s no está en el archivo', entry.get('frame'))
+            results.append(None)
+            continue
+        results.append(compute_embedding_from_bytes(img_bytes, roi_from_position(entry.get('position')), max_side))
+    return results
+
+
+def _timed_embedding_from_bytes(job):
+    """compute_embedding_timed + segundos totales medidos dentro del worker."""
+    started = time.perf_counter()
+    emb, timings, reason = compute_embedding_timed(*job)
+    return emb, timings, reason, time.perf_counter() - started
+
+
+def _record_result(timings, reason, worker_s=None, wall_s=None):
+    """Pasa a la petición en curso los tiempos medidos en el worker.
+    `encoder_wait` es lo que el trabajo pasó en cola/IPC fuera del cálculo.
+    """
+    for name, seconds in timings.items():
+        metrics.record(name, seconds)
+    if worker_s is not None and wall_s is not None:
+        metrics.record('encoder_wait', max(wall_s - worker_s, 0.0))
+    if reason is not None:
+        metrics.incr(reason)
+
+
+def warmup_frame() -> Optional[bytes]:
+    """JPEG sintético (degradado, sin rostro) para ejercitar el pipeline al arrancar."""
+    if not available(np) or not available(cv2):
+        return None
+    ramp = np.linspace(0, 255, 320, dtype=np.uint8)
+    frame = np.dstack([np.tile(ramp, (240, 1)), np.tile(ramp[::-1], (240, 1)), np.full((240, 320), 128, np.uint8)])
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+
+def dummy_encode(img_bytes, max_side=0):
+    """Recorre decodificación, detección y embedding sobre `img_bytes`.
+    El frame no tiene rostro, así que el embedding se fuerza sobre una caja fija:
+    así también se cargan y ejecutan los modelos de landmarks y de embeddings.
+    """
+    compute_embedding_timed(img_bytes, None, max_side)
+    if available(face_recognition):
+        rgb = cv2.cvtColor(cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        face_recognition.face_encodings(rgb, [(60, 220, 180, 100)])
+
+
+def _warm_worker():
+    """Inicializador de cada proceso: importa las librerías y codifica un frame sintético."""
+    img_bytes = warmup_frame()
+    if img_bytes is not None:
+        dummy_encode(img_bytes)
+
+
+def _worker_ready(_item):
+    return True
+
+
+class EncoderPool:
+    """Pool de procesos con cola acotada y tiempo máximo por trabajo."""
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(max(self.capacity, 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: los hijos no heredan conexiones a BD ni hilos del servidor
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_worker,
+                )
+            return self._executor
+
+    def _reset(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, wait=False):
+        """Encola un trabajo; lanza EncoderBusy si la cola está llena.
+        Con wait=True espera hasta `timeout` por un cupo (usado dentro de un lote).
+        """
+        acquired = self._slots.acquire(timeout=self.timeout) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise EncoderBusy()
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # Un proceso murió (p.ej. fallo nativo de dlib): se recrea el pool una vez
+                logging.getLogger('facial').warning('encoder: pool roto, recreando procesos')
+                self._reset(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # El cupo se libera cuando el trabajo termina realmente, no al vencer el timeout
+        future.add_done_callback(lambda _f: self._slots.release())
+        # Para descartar justo este executor si el proceso muere durante el trabajo
+        future.executor = executor
+        return future
+
+    def _broken(self, future):
+        """Un proceso murió con el trabajo en curso: se descarta el pool (se recrea en el
+        próximo submit) y la petición se responde como ocupada (503), no como error.
+        """
+        logging.getLogger('facial').warning('encoder: un proceso del pool murió durante un trabajo; se recrea el pool')
+        self._reset(future.executor)
+        return EncoderBusy()
+
+    def run(self, fn, *args):
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            logging.getLogger('facial').warning('encoder: trabajo excedió %ss', self.timeout)
+            raise EncoderTimeout()
+        except BrokenProcessPool:
+            raise self._broken(future)
+
+    def run_many(self, fn, items):
+        """Reparte un lote entre los procesos; resultados en el mismo orden que `items`.
+        Solo el primer trabajo falla rápido por cola llena; los siguientes esperan
+        cupos que el propio lote va liberando.
+        """
+        futures = []
+        try:
+            for item in items:
+                futures.append(self.submit(fn, item, wait=bool(futures)))
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result(timeout=self.timeout))
+                except FutureTimeout:
+                    logging.getLogger('facial').warning('encoder: trabajo de lote excedió %ss', self.timeout)
+                    raise EncoderTimeout()
+                except BrokenProcessPool:
+                    raise self._broken(future)
+            return results
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def warm(self):
+        """Arranca los procesos (cada uno ejecuta _warm_worker) y espera a que respondan."""
+        self.run_many(_worker_ready, range(self.workers))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _forget_pool():
+    # Un hijo creado con fork (p.ej. gunicorn --preload tras el calentamiento en el
+    # proceso maestro) no hereda los hilos del executor: crea su propio pool
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+def get_encoder_pool() -> Optional[EncoderPool]:
+    """Pool configurado por settings; None si la codificación es en línea."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    from django.conf import settings
+    workers = getattr(settings, 'FACIAL_ENCODER_WORKERS', 0)
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = EncoderPool(
+                workers=workers,
+                queue_size=getattr(settings, 'FACIAL_ENCODER_QUEUE', 8),
+                timeout=getattr(settings, 'FACIAL_ENCODER_TIMEOUT', 10.0),
+            )
+        return _pool
+
+
+def _detect_max_side():
+    from django.conf import settings
+    return getattr(settings, 'FACIAL_DETECT_MAX_SIDE', 0)
+
+
+def _encoder_name():
+    # Forma parte de la clave de caché: el fallback produce otros vectores
+    return 'dlib' if available(face_recognition) else 'fallback'
+
+
+def quality_thresholds() -> Optional[Thresholds]:
+    """Umbrales del control de calidad (None si FACIAL_QUALITY_GATE está desactivado)."""
+    from django.conf import settings
+    if not getattr(settings, 'FACIAL_QUALITY_GATE', True):
+        return None
+    return Thresholds(
+        max_side=getattr(settings, 'FACIAL_QUALITY_MAX_SIDE', 200),
+        min_sharpness=getattr(settings, 'FACIAL_QUALITY_MIN_SHARPNESS', 15.0),
+        min_brightness=getattr(settings, 'FACIAL_QUALITY_MIN_BRIGHTNESS', 40.0),
+        max_brightness=getattr(settings, 'FACIAL_QUALITY_MAX_BRIGHTNESS', 215.0),
+        min_contrast=getattr(settings, 'FACIAL_QUALITY_MIN_CONTRAST', 12.0),
+    )
+
+
+def _count_rejection(reason):
+    metrics.incr(f'quality_{reason}')
+    logging.getLogger('facial').debug('quality: frame rechazado (%s)', reason)
+
+
+def quality_gate(img_bytes) -> Optional[str]:
+    """Motivo por el que el frame no vale la pena codificar, o None (ver services.quality)."""
+    thresholds = quality_thresholds()
+    if thresholds is None:
+        return None
+    with metrics.stage('quality'):
+        reason = check_quality(img_bytes, thresholds)
+    if reason is not None:
+        _count_rejection(reason)
+    return reason
+
+
+def encoder_signature(max_side=None) -> str:
+    """Identifica el codificador y sus parámetros con los que se calculan los embeddings
+    (se guarda en Usuario.embedding_encoder; reembed_users recalcula los que difieren).
+    """
+    max_side = _detect_max_side() if max_side is None else max_side
+    return f'{_encoder_name()}/max_side={max_side}'
+
+
+def frame_bytes(frame) -> Optional[bytes]:
+    """Bytes de imagen de un frame: tal cual si ya llegó binario (multipart / image/jpeg),
+    decodificado si es un data URL base64 (formato JSON del front).
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        return bytes(frame) or None
+    return decode_b64(frame)
+
+
+def encode_frame(frame, position=None) -> Optional['np.ndarray']:
+    """Calcula el embedding de un frame (bytes o base64) en el pool, o en línea si no hay pool.
+    Si `position` trae la caja del rostro (position_data['box']) se usa como ROI.
+    Lanza PoorQualityFrame si el frame no pasa el control de calidad.
+    """
+    with metrics.stage('b64'):
+        img_bytes = frame_bytes(frame)
+    if not img_bytes:
+        metrics.incr('invalid')
+        return None
+    args = (img_bytes, roi_from_position(position), _detect_max_side())
+    cache = get_frame_cache()
+    key = cache_key(*args, _encoder_name()) if cache is not None else None
+    if key is not None:
+        with metrics.stage('frame_cache'):
+            found, emb = cache.get(key)
+        if found:
+            metrics.incr('frame_cache_hit')
+            if emb is None:
+                metrics.incr('no_face')
+            return emb
+    rejected = quality_gate(img_bytes)
+    if rejected is not None:
+        raise PoorQualityFrame(rejected)
+    pool = get_encoder_pool()
+    started = time.perf_counter()
+    if pool is None:
+        emb, timings, reason = compute_embedding_timed(*args)
+        _record_result(timings, reason)
+    else:
+        # Se envían los bytes ya decodificados (25% menos que el base64) al proceso
+        emb, timings, reason, worker_s = pool.run(_timed_embedding_from_bytes, args)
+        _record_result(timings, reason, worker_s, time.perf_counter() - started)
+    if key is not None:
+        cache.set(key, emb)
+    return emb
+
+
+def encode_frames(frames, positions=None, gate=True):
+    """Calcula embeddings de varios frames (bytes o base64) como un solo lote.
+    Decodifica todo por adelantado y devuelve una lista alineada con `frames`
+    (None donde no hubo rostro, el frame era inválido o no pasó el control de
+    calidad). `positions`, alineada con `frames`, aporta la ROI de cada uno.
+    `gate=False` omite el control de calidad (el llamador ya lo aplicó).
+    """
+    log = logging.getLogger('facial')
+    started = time.perf_counter()
+    decoded = [frame_bytes(frame) for frame in frames]
+    decode_s = time.perf_counter() - started
+    valid = [i for i, img in enumerate(decoded) if img]
+    positions = positions or []
+    max_side = _detect_max_side()
+    results = [None] * len(frames)
+
+    # Los frames ya vistos (misma imagen y parámetros) salen de la caché
+    cache = get_frame_cache()
+    pending, jobs, keys = [], [], []
+    rejected = 0
+    for i in valid:
+        job = (decoded[i], roi_from_position(positions[i] if i < len(positions) else None), max_side)
+        key = cache_key(*job, _encoder_name()) if cache is not None else None
+        if key is not None:
+            found, emb = cache.get(key)
+            if found:
+                results[i] = emb
+                continue
+        if gate and quality_gate(decoded[i]) is not None:
+            rejected += 1
+            continue
+        pending.append(i)
+        jobs.append(job)
+        keys.append(key)
+
+    pool = get_encoder_pool()
+    if pool is None or not jobs:
+        timed = [_timed_embedding_from_bytes(job) for job in jobs]
+    else:
+        timed = pool.run_many(_timed_embedding_from_bytes, jobs)
+
+    for i, key, (emb, timings, reason, elapsed) in zip(pending, keys, timed):
+        results[i] = emb
+        if key is not None:
+            cache.set(key, emb)
+        _record_result(timings, reason)
+        log.debug('encoder: muestra %d encode=%.1fms ok=%s', i, elapsed * 1000, emb is not None)
+    total_s = time.perf_counter() - started
+    log.info(
+        'encoder: lote frames=%d válidos=%d en_caché=%d calidad_baja=%d con_rostro=%d decode=%.1fms total=%.1fms workers=%d',
+        len(frames), len(valid), len(valid) - len(pending) - rejected, rejected, sum(r is not None for r in results),
+        decode_s * 1000, total_s * 1000, pool.workers if pool else 0,
+    )
+    return results
+
+
+def iter_encode_frames(frames, positions=None, prefetch=None):
+    """Genera (índice, embedding | None, motivo de calidad | None) en el orden de
+    `frames`, codificando por adelantado como máximo `prefetch` frames (por defecto,
+    los procesos del pool). Pensado para cortar en el primer frame útil: al cerrar
+    el generador se cancelan los trabajos que aún no empezaron. Sin pool codifica
+    uno a uno, a demanda.
+    """
+    positions = positions or []
+    pool = get_encoder_pool()
+    if pool is None:
+        for i, frame in enumerate(frames):
+            try:
+                yield i, encode_frame(frame, positions[i] if i < len(positions) else None), None
+            except PoorQualityFrame as e:
+                yield i, None, e.reason
+        return
+    prefetch = max(prefetch or pool.workers, 1)
+    cache = get_frame_cache()
+    max_side = _detect_max_side()
+
+    def start(i):
+        # (índice, clave de caché, future | None, embedding ya resuelto, inicio, motivo de calidad)
+        with metrics.stage('b64'):
+            img_bytes = frame_bytes(frames[i])
+        if not img_bytes:
+            metrics.incr('invalid')
+            return i, None, None, None, 0.0, None
+        args = (img_bytes, roi_from_position(positions[i] if i < len(positions) else None), max_side)
+        key = cache_key(*args, _encoder_name()) if cache is not None else None
+        if key is not None:
+            found, emb = cache.get(key)
+            if found:
+                metrics.incr('frame_cache_hit')
+                if emb is None:
+                    metrics.incr('no_face')
+                return i, None, None, emb, 0.0, None
+        rejected = quality_gate(img_bytes)
+        if rejected is not None:
+            return i, None, None, None, 0.0, rejected
+        # Solo el primer trabajo falla rápido por cola llena (como run_many)
+        future = pool.submit(_timed_embedding_from_bytes, args, wait=bool(pending))
+        return i, key, future, None, time.perf_counter(), None
+
+    pending = deque()
+    next_index = 0
+    try:
+        while next_index < len(frames) or pending:
+            while next_index < len(frames) and len(pending) < prefetch:
+                pending.append(start(next_index))
+                next_index += 1
+            i, key, future, emb, started, rejected = pending.popleft()
+            if future is not None:
+                try:
+                    emb, timings, reason, worker_s = future.result(timeout=pool.timeout)
+                except FutureTimeout:
+                    future.cancel()
+                    logging.getLogger('facial').warning('encoder: trabajo excedió %ss', pool.timeout)
+                    raise EncoderTimeout()
+                except BrokenProcessPool:
+                    raise pool._broken(future)
+                _record_result(timings, reason, worker_s, time.perf_counter() - started)
+                if key is not None:
+                    cache.set(key, emb)
+            yield i, emb, rejected
+    finally:
+        for _, _, future, _, _, _ in pending:
+            if future is not None:
+                future.cancel()
+
+
+async def aencode_frame(frame, position=None) -> Optional['np.ndarray']:
+    """Versión asíncrona de encode_frame: el trabajo de CPU nunca corre en el event loop.
+    Lanza PoorQualityFrame si el frame no pasa el control de calidad.
+    """
+    loop = asyncio.get_running_loop()
+    roi = roi_from_position(position)
+    max_side = _detect_max_side()
+    pool = get_encoder_pool()
+    if isinstance(frame, (bytes, bytearray)):
+        img_bytes = frame_bytes(frame)
+    else:
+        img_bytes = await loop.run_in_executor(None, decode_b64, frame)
+    if not img_bytes:
+        metrics.incr('invalid')
+        return None
+    cache = get_frame_cache()
+    key = cache_key(img_bytes, roi, max_side, _encoder_name()) if cache is not None else None
+    if key is not None:
+        found, emb = await cache.aget(key)
+        if found:
+            metrics.incr('frame_cache_hit')
+            if emb is None:
+                metrics.incr('no_face')
+            return emb
+    thresholds = quality_thresholds()
+    if thresholds is not None:
+        # Las métricas se registran aquí: el executor no hereda el contexto de la petición
+        started = time.perf_counter()
+        rejected = await loop.run_in_executor(None, check_quality, img_bytes, thresholds)
+        metrics.record('quality', time.perf_counter() - started)
+        if rejected is not None:
+            _count_rejection(rejected)
+            raise PoorQualityFrame(rejected)
+    started = time.perf_counter()
+    if pool is None:
+        emb, timings, reason, worker_s = await loop.run_in_executor(
+            None, _timed_embedding_from_bytes, (img_bytes, roi, max_side))
+    else:
+        future = pool.submit(_timed_embedding_from_bytes, (img_bytes, roi, max_side))
+        try:
+            emb, timings, reason, worker_s = await asyncio.wait_for(asyncio.wrap_future(future), timeout=pool.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            logging.getLogger('facial').warning('encoder: trabajo excedió %ss', pool.timeout)
+            raise EncoderTimeout()
+        except BrokenProcessPool:
+            raise pool._broken(future)
+    _record_result(timings, reason, worker_s, time.perf_counter() - started)
+    if key is not None:
+        await cache.aset(key, emb)
+    return emb
+
+
+async def aencode_frames(frames, positions=None):
+    """Versión asíncrona de encode_frames. El lote corre en un hilo con una copia del
+    contexto de la petición (asyncio.to_thread), así sus métricas llegan a Server-Timing.
+    """
+    return await asyncio.to_thread(encode_frames, frames, positions)
+
+
+async def aiter_encode_frames(frames, positions=None, prefetch=None):
+    """Versión asíncrona de iter_encode_frames (mismas tuplas): tareas aencode_frame
+    con a lo sumo `prefetch` en curso; al cerrar el generador se cancelan las pendientes.
+    """
+    positions = positions or []
+    pool = get_encoder_pool()
+    prefetch = max(prefetch or (pool.workers if pool is not None else 1), 1)
+    pending = deque()
+    next_index = 0
+    try:
+        while next_index < len(frames) or pending:
+            while next_index < len(frames) and len(pending) < prefetch:
+                position = positions[next_index] if next_index < len(positions) else None
+                pending.append((next_index, asyncio.ensure_future(aencode_frame(frames[next_index], position))))
+                next_index += 1
+            i, task = pending.popleft()
+            try:
+                emb, rejected = await task, None
+            except PoorQualityFrame as e:
+                emb, rejected = None, e.reason
+            yield i, emb, rejected
+    finally:
+        for _, task in pending:
+            task.cancel()
+            # Recupera el resultado para que asyncio no registre excepciones sin leer
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
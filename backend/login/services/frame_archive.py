@@ -0,0 +1,110 @@
+"""Archivo local de los frames de enrolamiento, direccionado por contenido.
+
+Con FACIAL_FRAME_ARCHIVE_DIR configurado, register_view (y bulk_enroll) guardan
+cada frame de enrolamiento como <raíz>/<ab>/<cd>/<digest><ext>, con digest el
+blake2b de los bytes de la imagen: el mismo frame se guarda una sola vez y
+un archivo existente nunca se reescribe. JPEG, PNG y WebP ya están comprimidos
+y se guardan tal cual; cualquier otro formato se comprime con zlib ('.z').
+
+El usuario conserva en `enrollment_frames` la lista de {frame: digest,
+position: ...}, suficiente para que `manage.py reembed_users` recalcule sus
+embeddings con el codificador actual sin volver a enrolarlo.
+
+Sin dependencias de Django: los procesos del pool de re-embedding lo importan
+con la ruta de la raíz ya resuelta.
+"""
+import hashlib
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Optional
+
+
+# Firmas de formatos que ya vienen comprimidos (no vale la pena recomprimir)
+_COMPRESSED_FORMATS = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+)
+_ZLIB_SUFFIX = '.z'
+
+
+def frame_digest(img_bytes) -> str:
+    return hashlib.blake2b(img_bytes, digest_size=20).hexdigest()
+
+
+def _suffix(img_bytes):
+    for magic, suffix in _COMPRESSED_FORMATS:
+        if img_bytes.startswith(magic):
+            return suffix
+    if img_bytes[:4] == b'RIFF' and img_bytes[8:12] == b'WEBP':
+        return '.webp'
+    return _ZLIB_SUFFIX
+
+
+class FrameArchive:
+    """Almacén de frames en disco bajo `root`."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _dir(self, digest):
+        return self.root / digest[:2] / digest[2:4]
+
+    def store(self, img_bytes) -> str:
+        """Guarda el frame (si no estaba) y devuelve su digest."""
+        digest = frame_digest(img_bytes)
+        suffix = _suffix(img_bytes)
+        folder = self._dir(digest)
+        path = folder / f'{digest}{suffix}'
+        if path.exists():
+            return digest
+        folder.mkdir(parents=True, exist_ok=True)
+        data = zlib.compress(img_bytes, 6) if suffix == _ZLIB_SUFFIX else img_bytes
+        # Escritura atómica: un lector nunca ve un archivo a medias
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest
+
+    def path(self, digest) -> Optional[Path]:
+        folder = self._dir(digest)
+        for candidate in folder.glob(f'{digest}.*') if folder.is_dir() else ():
+            if not candidate.name.startswith('.'):
+                return candidate
+        return None
+
+    def load(self, digest) -> Optional[bytes]:
+        """Bytes originales del frame (None si no está archivado)."""
+        path = self.path(digest)
+        if path is None:
+            return None
+        data = path.read_bytes()
+        return zlib.decompress(data) if path.suffix == _ZLIB_SUFFIX else data
+
+
+def get_frame_archive() -> Optional[FrameArchive]:
+    """Archivo configurado por settings (None si FACIAL_FRAME_ARCHIVE_DIR está vacío)."""
+    from django.conf import settings
+    root = getattr(settings, 'FACIAL_FRAME_ARCHIVE_DIR', None)
+    return FrameArchive(root) if root else None
+
+
+def archive_frames(archive, frames, positions=None):
+    """Archiva frames (bytes) y devuelve las entradas para `Usuario.enrollment_frames`."""
+    positions = positions or []
+    entries = []
+    for i, img_bytes in enumerate(frames):
+        if not img_bytes:
+            continue
+        entries.append({
+            'frame': archive.store(img_bytes),
+            'position': positions[i] if i < len(positions) else None,
+        })
+    return entries
@@ -0,0 +1,189 @@
+"""Caché de embeddings por contenido del frame.
+
+Los clientes reintentan /api/login/ con el mismo frame tras errores transitorios
+y /api/encode/ suele recibir un frame que se vuelve a codificar enseguida. La
+clave es un hash rápido (blake2b) de los bytes de imagen ya decodificados más
+los parámetros que cambian el resultado (ROI, max_side, tipo de codificador),
+así que un acierto evita imdecode, detección y codificación por completo.
+También se cachea "sin rostro" para no repetir una detección fallida.
+
+Backends (FACIAL_FRAME_CACHE):
+  'local'  -> LRU + TTL en memoria del proceso.
+  'django' -> framework de caché de Django (alias FACIAL_FRAME_CACHE_ALIAS),
+              compartido entre workers si el backend lo es (Redis, Memcached).
+  ''       -> desactivada.
+
+Sin importar Django al cargar: el módulo lo usa services.encoder.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from .lazy import np
+
+
+KEY_PREFIX = 'facial:frame:'
+# Valor almacenado para frames en los que no se detectó rostro
+_NO_FACE = b''
+
+
+def cache_key(img_bytes, roi=None, max_side=0, encoder='') -> str:
+    """Clave de contenido: blake2b de la imagen + parámetros del codificador."""
+    digest = hashlib.blake2b(img_bytes, digest_size=16)
+    digest.update(f'|{roi!r}|{max_side}|{encoder}'.encode('ascii'))
+    return KEY_PREFIX + digest.hexdigest()
+
+
+def _dump(emb) -> bytes:
+    return _NO_FACE if emb is None else np.asarray(emb, dtype=np.float32).tobytes()
+
+
+def _load(value):
+    """Devuelve (encontrado, embedding); embedding None = frame sin rostro."""
+    if value is None:
+        return False, None
+    if value == _NO_FACE:
+        return True, None
+    return True, np.frombuffer(value, dtype=np.float32)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class LocalFrameCache:
+    """LRU + TTL en memoria del proceso (mismo esquema que la caché de galerías)."""
+
+    backend = 'local'
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = _Stats()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clave -> (expira_en, bytes)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self.stats.record(entry is not None)
+        return _load(entry[1] if entry is not None else None)
+
+    def set(self, key, emb):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, _dump(emb))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, emb):
+        self.set(key, emb)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'backend': self.backend, 'size': size, 'max_entries': self.max_entries, 'ttl': self.ttl, **self.stats.as_dict()}
+
+
+class DjangoFrameCache:
+    """Sobre el framework de caché de Django; los contadores son por proceso."""
+
+    backend = 'django'
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+        self.stats = _Stats()
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        value = self._cache.get(key)
+        self.stats.record(value is not None)
+        return _load(value)
+
+    def set(self, key, emb):
+        self._cache.set(key, _dump(emb), timeout=self.ttl)
+
+    async def aget(self, key):
+        value = await self._cache.aget(key)
+        self.stats.record(value is not None)
+        return _load(value)
+
+    async def aset(self, key, emb):
+        await self._cache.aset(key, _dump(emb), timeout=self.ttl)
+
+    def info(self):
+        return {'backend': self.backend, 'alias': self.alias, 'ttl': self.ttl, **self.stats.as_dict()}
+
+
+_frame_cache = None  # None = sin configurar, False = desactivada
+_frame_cache_lock = threading.Lock()
+
+
+def get_frame_cache():
+    """Caché configurada por settings (None si FACIAL_FRAME_CACHE está vacío)."""
+    global _frame_cache
+    if _frame_cache is not None:
+        return _frame_cache or None
+    from django.conf import settings
+    backend = getattr(settings, 'FACIAL_FRAME_CACHE', 'local')
+    ttl = getattr(settings, 'FACIAL_FRAME_CACHE_TTL', 60)
+    with _frame_cache_lock:
+        if _frame_cache is None:
+            if backend == 'local':
+                _frame_cache = LocalFrameCache(getattr(settings, 'FACIAL_FRAME_CACHE_SIZE', 512), ttl)
+            elif backend == 'django':
+                _frame_cache = DjangoFrameCache(getattr(settings, 'FACIAL_FRAME_CACHE_ALIAS', 'default'), ttl)
+            elif not backend:
+                _frame_cache = False
+            else:
+                raise ValueError(f'FACIAL_FRAME_CACHE desconocido: {backend!r}')
+    return _frame_cache or None
+
+
+def reset_frame_cache():
+    """Olvida la caché configurada (p.ej. tras cambiar settings en pruebas)."""
+    global _frame_cache
+    with _frame_cache_lock:
+        _frame_cache = None
+
+
+def frame_cache_info():
+    cache = get_frame_cache()
+    return cache.info() if cache is not None else {'backend': None}
@@ -0,0 +1,468 @@
+"""Índice de embeddings para identificación 1:N.
+
+Apila todos los embeddings registrados en una sola matriz float32 (filas x 128)
+junto a un mapa fila -> usuario. La búsqueda usa la expansión
+||a - b||^2 = ||a||^2 - 2 a·b + ||b||^2, de modo que el costo dominante es un
+único producto matriz-vector (BLAS), seguido de selección top-k con argpartition.
+Con FACIAL_INDEX_DTYPE = float16 o int8 la matriz se guarda cuantizada (ver
+services.quantize); en int8 la escala por dimensión es común a todo el índice.
+
+Si FACIAL_INDEX_DIR está configurado, el índice se lee de archivos .npy generados
+por `manage.py build_face_index` y abiertos con memmap: todos los workers
+comparten una sola copia en el page cache del SO. Cada generación vive en su
+propio directorio y el puntero CURRENT se reemplaza atómicamente; los workers
+detectan la nueva generación y la intercambian sin reiniciar.
+
+Sin FACIAL_INDEX_DIR cada proceso construye su índice desde la BD. Los cambios de
+usuarios (registro, re-enrolamiento, baja, bulk_enroll, reembed_users) se publican
+en la caché compartida (FACIAL_EMBEDDING_CACHE) como un diario: un contador de
+generación y, por generación, los pks que cambiaron. Cada worker revisa el
+contador como máximo cada FACIAL_INDEX_CHECK_INTERVAL segundos y reemplaza solo
+las filas de esos usuarios. Si le falta una entrada del diario o hay demasiados
+cambios, reconstruye el índice completo en un hilo aparte y sigue respondiendo con
+el anterior mientras tanto. Sin caché compartida, la reconstrucción es periódica
+(FACIAL_INDEX_REFRESH).
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .embeddings import EMBEDDING_DIMS, build_gallery, shared_cache
+from .lazy import np
+from .quantize import QuantizedMatrix, quantize, quantize_int8, row_sq_norms, sq_distances
+
+
+class EmbeddingIndex:
+    """Matriz apilada de embeddings con mapa fila -> id de usuario.
+    `scale` (por dimensión) solo existe si la matriz es int8.
+    """
+
+    def __init__(self, matrix, user_ids, sq_norms=None, generation=None, scale=None):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.scale = scale
+        if sq_norms is None:
+            sq_norms = row_sq_norms(matrix, scale)
+        self.sq_norms = sq_norms
+        self.generation = generation
+
+    def __len__(self):
+        return int(self.matrix.shape[0])
+
+    @classmethod
+    def from_queryset(cls, queryset, chunk_size=2000, mode=None):
+        """Construye el índice recorriendo usuarios por bloques, en el modo `mode`
+        (por defecto FACIAL_INDEX_DTYPE).
+        """
+        blocks, ids = [], []
+        for user in queryset.iterator(chunk_size=chunk_size):
+            try:
+                gallery = build_gallery(user, 'float32')
+            except Exception:
+                logging.getLogger('facial').exception('index: embeddings ilegibles user=%s', user.pk)
+                continue
+            if gallery is None or gallery.shape[1] != EMBEDDING_DIMS:
+                continue
+            blocks.append(gallery)
+            ids.append(np.full(gallery.shape[0], user.pk, dtype=np.int64))
+        if not blocks:
+            return cls(np.zeros((0, EMBEDDING_DIMS), dtype=np.float32), np.zeros(0, dtype=np.int64))
+        return cls.from_matrix(np.vstack(blocks), np.concatenate(ids), mode)
+
+    @classmethod
+    def from_matrix(cls, matrix, user_ids, mode=None):
+        """Índice a partir de una matriz float32, cuantizada según `mode`."""
+        quantized = quantize(matrix, mode or index_dtype())
+        if isinstance(quantized, QuantizedMatrix):
+            return cls(quantized.data, user_ids, quantized.sq_norms, scale=quantized.scale)
+        return cls(quantized, user_ids)
+
+    def replace_users(self, user_ids, matrix, row_ids):
+        """Índice nuevo sin las filas de `user_ids` y con las filas float32 de `matrix`
+        (usuario de cada fila en `row_ids`). No modifica este índice: las búsquedas en
+        curso siguen usándolo. En int8 las filas nuevas usan la escala del índice.
+        """
+        keep = ~np.isin(self.user_ids, np.fromiter(user_ids, dtype=np.int64))
+        data, ids, norms = self.matrix[keep], self.user_ids[keep], self.sq_norms[keep]
+        if len(matrix):
+            if self.scale is not None:
+                rows = quantize_int8(matrix, self.scale)[0]
+            else:
+                rows = np.asarray(matrix, dtype=self.matrix.dtype)
+            data = np.concatenate([data, rows])
+            ids = np.concatenate([ids, np.asarray(row_ids, dtype=np.int64)])
+            norms = np.concatenate([norms, row_sq_norms(rows, self.scale)])
+        return EmbeddingIndex(data, ids, norms, scale=self.scale)
+
+    def search(self, live_emb, k=5):
+        """Devuelve hasta k pares (user_id, distancia) ordenados, uno por usuario."""
+        if not len(self):
+            return []
+        live = np.asarray(live_emb, dtype=np.float32)[:EMBEDDING_DIMS]
+        sq = sq_distances(self.matrix, live, self.scale, self.sq_norms)
+        # Se piden más filas que k porque un usuario aporta varias muestras
+        rows = min(len(sq), k * 8)
+        top = np.argpartition(sq, rows - 1)[:rows] if rows < len(sq) else np.arange(len(sq))
+        top = top[np.argsort(sq[top])]
+        results, seen = [], set()
+        for row in top:
+            uid = int(self.user_ids[row])
+            if uid in seen:
+                continue
+            seen.add(uid)
+            results.append((uid, float(np.sqrt(max(sq[row], 0.0)))))
+            if len(results) == k:
+                break
+        return results
+
+
+# Formato en disco: <dir>/gen-<N>/{embeddings,ids,norms}.npy (+ scale.npy en int8)
+# + <dir>/CURRENT (JSON)
+INDEX_FORMAT = 1
+_CURRENT = 'CURRENT'
+_FILES = ('embeddings', 'ids', 'norms')
+
+
+def _read_current(directory):
+    with open(Path(directory) / _CURRENT, encoding='utf-8') as fh:
+        meta = json.load(fh)
+    if meta.get('format') != INDEX_FORMAT:
+        raise ValueError(f"Formato de índice no soportado: {meta.get('format')}")
+    return meta
+
+
+def write_index(directory, index, keep=2):
+    """Escribe una nueva generación del índice y publica el puntero CURRENT.
+    Devuelve el número de generación escrito.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        generation = int(_read_current(directory)['generation']) + 1
+    except (FileNotFoundError, ValueError, KeyError):
+        generation = 1
+
+    final_dir = directory / f'gen-{generation}'
+    tmp_dir = directory / f'gen-{generation}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    arrays = {
+        'embeddings': np.ascontiguousarray(index.matrix),
+        'ids': np.ascontiguousarray(index.user_ids, dtype=np.int64),
+        'norms': np.ascontiguousarray(index.sq_norms, dtype=np.float32),
+    }
+    if index.scale is not None:
+        arrays['scale'] = np.ascontiguousarray(index.scale, dtype=np.float32)
+    for name in arrays:
+        with open(tmp_dir / f'{name}.npy', 'wb') as fh:
+            np.save(fh, arrays[name])
+            fh.flush()
+            os.fsync(fh.fileno())
+    # Restos de una ejecución interrumpida antes de publicar CURRENT
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+
+    meta = {
+        'format': INDEX_FORMAT,
+        'generation': generation,
+        'rows': int(arrays['embeddings'].shape[0]),
+        'dims': int(arrays['embeddings'].shape[1]),
+        'dtype': arrays['embeddings'].dtype.name,
+        'created': time.time(),
+    }
+    tmp_current = directory / f'{_CURRENT}.tmp'
+    with open(tmp_current, 'w', encoding='utf-8') as fh:
+        json.dump(meta, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_current, directory / _CURRENT)
+
+    # Las generaciones viejas pueden seguir mapeadas por workers: en POSIX borrar es seguro
+    for old in directory.glob('gen-*'):
+        suffix = old.name[len('gen-'):]
+        if suffix.isdigit() and int(suffix) <= generation - keep:
+            shutil.rmtree(old, ignore_errors=True)
+    return generation
+
+
+def load_index(directory):
+    """Abre la generación publicada en CURRENT con memmap de solo lectura."""
+    meta = _read_current(directory)
+    gen_dir = Path(directory) / f"gen-{meta['generation']}"
+    arrays = {name: np.load(gen_dir / f'{name}.npy', mmap_mode='r') for name in _FILES}
+    scale = np.load(gen_dir / 'scale.npy') if meta.get('dtype') == 'int8' else None
+    return EmbeddingIndex(arrays['embeddings'], arrays['ids'], arrays['norms'], generation=meta['generation'], scale=scale)
+
+
+def index_dtype():
+    """Modo del índice 1:N (FACIAL_INDEX_DTYPE, por defecto el de FACIAL_EMBEDDING_DTYPE)."""
+    return getattr(settings, 'FACIAL_INDEX_DTYPE', None) or getattr(settings, 'FACIAL_EMBEDDING_DTYPE', 'float32')
+
+
+_lock = threading.Lock()
+_index = None
+_current_stamp = None
+_next_check = 0.0
+
+
+def _current_signature(directory):
+    st = os.stat(Path(directory) / _CURRENT)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _get_disk_index(directory):
+    """Índice memmap; revisa CURRENT como máximo cada FACIAL_INDEX_CHECK_INTERVAL segundos."""
+    global _index, _current_stamp, _next_check
+    now = time.monotonic()
+    if _index is not None and now < _next_check:
+        return _index
+    with _lock:
+        if _index is not None and now < _next_check:
+            return _index
+        _next_check = now + getattr(settings, 'FACIAL_INDEX_CHECK_INTERVAL', 5)
+        try:
+            stamp = _current_signature(directory)
+        except FileNotFoundError:
+            logging.getLogger('facial').warning('index: no existe %s/%s; ejecute build_face_index', directory, _CURRENT)
+            _index = EmbeddingIndex(np.zeros((0, EMBEDDING_DIMS), dtype=np.float32), np.zeros(0, dtype=np.int64))
+            _current_stamp = None
+            return _index
+        if _index is None or stamp != _current_stamp:
+            previous = _index.generation if _index is not None else None
+            # Intercambio atómico: las búsquedas en curso conservan su referencia anterior
+            _index = load_index(directory)
+            _current_stamp = stamp
+            logging.getLogger('facial').info(
+                'index: generación %s cargada (anterior=%s, filas=%d)', _index.generation, previous, len(_index)
+            )
+        return _index
+
+
+def _db_queryset():
+    from ..models.models import Usuario
+    return Usuario.objects.filter(is_active=True).only('id', 'facial_embeddings_bin', 'facial_embeddings')
+
+
+def build_index_from_db(chunk_size=2000):
+    """Construye el índice con todos los usuarios activos de la BD."""
+    return EmbeddingIndex.from_queryset(_db_queryset().order_by('pk'), chunk_size=chunk_size)
+
+
+# Diario de cambios en la caché compartida (modo BD): contador de generación y, por
+# generación, la lista de pks que cambiaron o _FULL para reconstruir todo
+_GENERATION_KEY = 'facial:index:generation'
+_FULL = 'all'
+_generation = None  # generación del diario ya aplicada al índice del proceso
+_built_at = 0.0
+_rebuilding = False
+_pending = set()  # pks cambiados en este proceso durante una reconstrucción
+_build_lock = threading.Lock()
+
+
+def _change_key(generation):
+    return f'facial:index:change:{generation}'
+
+
+def _max_incremental():
+    return getattr(settings, 'FACIAL_INDEX_MAX_INCREMENTAL', 2000)
+
+
+def _read_generation(cache):
+    generation = cache.get(_GENERATION_KEY)
+    if generation is None:
+        cache.add(_GENERATION_KEY, 0, None)
+        generation = cache.get(_GENERATION_KEY)
+    return generation
+
+
+def _publish(pks):
+    """Agrega una entrada al diario; devuelve su generación (None sin caché compartida)."""
+    cache = shared_cache()
+    if cache is None:
+        return None
+    try:
+        _read_generation(cache)
+        generation = cache.incr(_GENERATION_KEY)
+        cache.set(_change_key(generation), _FULL if pks is None else sorted(pks),
+                  getattr(settings, 'FACIAL_EMBEDDING_CACHE_TTL', 86400))
+        return generation
+    except Exception as e:
+        logging.getLogger('facial').warning('index: no se pudo publicar el cambio: %s', e)
+        return None
+
+
+def _build_db_index():
+    """Construye el índice completo y lo instala con la generación del diario leída antes
+    de empezar: lo publicado durante la construcción se vuelve a aplicar después.
+    """
+    global _index, _generation, _built_at
+    generation = None
+    cache = shared_cache()
+    if cache is not None:
+        try:
+            generation = _read_generation(cache)
+        except Exception as e:
+            logging.getLogger('facial').warning('index: caché compartida no disponible: %s', e)
+    started = time.perf_counter()
+    index = build_index_from_db()
+    with _lock:
+        _index, _generation, _built_at = index, generation, time.monotonic()
+    logging.getLogger('facial').info(
+        'index: construido filas=%d generación=%s en %.2fs', len(index), generation, time.perf_counter() - started
+    )
+
+
+def _apply_users(pks, since=None, until=None):
+    """Reemplaza en el índice del proceso las filas de los usuarios `pks`, leídas de la BD.
+    Si el índice estaba en la generación `since`, queda en `until`.
+    """
+    global _index, _generation
+    rows = EmbeddingIndex.from_queryset(_db_queryset().filter(pk__in=pks), mode='float32')
+    with _lock:
+        if _index is None:
+            return
+        _index = _index.replace_users(pks, rows.matrix, rows.user_ids)
+        if until is not None and _generation is not None and _generation == since:
+            _generation = until
+
+
+def _rebuild_in_background():
+    """Reconstruye el índice en un hilo aparte; mientras tanto se sigue usando el actual."""
+    global _rebuilding
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+
+    def run():
+        global _rebuilding
+        from django.db import connection
+        try:
+            with _build_lock:
+                _build_db_index()
+        except Exception:
+            logging.getLogger('facial').exception('index: falló la reconstrucción')
+        finally:
+            with _lock:
+                _rebuilding = False
+                pending = set(_pending)
+                _pending.clear()
+        try:
+            if pending:
+                _apply_users(pending)
+        except Exception:
+            logging.getLogger('facial').exception('index: falló la actualización de usuarios')
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name='facial-index-rebuild', daemon=True).start()
+
+
+def _sync_db_index():
+    """Aplica lo publicado por otros procesos; revisa el diario como máximo cada
+    FACIAL_INDEX_CHECK_INTERVAL segundos.
+    """
+    global _next_check
+    now = time.monotonic()
+    if now < _next_check:
+        return
+    with _lock:
+        if now < _next_check:
+            return
+        _next_check = now + getattr(settings, 'FACIAL_INDEX_CHECK_INTERVAL', 5)
+        applied = _generation
+    cache = shared_cache()
+    if cache is None or applied is None:
+        if now - _built_at >= getattr(settings, 'FACIAL_INDEX_REFRESH', 300):
+            _rebuild_in_background()
+        return
+    try:
+        generation = cache.get(_GENERATION_KEY)
+        if generation == applied:
+            return
+        if generation is None or generation < applied or generation - applied > _max_incremental():
+            # La caché perdió el diario o hay demasiados cambios pendientes
+            _rebuild_in_background()
+            return
+        keys = [_change_key(g) for g in range(applied + 1, generation + 1)]
+        changes = cache.get_many(keys)
+    except Exception as e:
+        logging.getLogger('facial').warning('index: no se pudo leer el diario: %s', e)
+        return
+    pks, last = set(), applied
+    for position, key in enumerate(keys):
+        entry = changes.get(key)
+        if entry is None:
+            # La última entrada puede no estar escrita todavía (se reintenta en la próxima
+            # revisión); si falta una intermedia, expiró y hay que reconstruir
+            if any(later in changes for later in keys[position + 1:]):
+                _rebuild_in_background()
+                return
+            break
+        if entry == _FULL or len(pks) + len(entry) > _max_incremental():
+            _rebuild_in_background()
+            return
+        pks.update(entry)
+        last = applied + position + 1
+    if last == applied:
+        return
+    try:
+        _apply_users(pks, since=applied, until=last)
+    except Exception:
+        logging.getLogger('facial').exception('index: falló la actualización de usuarios')
+        return
+    logging.getLogger('facial').info('index: generación %d aplicada usuarios=%d', last, len(pks))
+
+
+def get_index():
+    """Índice del proceso: memmap compartido si hay FACIAL_INDEX_DIR, si no se construye
+    desde la BD (solo la primera vez bloquea) y se mantiene con el diario de cambios.
+    """
+    directory = getattr(settings, 'FACIAL_INDEX_DIR', None)
+    if directory:
+        return _get_disk_index(directory)
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _build_db_index()
+        return _index
+    _sync_db_index()
+    return _index
+
+
+def update_index_users(pks=None):
+    """Registra que cambiaron los embeddings o el estado de los usuarios `pks` (None:
+    todos). Publica el cambio para los demás workers y actualiza el índice del proceso
+    reemplazando solo esas filas. En modo memmap fuerza revisar CURRENT; los cambios de
+    la BD solo llegan al archivo al ejecutar build_face_index.
+    """
+    global _next_check
+    if getattr(settings, 'FACIAL_INDEX_DIR', None):
+        with _lock:
+            _next_check = 0.0
+        return
+    if pks is not None:
+        pks = {int(pk) for pk in pks}
+        if not pks:
+            return
+    generation = _publish(pks)
+    if _index is None:
+        return
+    if pks is None or len(pks) > _max_incremental():
+        _rebuild_in_background()
+        return
+    with _lock:
+        if _rebuilding:
+            _pending.update(pks)
+    _apply_users(pks, since=None if generation is None else generation - 1, until=generation)
+
+
+def invalidate_index():
+    """Todos los workers reconstruyen el índice (en segundo plano)."""
+    update_index_users(None)
@@ -0,0 +1,87 @@
+"""Importación diferida de numpy, cv2 y face_recognition.
+
+Importarlos al cargar los módulos hacía que cualquier comando de manage.py
+(migrate, check, shell) y cualquier proceso pagara su costo antes de hacer nada:
+numpy ~70 ms, cv2 ~20 ms y face_recognition bastante más, porque al importarse
+carga los modelos de dlib. Los servicios usan en su lugar estos sustitutos: el
+módulo real se importa en el primer acceso a un atributo y, a partir de ahí, sus
+atributos se copian al sustituto, de modo que `np.frombuffer` cuesta lo mismo que
+con el módulo real. `available(mod)` reemplaza a las comprobaciones `mod is None`.
+
+La carga explícita al arrancar el servidor está en services.warmup.
+
+Sin dependencias de Django.
+"""
+import importlib
+import logging
+import threading
+import time
+
+
+class LazyModule:
+    """Módulo que se importa al primer acceso a un atributo.
+    Si la importación falla, `available()` devuelve False y el acceso a un
+    atributo lanza ImportError.
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_error = None
+        self._lazy_seconds = None
+        self._lazy_lock = threading.Lock()
+
+    def _lazy_load(self):
+        """Módulo real (None si no se puede importar); lo importa una sola vez."""
+        if self._lazy_module is not None or self._lazy_error is not None:
+            return self._lazy_module
+        with self._lazy_lock:
+            if self._lazy_module is None and self._lazy_error is None:
+                started = time.perf_counter()
+                try:
+                    module = importlib.import_module(self._lazy_name)
+                except Exception as e:
+                    self._lazy_error = e
+                    logging.getLogger('facial').debug('lazy: %s no disponible (%s)', self._lazy_name, e)
+                else:
+                    self._lazy_seconds = time.perf_counter() - started
+                    # Los atributos quedan en el diccionario de la instancia: los accesos
+                    # siguientes no pasan por __getattr__
+                    for attr, value in vars(module).items():
+                        if not attr.startswith('_lazy_'):
+                            self.__dict__.setdefault(attr, value)
+                    self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        # Solo se llama para atributos que no están en la instancia
+        if attr.startswith('_lazy_'):
+            raise AttributeError(attr)
+        module = self._lazy_load()
+        if module is None:
+            raise ImportError(f'{self._lazy_name} no está disponible: {self._lazy_error}')
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = 'cargado' if self._lazy_module is not None else 'no disponible' if self._lazy_error else 'diferido'
+        return f'<módulo {self._lazy_name!r} ({state})>'
+
+
+def available(module: LazyModule) -> bool:
+    """True si el módulo se puede importar (lo importa si hacía falta)."""
+    return module._lazy_load() is not None
+
+
+def loaded(module: LazyModule) -> bool:
+    """True si el módulo ya se importó (sin importarlo)."""
+    return module._lazy_module is not None
+
+
+def import_seconds(module: LazyModule):
+    """Segundos que tomó importar el módulo (None si no se importó)."""
+    return module._lazy_seconds
+
+
+np = LazyModule('numpy')
+cv2 = LazyModule('cv2')
+face_recognition = LazyModule('face_recognition')
@@ -0,0 +1,163 @@
+"""Tiempos por etapa del pipeline facial y métricas agregadas del proceso.
+
+Cada petición instrumentada (ver login.middleware.facial_timing_middleware) abre
+un registro en una ContextVar; `stage('detect')` y `record(...)` anotan ahí la
+duración de cada etapa, que termina en la cabecera Server-Timing y en los
+histogramas del proceso. Fuera de una petición instrumentada (o con
+FACIAL_METRICS_ENABLED = False) `stage()` devuelve un contexto vacío: el costo
+es una lectura de ContextVar.
+
+Los histogramas y contadores son por proceso; con varios workers, Prometheus
+debe raspar cada uno (o sumarse en el agregador). /metrics/ los expone en
+formato de texto de Prometheus.
+
+Sin dependencias de Django.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+
+# Límites superiores (segundos) de los buckets de los histogramas
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = contextvars.ContextVar('facial_timings', default=None)
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus (buckets fijos, suma y cuenta)."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms = {}  # (métrica, etiqueta) -> Histogram
+_counters = {}  # (métrica, etiqueta) -> int
+
+
+def observe(metric, label, seconds):
+    with _lock:
+        hist = _histograms.get((metric, label))
+        if hist is None:
+            hist = _histograms[(metric, label)] = Histogram()
+        hist.observe(seconds)
+
+
+def incr(event, amount=1):
+    """Cuenta un evento (no_face, mismatch, position, ...) si la petición está instrumentada."""
+    if _timings.get() is None:
+        return
+    with _lock:
+        _counters[('facial_events_total', event)] = _counters.get(('facial_events_total', event), 0) + amount
+
+
+def begin():
+    """Abre el registro de tiempos de la petición; devuelve el token para end()."""
+    return _timings.set({})
+
+
+def end(token):
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or {}
+
+
+def active() -> bool:
+    return _timings.get() is not None
+
+
+def record(name, seconds):
+    """Anota la duración de una etapa medida por otro medio (p.ej. dentro del pool)."""
+    timings = _timings.get()
+    if timings is None:
+        return
+    timings[name] = timings.get(name, 0.0) + seconds
+    observe('facial_stage_seconds', name, seconds)
+
+
+class _Stage:
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        observe('facial_stage_seconds', self.name, elapsed)
+        return False
+
+
+def stage(name):
+    """Contexto que mide una etapa: `with stage('compare'): ...`."""
+    timings = _timings.get()
+    if timings is None:
+        return _NOOP
+    return _Stage(name, timings)
+
+
+def server_timing(timings) -> str:
+    """Valor de la cabecera Server-Timing (duraciones en milisegundos)."""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items())
+
+
+def _label_name(metric):
+    if metric == 'facial_stage_seconds':
+        return 'stage'
+    if metric == 'facial_request_seconds':
+        return 'view'
+    return 'event'
+
+
+def render_prometheus() -> str:
+    """Histogramas y contadores en formato de texto de Prometheus (0.0.4)."""
+    with _lock:
+        histograms = sorted((key, (list(h.counts), h.total, h.count)) for key, h in _histograms.items())
+        counters = sorted(_counters.items())
+    lines = []
+    seen = set()
+    for (metric, label), (counts, total, count) in histograms:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f'# TYPE {metric} histogram')
+        name = _label_name(metric)
+        cumulative = 0
+        for bound, n in zip(BUCKETS, counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{{name}="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{name}="{label}",le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{{name}="{label}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{{name}="{label}"}} {count}')
+    for (metric, label), value in counters:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric}{{{_label_name(metric)}="{label}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Vacía histogramas y contadores del proceso."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
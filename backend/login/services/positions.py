@@ -0,0 +1,111 @@
+"""Validación vectorizada de la posición del rostro.
+
+Las posiciones registradas de cada usuario (listas de dicts {x, y, scale} y/o
+{roll, pitch, yaw, dist}) se normalizan una sola vez a matrices float64 y se
+guardan en la caché de services.embeddings junto a la galería. Validar una
+posición viva es entonces una comparación |registradas - viva| <= tolerancia
+sobre toda la matriz, y match_many hace lo mismo para varios candidatos a la vez
+(identificación 1:N).
+"""
+from typing import NamedTuple
+
+from .lazy import np
+
+
+XYS_KEYS = ('x', 'y', 'scale')
+ANGLE_KEYS = ('roll', 'pitch', 'yaw', 'dist')
+
+
+class Poses(NamedTuple):
+    """Posiciones registradas: xys (n x 3) y angles (m x 4), float64."""
+
+    xys: 'np.ndarray'
+    angles: 'np.ndarray'
+
+
+def _rows(positions, keys):
+    rows = []
+    for p in positions:
+        if not isinstance(p, dict) or not all(k in p for k in keys):
+            continue
+        try:
+            rows.append([float(p[k]) for k in keys])
+        except (TypeError, ValueError):
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, len(keys))
+
+
+def poses_from_list(positions) -> Poses:
+    return Poses(_rows(positions, XYS_KEYS), _rows(positions, ANGLE_KEYS))
+
+
+def user_positions(user):
+    """Lista de posiciones registradas; sin colección, la posición de compatibilidad."""
+    return user.positions or ([] if user.position_data is None else [user.position_data])
+
+
+def build_poses(user) -> Poses:
+    return poses_from_list(user_positions(user))
+
+
+def live_vectors(live_pos):
+    """(xys, angles) de la posición viva; cada uno None si faltan claves o no es numérico."""
+    if not isinstance(live_pos, dict):
+        return None, None
+    vectors = []
+    for keys in (XYS_KEYS, ANGLE_KEYS):
+        try:
+            vectors.append(np.array([float(live_pos[k]) for k in keys], dtype=np.float64)
+                           if all(k in live_pos for k in keys) else None)
+        except (TypeError, ValueError):
+            vectors.append(None)
+    return vectors[0], vectors[1]
+
+
+def tolerances(attempts):
+    """Tolerancias por eje (xys, angles) con leve adaptación por intentos fallidos."""
+    attempts = attempts or 0
+    tol_xy = max(0.05, 0.10 - attempts * 0.01)      # 0.10 -> 0.05
+    tol_scale = max(0.08, 0.15 - attempts * 0.01)   # 0.15 -> 0.08
+    tol_ang = max(8, 15 - attempts * 1)
+    tol_dist = max(0.12, 0.22 - attempts * 0.02)
+    return (
+        np.array([tol_xy, tol_xy, tol_scale], dtype=np.float64),
+        np.array([tol_ang, tol_ang, tol_ang, tol_dist], dtype=np.float64),
+    )
+
+
+def matches(poses: Poses, live_pos, tol=None, attempts=0) -> bool:
+    """True si alguna posición registrada está dentro de tolerancia en todos sus ejes."""
+    live_xys, live_angles = live_vectors(live_pos)
+    tol_xys, tol_angles = tol if tol is not None else tolerances(attempts)
+    if live_xys is not None and poses.xys.size and (np.abs(poses.xys - live_xys) <= tol_xys).all(axis=1).any():
+        return True
+    if live_angles is not None and poses.angles.size and (np.abs(poses.angles - live_angles) <= tol_angles).all(axis=1).any():
+        return True
+    return False
+
+
+def match_many(pose_sets, live_pos, attempts) -> 'np.ndarray':
+    """Valida la posición viva contra varios usuarios en una sola pasada.
+    `pose_sets` y `attempts` están alineados por candidato; devuelve un array bool.
+    """
+    n = len(pose_sets)
+    result = np.zeros(n, dtype=bool)
+    if not n:
+        return result
+    live = live_vectors(live_pos)
+    tol_tables = [tolerances(a) for a in attempts]
+    for kind, vector in enumerate(live):
+        if vector is None:
+            continue
+        blocks = [poses[kind] for poses in pose_sets]
+        counts = np.array([len(b) for b in blocks])
+        if not counts.sum():
+            continue
+        owner = np.repeat(np.arange(n), counts)
+        stacked = np.concatenate(blocks)
+        tol = np.stack([table[kind] for table in tol_tables])[owner]
+        ok = (np.abs(stacked - vector) <= tol).all(axis=1)
+        result |= np.bincount(owner[ok], minlength=n) > 0
+    return result
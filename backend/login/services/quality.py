@@ -0,0 +1,87 @@
+"""Control rápido de calidad del frame antes de la detección de rostros.
+
+Buena parte de los frames de login y enrolamiento llegan movidos, oscuros o
+quemados, y aun así pasaban por la detección HOG y el embedding completo antes de
+fallar. Aquí se miden sobre una copia reducida en escala de grises (el JPEG se
+decodifica ya reducido, sin pasar por la imagen a color completa):
+
+- nitidez: varianza del Laplaciano (bajo = borroso);
+- brillo: media de la luminancia (0-255);
+- contraste: desviación estándar de la luminancia.
+
+La copia se lleva siempre al mismo lado mayor (`max_side`), de modo que la
+nitidez es comparable entre resoluciones. Cuesta alrededor de un milisegundo
+para un frame de webcam.
+
+Sin dependencias de Django: los umbrales llegan ya resueltos (ver
+encoder.quality_thresholds).
+"""
+from typing import NamedTuple, Optional
+
+from .lazy import available, cv2, np
+
+
+# Motivos de rechazo, en el orden en que se evalúan: primero la exposición
+# (un frame oscuro también parece borroso), luego el contraste y la nitidez
+REASONS = ('too_dark', 'too_bright', 'low_contrast', 'blurry')
+
+
+class PoorQualityFrame(Exception):
+    """El frame no pasa el control de calidad; `reason` es uno de REASONS."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Thresholds(NamedTuple):
+    max_side: int = 200
+    min_sharpness: float = 15.0
+    min_brightness: float = 40.0
+    max_brightness: float = 215.0
+    min_contrast: float = 12.0
+
+
+class FrameQuality(NamedTuple):
+    sharpness: float
+    brightness: float
+    contrast: float
+
+
+def measure(img_bytes, max_side=200) -> Optional[FrameQuality]:
+    """Nitidez, brillo y contraste del frame (None si no se puede decodificar)."""
+    if not available(np) or not img_bytes:
+        return None
+    gray = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is None:
+        return None
+    h, w = gray.shape
+    scale = max_side / max(h, w) if max_side else 1.0
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(round(w * scale), 1), max(round(h * scale), 1)), interpolation=cv2.INTER_AREA)
+    mean, std = cv2.meanStdDev(gray)
+    lap_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))[1]
+    return FrameQuality(float(lap_std[0, 0]) ** 2, float(mean[0, 0]), float(std[0, 0]))
+
+
+def rejection_reason(quality: FrameQuality, thresholds: Thresholds) -> Optional[str]:
+    if quality.brightness < thresholds.min_brightness:
+        return 'too_dark'
+    if quality.brightness > thresholds.max_brightness:
+        return 'too_bright'
+    if quality.contrast < thresholds.min_contrast:
+        return 'low_contrast'
+    if quality.sharpness < thresholds.min_sharpness:
+        return 'blurry'
+    return None
+
+
+def check_quality(img_bytes, thresholds: Thresholds = Thresholds()) -> Optional[str]:
+    """Motivo de rechazo del frame o None si es utilizable.
+    Un frame que no se puede decodificar no se rechaza aquí: el codificador lo
+    reporta como 'invalid'.
+    """
+    quality = measure(img_bytes, thresholds.max_side)
+    if quality is None:
+        return None
+    return rejection_reason(quality, thresholds)
@@ -0,0 +1,130 @@
+"""Cuantización de embeddings (float16 e int8 con escala por dimensión).
+
+Con muchas muestras en memoria (galerías cacheadas, índice 1:N) el costo de
+comparar lo domina el ancho de banda de memoria, no la aritmética. Los modos:
+
+- float32: sin pérdida (por defecto).
+- float16: la mitad de memoria; error relativo ~5e-4, despreciable frente a los
+  umbrales. numpy convierte float16 a float32 sin instrucciones vectoriales, así
+  que en un índice 1:N grande la búsqueda es varias veces más lenta que en float32.
+- int8: un cuarto de memoria. Cada dimensión d se guarda como q = round(v / s[d])
+  con s[d] = max|v[:, d]| / 127. El redondeo suma un error uniforme de ancho
+  s[d] por dimensión, que en promedio agranda la distancia al cuadrado en
+  sum(s**2) / 12; `sq_distances` resta ese sesgo para que los umbrales de
+  float32 sigan valiendo. El desplazamiento residual se mide con
+  `manage.py calibrate_quantization` y se compensa con FACIAL_QUANT_THRESHOLD_OFFSET.
+
+Sin dependencias de Django.
+"""
+from .lazy import np
+
+
+MODES = ('float32', 'float16', 'int8')
+INT8_MAX = 127
+# Filas por bloque al convertir int8/float16 a float32 en el producto matriz-vector:
+# un bloque (~512 KB) cabe en caché y el producto int8 supera al de float32 cuando
+# la matriz no cabe en caché (el costo es ancho de banda de memoria)
+BLOCK_ROWS = 1024
+
+
+def int8_scale(matrix):
+    """Escala por dimensión (float32) para cuantizar `matrix` a int8 sin saturar."""
+    peak = np.abs(np.asarray(matrix, dtype=np.float32)).max(axis=0) if len(matrix) else np.zeros(matrix.shape[1])
+    scale = (peak / INT8_MAX).astype(np.float32)
+    # Dimensiones constantes en cero: cualquier escala positiva sirve
+    scale[scale == 0] = 1.0 / INT8_MAX
+    return scale
+
+
+def quantize_int8(matrix, scale=None):
+    """(q int8, escala float32) con q = round(matrix / escala)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if scale is None:
+        scale = int8_scale(matrix)
+    q = np.clip(np.rint(matrix / scale), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return q, scale
+
+
+def dequantize(data, scale=None):
+    """Matriz float32 a partir de datos float16/float32, o int8 con su escala."""
+    if scale is None:
+        return np.asarray(data, dtype=np.float32)
+    return data.astype(np.float32) * scale
+
+
+def rounding_noise(scale) -> float:
+    """Sesgo esperado de la distancia al cuadrado por el redondeo a int8."""
+    if scale is None:
+        return 0.0
+    return float(np.dot(scale, scale) / 12.0)
+
+
+def row_sq_norms(data, scale=None):
+    """||fila||^2 de la matriz (descuantizada) en float32, por bloques."""
+    out = np.empty(len(data), dtype=np.float32)
+    for start in range(0, len(data), BLOCK_ROWS):
+        block = dequantize(data[start:start + BLOCK_ROWS], scale)
+        out[start:start + BLOCK_ROWS] = np.einsum('ij,ij->i', block, block)
+    return out
+
+
+def sq_distances(data, live, scale=None, sq_norms=None):
+    """Distancias al cuadrado (corregidas por redondeo en int8) de cada fila a `live`.
+
+    Usa ||a - b||^2 = ||a||^2 - 2 a·b + ||b||^2; para int8 el producto se hace
+    contra live * escala, sin descuantizar la matriz completa.
+    """
+    live = np.asarray(live, dtype=np.float32)
+    if sq_norms is None:
+        sq_norms = row_sq_norms(data, scale)
+    probe = live * scale if scale is not None else live
+    if data.dtype == np.float32:
+        dots = data @ probe
+    else:
+        dots = np.empty(len(data), dtype=np.float32)
+        buffer = np.empty((min(BLOCK_ROWS, len(data)), data.shape[1]), dtype=np.float32)
+        for start in range(0, len(data), BLOCK_ROWS):
+            block = data[start:start + BLOCK_ROWS]
+            target = buffer[:len(block)]
+            np.copyto(target, block, casting='unsafe')
+            dots[start:start + BLOCK_ROWS] = target @ probe
+    return sq_norms - 2.0 * dots + float(live @ live) - rounding_noise(scale)
+
+
+class QuantizedMatrix:
+    """Matriz int8 con su escala por dimensión y las normas de sus filas."""
+
+    __slots__ = ('data', 'scale', 'sq_norms')
+
+    def __init__(self, data, scale, sq_norms=None):
+        self.data = data
+        self.scale = scale
+        self.sq_norms = row_sq_norms(data, scale) if sq_norms is None else sq_norms
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.scale.nbytes + self.sq_norms.nbytes
+
+    def __len__(self):
+        return len(self.data)
+
+    def dequantize(self):
+        return dequantize(self.data, self.scale)
+
+    def sq_distances(self, live):
+        return sq_distances(self.data, live, self.scale, self.sq_norms)
+
+
+def quantize(matrix, mode):
+    """Convierte una matriz float32 al modo indicado (ndarray o QuantizedMatrix)."""
+    if mode == 'float32':
+        return np.ascontiguousarray(matrix, dtype=np.float32)
+    if mode == 'float16':
+        return np.ascontiguousarray(matrix, dtype=np.float16)
+    if mode == 'int8':
+        return QuantizedMatrix(*quantize_int8(matrix))
+    raise ValueError(f'Modo de cuantización desconocido: {mode!r}')
@@ -0,0 +1,76 @@
+"""Calentamiento explícito del pipeline facial al arrancar un worker del servidor.
+
+Con las importaciones diferidas (services.lazy) nada pesado se carga al iniciar
+Django; sin calentamiento lo pagaría la primera petición de cada worker:
+importar numpy/cv2/face_recognition (que carga los modelos de dlib), la primera
+detección y el primer embedding, y el arranque de los procesos del pool.
+`warm_up()` lo hace antes de recibir tráfico y mide cada paso: el frame
+sintético se codifica dos veces, en frío y en caliente, y la diferencia es lo
+que se ahorra la primera petición.
+
+Se llama desde core/wsgi.py y core/asgi.py (servidores y runserver), no desde
+AppConfig.ready(): así migrate, check y el resto de comandos no lo pagan.
+Se desactiva con FACIAL_WARMUP = False.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from .encoder import dummy_encode, get_encoder_pool, warmup_frame
+from .lazy import available, cv2, face_recognition, import_seconds, np
+from .quality import check_quality
+
+
+_report = None
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def warm_up() -> dict:
+    """Carga librerías y modelos, codifica un frame sintético (frío y caliente) y
+    arranca el pool de codificación. Devuelve los tiempos en milisegundos; un
+    fallo se registra y no impide arrancar el servidor.
+    """
+    global _report
+    log = logging.getLogger('facial')
+    started = time.perf_counter()
+    report = {'imports': {}, 'encode_cold': None, 'encode_warm': None, 'pool': None}
+    try:
+        for name, module in (('numpy', np), ('cv2', cv2), ('face_recognition', face_recognition)):
+            report['imports'][name] = _ms(import_seconds(module)) if available(module) else None
+        img_bytes = warmup_frame()
+        if img_bytes is not None:
+            check_quality(img_bytes)
+            max_side = getattr(settings, 'FACIAL_DETECT_MAX_SIDE', 0)
+            for step in ('encode_cold', 'encode_warm'):
+                step_started = time.perf_counter()
+                dummy_encode(img_bytes, max_side)
+                report[step] = _ms(time.perf_counter() - step_started)
+        pool = get_encoder_pool()
+        if pool is not None:
+            step_started = time.perf_counter()
+            pool.warm()
+            report['pool'] = _ms(time.perf_counter() - step_started)
+    except Exception as e:
+        log.exception('warmup: falló el calentamiento (%s); el servidor arranca igual', e)
+    report['total'] = _ms(time.perf_counter() - started)
+    _report = report
+    log.info(
+        'warmup: importaciones %s ms; codificación frío=%s ms caliente=%s ms; pool=%s ms; total=%s ms',
+        report['imports'], report['encode_cold'], report['encode_warm'], report['pool'], report['total'],
+    )
+    return report
+
+
+def warm_up_if_enabled():
+    """Punto de entrada de core/wsgi.py y core/asgi.py."""
+    if getattr(settings, 'FACIAL_WARMUP', True):
+        warm_up()
+
+
+def warmup_report():
+    """Resultado del último calentamiento del proceso (None si no se hizo)."""
+    return _report
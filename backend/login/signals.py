@@ -0,0 +1,51 @@
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models.models import Usuario
+from .services.attempts import SKIP_LAST_LOGIN
+from .services.embeddings import invalidate_gallery
+from .services.index import update_index_users
+
+
+# La galería cacheada se invalida con Usuario.VERSIONED_FIELDS (embeddings y posiciones);
+# los embeddings y is_active cambian además el índice 1:N
+EMBEDDING_FIELDS = {'facial_embeddings_bin', 'facial_embeddings', 'facial_data'}
+INDEX_FIELDS = EMBEDDING_FIELDS | {'is_active'}
+
+
+@receiver(post_save, sender=Usuario)
+def _drop_cached_gallery(sender, instance, update_fields=None, **kwargs):
+    # Usuario.save() deja en _saved_changes los campos que realmente cambiaron
+    changed = getattr(instance, '_saved_changes', None)
+    if changed is None:
+        changed = Usuario.TRACKED_FIELDS if update_fields is None else Usuario.TRACKED_FIELDS.intersection(update_fields)
+    if Usuario.VERSIONED_FIELDS.intersection(changed):
+        invalidate_gallery(instance.pk)
+    if INDEX_FIELDS.intersection(changed):
+        # Solo se reemplazan las filas del usuario, y después del commit: el índice las relee de la BD
+        pk = instance.pk
+        transaction.on_commit(lambda: update_index_users([pk]))
+
+
+@receiver(post_delete, sender=Usuario)
+def _drop_deleted_gallery(sender, instance, **kwargs):
+    invalidate_gallery(instance.pk)
+    pk = instance.pk
+    transaction.on_commit(lambda: update_index_users([pk]))
+
+
+def _update_last_login(sender, user, **kwargs):
+    """update_last_login de Django, salvo para el login facial, que escribe
+    last_login junto con failed_attempts en un solo UPDATE (services.attempts).
+    """
+    if getattr(user, SKIP_LAST_LOGIN, False):
+        return
+    update_last_login(sender, user, **kwargs)
+
+
+# Reemplaza el receptor que registra django.contrib.auth (mismo dispatch_uid)
+if user_logged_in.disconnect(dispatch_uid='update_last_login'):
+    user_logged_in.connect(_update_last_login, dispatch_uid='update_last_login')
@@ -1,3 +1,404 @@
-from django.test import TestCase
+import asyncio
 
-# Create your tests here.
+import numpy as np
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.db import connection
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models.models import Usuario
+from .services import admission, index as index_module, positions
+from .services.attempts import MAX_FAILED_ATTEMPTS, login_success, record_failure
+from .services.embeddings import (
+    _HEADER, PACK_MAGIC, embeddings_shape, pack_embeddings, unpack_embeddings,
+)
+from .services.index import EmbeddingIndex, get_index
+from .services.quantize import quantize_int8
+
+
+def make_user(n, embeddings=None, **extra):
+    user = Usuario(email=f'u{n}@example.com', dni=str(n), nombres='N', apellidos=f'A{n}', **extra)
+    if embeddings is not None:
+        user.facial_embeddings_bin = pack_embeddings(embeddings, 'float32')
+    user.save()
+    return user
+
+
+def usuario_updates(queries):
+    return [q['sql'] for q in queries if q['sql'].startswith('UPDATE') and 'login_usuario' in q['sql']]
+
+
+class AttemptsTests(TestCase):
+    """Intentos fallidos (UPDATE atómico con tope) y login exitoso en un solo UPDATE."""
+
+    def setUp(self):
+        self.user = make_user(1)
+
+    def test_record_failure_is_one_atomic_update(self):
+        # Dos instancias viejas no se pisan: el incremento lo hace la BD
+        stale_a = Usuario.objects.get(pk=self.user.pk)
+        stale_b = Usuario.objects.get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            record_failure(stale_a)
+        record_failure(stale_b)
+        updates = usuario_updates(ctx.captured_queries)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('"failed_attempts" + 1', updates[0])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.failed_attempts, 2)
+
+    def test_record_failure_is_capped(self):
+        Usuario.objects.filter(pk=self.user.pk).update(failed_attempts=MAX_FAILED_ATTEMPTS - 1)
+        for _ in range(3):
+            record_failure(self.user)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.failed_attempts, MAX_FAILED_ATTEMPTS)
+
+    def test_login_success_resets_in_one_update(self):
+        Usuario.objects.filter(pk=self.user.pk).update(failed_attempts=3)
+        user = Usuario.objects.get(pk=self.user.pk)
+        request = RequestFactory().post('/api/login/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        with CaptureQueriesContext(connection) as ctx:
+            login_success(request, user)
+        updates = usuario_updates(ctx.captured_queries)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"failed_attempts"', updates[0])
+        self.assertIn('"last_login"', updates[0])
+        user = Usuario.objects.get(pk=self.user.pk)
+        self.assertEqual(user.failed_attempts, 0)
+        self.assertIsNotNone(user.last_login)
+
+
+class PackingTests(SimpleTestCase):
+    """Formato binario de embeddings: ida y vuelta por modo y cabeceras inválidas."""
+
+    def setUp(self):
+        self.matrix = np.random.default_rng(0).normal(scale=0.1, size=(3, 128)).astype(np.float32)
+
+    def test_float32_round_trip_is_exact(self):
+        np.testing.assert_array_equal(unpack_embeddings(pack_embeddings(self.matrix, 'float32')), self.matrix)
+
+    def test_float16_round_trip(self):
+        restored = unpack_embeddings(pack_embeddings(self.matrix, 'float16'))
+        self.assertEqual(restored.shape, self.matrix.shape)
+        np.testing.assert_allclose(restored, self.matrix, rtol=1e-3, atol=1e-4)
+
+    def test_int8_round_trip_within_half_a_step(self):
+        blob = pack_embeddings(self.matrix, 'int8')
+        restored = unpack_embeddings(blob)
+        step = np.abs(self.matrix).max(axis=0) / 127
+        self.assertTrue((np.abs(restored - self.matrix) <= step * 0.5 + 1e-6).all())
+        # Cabecera + escala float16 + una fila int8 por muestra
+        self.assertEqual(len(blob), _HEADER.size + 2 * 128 + 3 * 128)
+
+    def test_int8_with_float32_scale_still_reads(self):
+        q, scale = quantize_int8(self.matrix)
+        blob = _HEADER.pack(PACK_MAGIC, 1, 2, 128, 3) + scale.astype('<f4').tobytes() + q.tobytes()
+        np.testing.assert_allclose(unpack_embeddings(blob), q.astype(np.float32) * scale)
+
+    def test_shape_from_header(self):
+        self.assertEqual(embeddings_shape(pack_embeddings(self.matrix, 'int8')), (3, 128))
+
+    def test_bad_header_is_rejected(self):
+        blob = pack_embeddings(self.matrix, 'float32')
+        for bad in (b'XXXX' + blob[4:], blob[:4] + b'\x09' + blob[5:], blob[:_HEADER.size - 1]):
+            with self.assertRaises(ValueError):
+                unpack_embeddings(bad)
+
+
+class VersioningTests(TestCase):
+    """embeddings_version solo sube cuando cambian de verdad los campos biométricos."""
+
+    def setUp(self):
+        self.embeddings = np.ones((2, 128), dtype=np.float32)
+        self.user = make_user(1, self.embeddings, positions=[{'x': 0.5, 'y': 0.5, 'scale': 0.3}])
+
+    def reload(self):
+        return Usuario.objects.get(pk=self.user.pk)
+
+    def test_new_user_with_embeddings_starts_versioned(self):
+        self.assertEqual(self.user.embeddings_version, 1)
+        self.assertEqual(self.user.embedding_count, 2)
+        self.assertIsNotNone(self.user.enrollment_updated_at)
+
+    def test_new_user_without_embeddings_is_not_versioned(self):
+        user = make_user(2)
+        self.assertEqual(user.embeddings_version, 0)
+        self.assertIsNone(user.enrollment_updated_at)
+
+    def test_other_fields_do_not_bump(self):
+        user = self.reload()
+        user.nombres = 'Otro'
+        user.save()
+        self.assertEqual(self.reload().embeddings_version, 1)
+
+    def test_same_value_does_not_bump(self):
+        user = self.reload()
+        user.facial_embeddings_bin = pack_embeddings(self.embeddings, 'float32')
+        user.positions = [{'x': 0.5, 'y': 0.5, 'scale': 0.3}]
+        user.save()
+        self.assertEqual(self.reload().embeddings_version, 1)
+
+    def test_embedding_change_bumps(self):
+        user = self.reload()
+        user.facial_embeddings_bin = pack_embeddings(self.embeddings * 2, 'float32')
+        user.save()
+        self.assertEqual(self.reload().embeddings_version, 2)
+
+    def test_in_place_change_is_detected(self):
+        user = self.reload()
+        user.positions.append({'x': 0.4, 'y': 0.4, 'scale': 0.3})
+        self.assertEqual(user.changed_fields(), {'positions'})
+        user.save()
+        self.assertEqual(self.reload().embeddings_version, 2)
+
+    def test_changed_fields_after_refresh_from_db(self):
+        user = Usuario.objects.only('id', 'email').get(pk=self.user.pk)
+        self.assertEqual(user.changed_fields(), set())
+        user.refresh_from_db(fields=['positions', 'facial_embeddings_bin'])
+        self.assertEqual(user.changed_fields(), set())
+        user.positions = []
+        self.assertEqual(user.changed_fields(), {'positions'})
+        user.refresh_from_db()
+        self.assertEqual(user.changed_fields(), set())
+
+    def test_update_fields(self):
+        user = self.reload()
+        user.positions = []
+        user.nombres = 'Otro'
+        # Solo se guarda nombres: el cambio de posiciones queda pendiente y no versiona
+        user.save(update_fields=['nombres'])
+        stored = self.reload()
+        self.assertEqual((stored.embeddings_version, stored.nombres, len(stored.positions)), (1, 'Otro', 1))
+        # Con el campo biométrico en update_fields también se guardan versión y resumen
+        user.save(update_fields=['positions'])
+        stored = self.reload()
+        self.assertEqual((stored.embeddings_version, stored.positions), (2, []))
+
+
+def legacy_position_check(stored, live_pos, attempts):
+    """Validación por muestra original de _validate_position_collection (referencia)."""
+    tol_xy = max(0.05, 0.10 - attempts * 0.01)
+    tol_scale = max(0.08, 0.15 - attempts * 0.01)
+    tol_ang = max(8, 15 - attempts * 1)
+    tol_dist = max(0.12, 0.22 - attempts * 0.02)
+    for p in stored:
+        if all(k in p for k in ('x', 'y', 'scale')) and all(k in live_pos for k in ('x', 'y', 'scale')):
+            if (abs(p['x'] - live_pos['x']) <= tol_xy and abs(p['y'] - live_pos['y']) <= tol_xy
+                    and abs(p['scale'] - live_pos['scale']) <= tol_scale):
+                return True
+        if all(k in p for k in ('roll', 'pitch', 'yaw', 'dist')) and all(k in live_pos for k in ('roll', 'pitch', 'yaw', 'dist')):
+            if (abs(p['roll'] - live_pos['roll']) <= tol_ang and abs(p['pitch'] - live_pos['pitch']) <= tol_ang
+                    and abs(p['yaw'] - live_pos['yaw']) <= tol_ang and abs(p['dist'] - live_pos['dist']) <= tol_dist):
+                return True
+    return False
+
+
+class PositionParityTests(SimpleTestCase):
+    """La validación vectorizada decide igual que el bucle por muestra original."""
+
+    def random_position(self, rng, kind):
+        xys = {'x': rng.uniform(0.3, 0.7), 'y': rng.uniform(0.3, 0.7), 'scale': rng.uniform(0.2, 0.4)}
+        angles = {'roll': rng.uniform(-20, 20), 'pitch': rng.uniform(-20, 20), 'yaw': rng.uniform(-20, 20),
+                  'dist': rng.uniform(0.3, 0.7)}
+        return {'xys': xys, 'angles': angles, 'both': {**xys, **angles}}[kind]
+
+    def test_matches_agrees_with_legacy_loop(self):
+        rng = np.random.default_rng(0)
+        kinds = ('xys', 'angles', 'both')
+        decisions = set()
+        for case in range(2000):
+            stored = [self.random_position(rng, kinds[rng.integers(3)]) for _ in range(rng.integers(0, 5))]
+            live = self.random_position(rng, kinds[case % 3])
+            attempts = int(rng.integers(0, 8))
+            expected = legacy_position_check(stored, live, attempts)
+            decisions.add(expected)
+            self.assertEqual(positions.matches(positions.poses_from_list(stored), live, attempts=attempts), expected,
+                             msg=f'caso {case}: {stored} vs {live} (intentos={attempts})')
+        # La muestra cubre aceptaciones y rechazos
+        self.assertEqual(decisions, {True, False})
+
+    def test_match_many_agrees_with_matches(self):
+        rng = np.random.default_rng(1)
+        pose_sets = [positions.poses_from_list([self.random_position(rng, 'both') for _ in range(rng.integers(0, 4))])
+                     for _ in range(50)]
+        attempts = [int(a) for a in rng.integers(0, 8, size=50)]
+        for live in (self.random_position(rng, kind) for kind in ('xys', 'angles', 'both')):
+            expected = [positions.matches(p, live, attempts=a) for p, a in zip(pose_sets, attempts)]
+            self.assertEqual(positions.match_many(pose_sets, live, attempts).tolist(), expected)
+
+
+@override_settings(
+    FACIAL_ADMISSION_ENABLED=True, FACIAL_ADMISSION_MAX_CONCURRENT=1, FACIAL_ADMISSION_QUEUE=0,
+    FACIAL_ADMISSION_WAIT=0.05, FACIAL_RATE_IP_BURST=2, FACIAL_RATE_IP_PER_SECOND=0.5,
+    FACIAL_RATE_EMAIL_BURST=0,
+)
+class AdmissionTests(SimpleTestCase):
+    """Rechazos del control de admisión: 429 por cubeta vacía, 503 por limitador saturado."""
+
+    def setUp(self):
+        admission.reset_admission()
+        self.addCleanup(admission.reset_admission)
+        self.view = admission.admission_control(lambda request: JsonResponse({'ok': True}))
+
+    def post(self, ip='10.0.0.1'):
+        request = RequestFactory().post('/api/login/', '{}', content_type='application/json', REMOTE_ADDR=ip)
+        return self.view(request)
+
+    def test_empty_bucket_returns_429_with_retry_after(self):
+        self.assertEqual([self.post().status_code for _ in range(2)], [200, 200])
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        # Otra IP tiene su propia cubeta
+        self.assertEqual(self.post('10.0.0.2').status_code, 200)
+
+    def test_saturated_limiter_returns_503(self):
+        limiter = admission.get_limiter()
+        limiter.acquire()
+        try:
+            response = self.post()
+        finally:
+            limiter.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.post().status_code, 200)
+
+    def test_waiters_are_served_in_order(self):
+        limiter = admission.ConcurrencyLimiter(1, 10, 1.0)
+        order = []
+
+        async def job(i):
+            await limiter.aacquire()
+            order.append(i)
+            await asyncio.sleep(0.001)
+            limiter.release()
+
+        async def run():
+            await asyncio.gather(*(job(i) for i in range(6)))
+
+        asyncio.run(run())
+        self.assertEqual(order, list(range(6)))
+        self.assertEqual(limiter.info()['active'], 0)
+
+
+class IndexSearchTests(SimpleTestCase):
+    """Búsqueda top-k del índice 1:N frente a fuerza bruta, antes y después de replace_users."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.rows = {uid: rng.normal(scale=0.1, size=(3, 128)).astype(np.float32) for uid in range(1, 201)}
+        self.rng = rng
+
+    def brute_force(self, rows, live, k):
+        best = sorted((float(np.sqrt(((m - live) ** 2).sum(axis=1)).min()), uid) for uid, m in rows.items())
+        return [uid for _, uid in best[:k]]
+
+    def build(self, rows, mode='float32'):
+        ids = np.concatenate([np.full(len(m), uid, dtype=np.int64) for uid, m in rows.items()])
+        return EmbeddingIndex.from_matrix(np.vstack(list(rows.values())), ids, mode)
+
+    def assert_same_top_k(self, index, rows, k=5):
+        # Muestras propias de usuarios (incluso reemplazados o dados de baja) y vectores al azar
+        probes = np.vstack([self.rows[7], self.rows[150], self.rng.normal(scale=0.1, size=(3, 128))])
+        for live in probes.astype(np.float32):
+            results = index.search(live, k=k)
+            self.assertEqual([uid for uid, _ in results], self.brute_force(rows, live, k))
+            distances = [d for _, d in results]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_search_matches_brute_force(self):
+        self.assert_same_top_k(self.build(self.rows), self.rows)
+
+    def test_replace_users_matches_rebuilt_index(self):
+        index = self.build(self.rows)
+        new = self.rng.normal(scale=0.1, size=(4, 128)).astype(np.float32)
+        # 7 se re-enrola con 2 muestras, 150 se da de baja (sin filas) y 201 es nuevo
+        updated = index.replace_users([7, 150, 201], np.vstack([new[:2], new[2:]]), [7, 7, 201, 201])
+        rows = {**self.rows, 7: new[:2], 201: new[2:]}
+        del rows[150]
+        self.assertEqual(len(index), 600)
+        self.assertEqual(len(updated), len(index) - 3 - 3 + 4)
+        self.assertNotIn(150, updated.user_ids)
+        self.assert_same_top_k(updated, rows)
+
+    def test_replace_users_int8_keeps_scale(self):
+        index = self.build(self.rows, 'int8')
+        new = self.rows[3] + 0.001
+        updated = index.replace_users([3], new, [3, 3, 3])
+        self.assertIs(updated.scale, index.scale)
+        self.assertEqual(updated.matrix.dtype, np.int8)
+        self.assertEqual(updated.search(new[0], k=1)[0][0], 3)
+
+
+@override_settings(FACIAL_INDEX_DIR=None, FACIAL_INDEX_CHECK_INTERVAL=0, FACIAL_EMBEDDING_CACHE='default')
+class IndexUpdateTests(TestCase):
+    """El índice desde la BD reemplaza solo las filas de los usuarios guardados y los
+    demás procesos aplican el cambio desde el diario de la caché compartida.
+    """
+
+    STATE = ('_index', '_generation', '_built_at', '_next_check')
+
+    def setUp(self):
+        cache.clear()
+        self.rng = np.random.default_rng(0)
+        self.users = [make_user(i, self.embeddings()) for i in range(4)]
+        self.reset_process()
+        self.addCleanup(self.reset_process)
+
+    def embeddings(self, n=2):
+        return self.rng.normal(scale=0.1, size=(n, 128)).astype(np.float32)
+
+    def reset_process(self):
+        for name, value in zip(self.STATE, (None, None, 0.0, 0.0)):
+            setattr(index_module, name, value)
+
+    def process_state(self):
+        return {name: getattr(index_module, name) for name in self.STATE}
+
+    def switch_to(self, state):
+        for name, value in state.items():
+            setattr(index_module, name, value)
+
+    def save(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+    def test_post_save_replaces_only_that_user(self):
+        index = get_index()
+        self.assertEqual(len(index), 8)
+        user = Usuario.objects.get(pk=self.users[0].pk)
+        new = self.embeddings(3)
+        user.facial_embeddings_bin = pack_embeddings(new, 'float32')
+        self.save(user)
+        updated = get_index()
+        self.assertEqual(len(updated), 9)
+        self.assertEqual(updated.search(new[1], k=1)[0][0], user.pk)
+        # Las filas de los demás usuarios son las mismas
+        others = index.user_ids != user.pk
+        np.testing.assert_array_equal(updated.matrix[updated.user_ids != user.pk], index.matrix[others])
+
+    def test_other_process_applies_the_journal(self):
+        get_index()
+        other = self.process_state()
+        user = Usuario.objects.get(pk=self.users[1].pk)
+        user.is_active = False
+        self.save(user)
+        self.assertNotIn(user.pk, get_index().user_ids)
+        # Otro worker con el índice anterior lo actualiza en su próxima revisión
+        self.switch_to(other)
+        self.assertIn(user.pk, index_module._index.user_ids)
+        self.assertNotIn(user.pk, get_index().user_ids)
+        self.assertEqual(index_module._generation, cache.get('facial:index:generation'))
+
+    def test_non_biometric_save_does_not_touch_the_index(self):
+        index = get_index()
+        generation = cache.get('facial:index:generation')
+        user = Usuario.objects.get(pk=self.users[2].pk)
+        user.nombres = 'Otro'
+        self.save(user)
+        self.assertIs(get_index(), index)
+        self.assertEqual(cache.get('facial:index:generation'), generation)
@@ -0,0 +1 @@
+from .urls import urlpatterns  # re-export
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views.views import (
+from ..views.views import (
     index,
     login_view,
     register_view,
@@ -7,9 +7,16 @@ from .views.views import (
     logout_view,
     api_encode,
     api_login,
+    api_identify,
     db_check,
+    metrics_view,
     api_debug_decode,
 )
+from ..views.async_views import (
+    api_encode_async,
+    api_login_async,
+    api_debug_decode_async,
+)
 
 urlpatterns = [
     path('', index, name='index'),
@@ -21,6 +28,13 @@ urlpatterns = [
     # APIs
     path('api/encode/', api_encode, name='api_encode'),
     path('api/login/', api_login, name='api_login'),
+    path('api/identify/', api_identify, name='api_identify'),
     path('api/db-check/', db_check, name='db_check'),
     path('api/debug-decode/', api_debug_decode, name='api_debug_decode'),
+    path('metrics/', metrics_view, name='metrics'),
+
+    # APIs async (ASGI): mismas respuestas que las síncronas
+    path('api/async/encode/', api_encode_async, name='api_encode_async'),
+    path('api/async/login/', api_login_async, name='api_login_async'),
+    path('api/async/debug-decode/', api_debug_decode_async, name='api_debug_decode_async'),
 ]
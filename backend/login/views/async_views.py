@@ -0,0 +1,165 @@
+"""Variantes asíncronas (ASGI) de las APIs faciales.
+
+Misma lógica y respuestas que las vistas síncronas de views.py, pero el ORM se
+usa con sus métodos async (aget/aupdate/alogin) y el trabajo de CPU (decodificar,
+detectar, codificar) se envía al pool de codificación o al executor, de modo que
+un solo proceso ASGI mantiene muchas subidas lentas en curso sin bloquear hilos.
+"""
+import base64
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from ..models.models import Usuario
+from ..services import metrics
+from ..services.attempts import LOGIN_FIELDS, alogin_success, arecord_failure
+from ..services.encoder import EncoderBusy, EncoderTimeout, aencode_frame, aencode_frames, aiter_encode_frames
+from ..services.admission import admission_control, request_json
+from ..services.quality import PoorQualityFrame
+from .views import (
+    _FrameTooLarge,
+    _busy_response,
+    _compare_to_collection,
+    _count_denied,
+    _debug_decode,
+    _denied_message,
+    _login_frames,
+    _login_ok_payload,
+    _quality_response,
+    _read_frame_request,
+    _too_large_response,
+    _validate_position_collection,
+)
+
+
+def _evaluate(user, live_emb, position):
+    with metrics.stage('compare'):
+        match = _compare_to_collection(user, live_emb)
+    with metrics.stage('position'):
+        position_ok = _validate_position_collection(user, position)
+    return match, position_ok
+
+
+async def _aevaluate_stream(user, frames, poses):
+    """Versión async de views._evaluate_stream sobre aiter_encode_frames."""
+    face = any_match = any_position = False
+    rejected = None
+    stream = aiter_encode_frames(frames, poses)
+    try:
+        async for index, live_emb, reason in stream:
+            if live_emb is None:
+                rejected = rejected or reason
+                continue
+            face = True
+            # Puede tocar la BD si algún campo está diferido: se ejecuta fuera del event loop
+            match, position_ok = await sync_to_async(_evaluate)(user, live_emb, poses[index])
+            if match and position_ok:
+                metrics.incr('login_frames_skipped', len(poses) - index - 1)
+                return index, True, True, True, None
+            any_match = any_match or match
+            any_position = any_position or position_ok
+    finally:
+        await stream.aclose()
+    return None, face, any_match, any_position, rejected
+
+
+@require_POST
+@csrf_exempt
+@admission_control
+async def api_encode_async(request):
+    """Versión async de api_encode (incluye el modo lote `facial_frames`)."""
+    try:
+        data, frame = _read_frame_request(request)
+    except _FrameTooLarge:
+        return _too_large_response()
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'JSON inválido'}, status=400)
+    frames = data.get('facial_frames')
+    try:
+        if frames is not None:
+            max_batch = getattr(settings, 'FACIAL_ENCODE_MAX_BATCH', 20)
+            if not isinstance(frames, list) or not frames or len(frames) > max_batch:
+                return JsonResponse({'ok': False, 'error': f'facial_frames debe ser una lista de 1 a {max_batch} frames'}, status=400)
+            embs = await aencode_frames(frames, data.get('positions'))
+            return JsonResponse({
+                'ok': any(e is not None for e in embs),
+                'embeddings': [base64.b64encode(e.tobytes()).decode('utf-8') if e is not None else None for e in embs],
+            })
+        emb = await aencode_frame(frame, data.get('position_data'))
+    except (EncoderBusy, EncoderTimeout) as e:
+        return _busy_response(e)
+    except PoorQualityFrame as e:
+        return _quality_response(e.reason)
+    if emb is None:
+        return JsonResponse({'ok': False, 'error': 'No face detected'}, status=400)
+    return JsonResponse({'ok': True, 'embedding': base64.b64encode(emb.tobytes()).decode('utf-8')})
+
+
+@csrf_exempt
+@admission_control
+async def api_login_async(request):
+    """Versión async de api_login: mismas validaciones y mensajes (incluida la lista
+    `facial_frames`, que se evalúa en orden hasta el primer frame válido).
+    """
+    log = logging.getLogger('facial')
+    if request.method != 'POST':
+        return JsonResponse({'ok': False, 'error': 'Method not allowed', 'allowed': ['POST']}, status=405)
+    try:
+        try:
+            data, frame = _read_frame_request(request)
+        except _FrameTooLarge:
+            return _too_large_response()
+        except Exception as e:
+            log.exception('api_login_async: JSON inválido: %s', e)
+            return JsonResponse({'ok': False, 'error': 'JSON inválido'}, status=400)
+
+        email = data.get('email')
+        try:
+            frames, poses = _login_frames(data, frame)
+        except ValueError as e:
+            return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+        if not all([*frames, *poses, email]):
+            return JsonResponse({'ok': False, 'error': 'Parámetros incompletos'}, status=400)
+
+        try:
+            with metrics.stage('db_user'):
+                user = await Usuario.objects.only(*LOGIN_FIELDS).aget(email=email)
+        except Usuario.DoesNotExist:
+            return JsonResponse({'ok': False, 'error': 'Usuario no encontrado'}, status=404)
+
+        try:
+            index, face, match, position_ok, rejected = await _aevaluate_stream(user, frames, poses)
+        except (EncoderBusy, EncoderTimeout) as e:
+            return _busy_response(e)
+        if not face:
+            if rejected is not None:
+                return _quality_response(rejected)
+            return JsonResponse({'ok': False, 'error': 'Rostro no detectado'}, status=400)
+
+        if match and position_ok:
+            with metrics.stage('session'):
+                await alogin_success(request, user)
+            metrics.incr('login_ok')
+            return JsonResponse(_login_ok_payload(data, index))
+        _count_denied(match, position_ok)
+        with metrics.stage('db_save'):
+            await arecord_failure(user)
+        return JsonResponse({'ok': False, 'error': _denied_message(match, position_ok)}, status=401)
+    except Exception as e:
+        log.exception('api_login_async: excepción inesperada %s', e)
+        return JsonResponse({'ok': False, 'error': 'Error interno'}, status=500)
+
+
+@require_POST
+@csrf_exempt
+@admission_control
+async def api_debug_decode_async(request):
+    """Versión async de api_debug_decode; el diagnóstico corre en el executor."""
+    data = request_json(request)
+    payload, status = await sync_to_async(_debug_decode, thread_sensitive=False)(data.get('facial_frame'))
+    return JsonResponse(payload, status=status)
@@ -1,6 +1,6 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.contrib.auth import login as auth_login, logout as auth_logout
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.contrib.auth import logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
@@ -9,6 +9,21 @@ from django.conf import settings
 import logging
 
 from ..models.models import Usuario
+from ..services.embeddings import get_gallery, get_poses, match_threshold, min_distance, pack_embeddings
+from ..services import positions
+from ..services.index import get_index
+from ..services.encoder import (
+    EncoderBusy, EncoderTimeout, encode_frame, encode_frames, encoder_signature, frame_bytes, iter_encode_frames,
+    quality_gate,
+)
+from ..services.quality import PoorQualityFrame
+from ..services.frame_archive import archive_frames, get_frame_archive
+from ..services.frame_cache import frame_cache_info
+from ..services.lazy import available, cv2, face_recognition, np
+from ..services.warmup import warmup_report
+from ..services import metrics
+from ..services.attempts import LOGIN_FIELDS, login_success, record_failure
+from ..services.admission import Rejected, admission_control, admission_info, request_json
 from django.db import connection
 
 import base64
@@ -16,18 +31,6 @@ import json
 import io
 from typing import Optional
 
-try:
-    import numpy as np
-    import cv2
-except Exception:  # pragma: no cover
-    np = None
-    cv2 = None
-
-try:
-    import face_recognition
-except Exception:
-    face_recognition = None
-
 
 def index(request):
     return redirect('login')
@@ -37,6 +40,18 @@ def login_view(request):
     return render(request, 'login/login.html')
 
 
+def _register_rejected(request, exc: Rejected):
+    """Rechazo del control de admisión en el formulario de registro (HTML, no JSON)."""
+    if exc.status == 429:
+        messages.error(request, 'Demasiados intentos de registro. Espera unos segundos e intenta nuevamente.')
+    else:
+        messages.error(request, 'Servidor ocupado. Intenta nuevamente en unos segundos.')
+    response = render(request, 'login/register.html', status=exc.status)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+@admission_control(on_reject=_register_rejected)
 def register_view(request):
     if request.method == 'POST':
         log = logging.getLogger('facial')
@@ -44,11 +59,21 @@ def register_view(request):
         apellidos = request.POST.get('apellidos')
         email = request.POST.get('email')
         dni = request.POST.get('dni')
-        facial_b64 = request.POST.get('facial_frame')
+        facial_frame = request.POST.get('facial_frame')
         position_json = request.POST.get('position_data')
         multi_samples = request.POST.get('samples')  # JSON con {frames:[], positions:[]}
-
-        log.debug(f'register_view: email={email}, dni={dni}, has_single={(facial_b64 is not None)}, has_samples={(multi_samples is not None)}')
+        try:
+            # Modo binario (multipart): archivos `frames` + campo JSON `positions`, o un archivo `facial_frame`
+            uploaded_frames = _uploaded_frames(request, 'frames')
+            uploaded_single = _uploaded_frames(request, 'facial_frame')
+        except _FrameTooLarge:
+            messages.error(request, 'La imagen enviada es demasiado grande.')
+            return render(request, 'login/register.html', status=413)
+        if uploaded_single:
+            facial_frame = uploaded_single[0]
+
+        log.debug('register_view: email=%s, dni=%s, has_single=%s, has_samples=%s, uploaded=%d',
+                  email, dni, facial_frame is not None, multi_samples is not None, len(uploaded_frames))
 
         if not all([nombres, apellidos, email, dni]):
             messages.error(request, 'Todos los campos son obligatorios.')
@@ -77,56 +102,100 @@ def register_view(request):
 
             embeddings_list = []
             positions_list = []
+            archived = []
+            weak = 0
+            archive = get_frame_archive()
 
             # Preferimos múltiples muestras si existen
-            if multi_samples:
+            if uploaded_frames or multi_samples:
                 try:
-                    samples = json.loads(multi_samples)
-                    frames = samples.get('frames', [])
-                    pos_list = samples.get('positions', [])
-                    log.debug(f'register_view: muestras recibidas frames={len(frames)} positions={len(pos_list)}')
-                    for idx, fb64 in enumerate(frames):
-                        emb = _compute_embedding_from_b64(fb64)
+                    if uploaded_frames:
+                        frames = uploaded_frames
+                        pos_list = json.loads(request.POST.get('positions') or '[]')
+                    else:
+                        samples = json.loads(multi_samples)
+                        frames = samples.get('frames', [])
+                        pos_list = samples.get('positions', [])
+                    log.debug('register_view: muestras recibidas frames=%d positions=%d', len(frames), len(pos_list))
+                    # Se decodifica una vez: los mismos bytes van al control de calidad, al codificador y al archivo
+                    frames = [frame_bytes(f) for f in frames]
+                    # Las muestras borrosas o mal expuestas se descartan antes de codificar y archivar
+                    keep = [i for i, img in enumerate(frames) if img and quality_gate(img) is None]
+                    weak = sum(1 for img in frames if img) - len(keep)
+                    if weak:
+                        log.debug('register_view: %d muestras descartadas por calidad', weak)
+                    frames = [frames[i] for i in keep]
+                    pos_list = [pos_list[i] for i in keep if i < len(pos_list)]
+                    # Un solo lote repartido entre los procesos; conserva el orden frame <-> posición
+                    encoded = []
+                    for idx, emb in enumerate(encode_frames(frames, pos_list, gate=False)):
                         if emb is not None:
+                            encoded.append(idx)
                             embeddings_list.append(emb.tolist())
                             if idx < len(pos_list):
                                 positions_list.append(pos_list[idx])
                         else:
-                            log.debug(f'register_view: emb None en muestra {idx}')
+                            log.debug('register_view: emb None en muestra %d', idx)
+                    # Solo se archivan los frames cuyo embedding se guarda (como bulk_enroll)
+                    if archive is not None:
+                        archived = archive_frames(
+                            archive, [frames[i] for i in encoded],
+                            [pos_list[i] if i < len(pos_list) else None for i in encoded],
+                        )
+                except (EncoderBusy, EncoderTimeout):
+                    raise
                 except Exception:
                     pass
 
             # Compatibilidad: si no hay muestras, usa una
-            if not embeddings_list and facial_b64 and position_json:
-                emb = _compute_embedding_from_b64(facial_b64)
+            if not embeddings_list and facial_frame and position_json:
+                position = json.loads(position_json)
+                facial_frame = frame_bytes(facial_frame)
+                try:
+                    emb = _compute_embedding(facial_frame, position)
+                except PoorQualityFrame:
+                    emb = None
+                    weak += 1
                 if emb is not None:
                     embeddings_list.append(emb.tolist())
-                    positions_list.append(json.loads(position_json))
+                    positions_list.append(position)
+                    if archive is not None:
+                        archived = archive_frames(archive, [facial_frame], [position])
                 else:
                     log.debug('register_view: emb None en modo compatibilidad (una muestra)')
 
             if not embeddings_list:
                 log.debug('register_view: embeddings_list vacío tras procesamiento; abortando registro (usuario se mantiene)')
-                messages.error(request, 'No se pudo extraer información facial válida. Intenta nuevamente con buena iluminación.')
+                if weak:
+                    messages.error(request, 'Las muestras salieron borrosas, oscuras o sobreexpuestas. Intenta nuevamente con buena iluminación y sin moverte.')
+                else:
+                    messages.error(request, 'No se pudo extraer información facial válida. Intenta nuevamente con buena iluminación.')
                 # No eliminar al usuario existente: mantener datos básicos
                 return render(request, 'login/register.html')
 
             # Guarda compatibilidad binaria principal (primer embedding) y posición principal
-            import numpy as _np
-            first = _np.array(embeddings_list[0], dtype=_np.float32)
-            user.facial_data = first.tobytes()
+            matrix = np.array(embeddings_list, dtype=np.float32)
+            user.facial_data = matrix[0].tobytes()
             user.position_data = positions_list[0] if positions_list else None
 
-            # Guarda la colección completa
-            user.facial_embeddings = embeddings_list
+            # Guarda la colección completa empaquetada; el JSON legado queda vacío
+            user.facial_embeddings_bin = pack_embeddings(matrix)
+            user.facial_embeddings = []
             user.positions = positions_list
             user.failed_attempts = 0
+            user.embedding_encoder = encoder_signature()
+            # Sin archivo configurado queda vacío: los frames previos ya no corresponden
+            user.enrollment_frames = archived
             user.save()
-            log.debug(f'register_view: guardado OK. embeddings={len(embeddings_list)} positions={len(positions_list)}')
+            log.debug('register_view: guardado OK. embeddings=%d positions=%d', len(embeddings_list), len(positions_list))
             messages.success(request, 'Registro exitoso. Ahora puedes iniciar sesión facial.')
             return redirect('login')
+        except (EncoderBusy, EncoderTimeout) as e:
+            log.warning('register_view: pool de codificación saturado (%s)', type(e).__name__)
+            messages.error(request, 'Servidor ocupado. Intenta nuevamente en unos segundos.')
+            return render(request, 'login/register.html', status=503)
         except Exception as e:
-            log.exception(f'register_view: excepción {e}')
+            log.exception('register_view: excepción %s', e)
             messages.error(request, f'Error al registrar: {e}')
 
     return render(request, 'login/register.html')
@@ -134,23 +203,51 @@ def register_view(request):
 
 @require_POST
 @csrf_exempt
+@admission_control
 def api_encode(request):
-    """Devuelve embedding facial a partir de un frame base64."""
+    """Devuelve embedding facial a partir de un frame (base64 en JSON, multipart o image/jpeg).
+    Modo lote: con `facial_frames` (lista) devuelve `embeddings` en el mismo orden (null si no hay rostro).
+    """
     log = logging.getLogger('facial')
-    data = json.loads(request.body.decode('utf-8')) if request.body else request.POST
-    log.debug(f'api_encode: payload_keys={list(data.keys())}')
-    if 'facial_frame' in data:
-        log.debug(f"api_encode: facial_frame length={len(data.get('facial_frame') or '')}")
-    b64 = data.get('facial_frame')
-    emb = _compute_embedding_from_b64(b64)
+    try:
+        data, frame = _read_frame_request(request)
+    except _FrameTooLarge:
+        return _too_large_response()
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'JSON inválido'}, status=400)
+    log.debug('api_encode: payload_keys=%s', list(data))
+    if frame:
+        log.debug('api_encode: facial_frame length=%d', len(frame))
+    frames = data.get('facial_frames')
+    if frames is not None:
+        max_batch = getattr(settings, 'FACIAL_ENCODE_MAX_BATCH', 20)
+        if not isinstance(frames, list) or not frames or len(frames) > max_batch:
+            return JsonResponse({'ok': False, 'error': f'facial_frames debe ser una lista de 1 a {max_batch} frames'}, status=400)
+        try:
+            embs = encode_frames(frames, data.get('positions'))
+        except (EncoderBusy, EncoderTimeout) as e:
+            return _busy_response(e)
+        return JsonResponse({
+            'ok': any(e is not None for e in embs),
+            'embeddings': [base64.b64encode(e.tobytes()).decode('utf-8') if e is not None else None for e in embs],
+        })
+    try:
+        emb = _compute_embedding(frame, data.get('position_data'))
+    except (EncoderBusy, EncoderTimeout) as e:
+        return _busy_response(e)
+    except PoorQualityFrame as e:
+        return _quality_response(e.reason)
     if emb is None:
         return JsonResponse({'ok': False, 'error': 'No face detected'}, status=400)
     return JsonResponse({'ok': True, 'embedding': base64.b64encode(emb.tobytes()).decode('utf-8')})
 
 
 @csrf_exempt
+@admission_control
 def api_login(request):
     """Autentica comparando embedding y validando posición aproximada.
+    Acepta un frame (facial_frame + position_data) o una lista ordenada
+    (facial_frames + positions) que se evalúa hasta el primer frame válido.
     Devuelve JSON incluso en caso de error para evitar HTML 500 en el front.
     """
     log = logging.getLogger('facial')
@@ -159,57 +256,205 @@ def api_login(request):
         return JsonResponse({'ok': False, 'error': 'Method not allowed', 'allowed': ['POST']}, status=405)
     try:
         try:
-            data = json.loads(request.body.decode('utf-8'))
+            data, frame = _read_frame_request(request)
+        except _FrameTooLarge:
+            return _too_large_response()
         except Exception as e:
-            log.exception(f'api_login: JSON inválido: {e}')
+            log.exception('api_login: JSON inválido: %s', e)
             return JsonResponse({'ok': False, 'error': 'JSON inválido'}, status=400)
 
-        log.debug(f"api_login: keys={list(data.keys())}, email={data.get('email')}")
-        if data.get('facial_frame'):
-            log.debug(f"api_login: facial_frame length={len(data.get('facial_frame'))}")
+        log.debug('api_login: keys=%s, email=%s', list(data), data.get('email'))
+        if frame:
+            log.debug('api_login: facial_frame length=%d', len(frame))
         if data.get('position_data'):
-            log.debug(f"api_login: position_data keys={list((data.get('position_data') or {}).keys())}")
+            log.debug('api_login: position_data keys=%s', list(data.get('position_data') or {}))
 
-        b64 = data.get('facial_frame')
-        position = data.get('position_data')
         email = data.get('email')
-        if not all([b64, position, email]):
+        try:
+            frames, poses = _login_frames(data, frame)
+        except ValueError as e:
+            return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+        if not all([*frames, *poses, email]):
             return JsonResponse({'ok': False, 'error': 'Parámetros incompletos'}, status=400)
 
         try:
-            user = Usuario.objects.get(email=email)
+            with metrics.stage('db_user'):
+                # Solo las columnas del login; el JSON legado se carga si hiciera falta
+                user = Usuario.objects.only(*LOGIN_FIELDS).get(email=email)
         except Usuario.DoesNotExist:
             return JsonResponse({'ok': False, 'error': 'Usuario no encontrado'}, status=404)
 
-        live_emb = _compute_embedding_from_b64(b64)
-        if live_emb is None:
+        # Codificación en flujo: se corta en el primer frame que pasa rostro y posición
+        try:
+            index, face, match, position_ok, rejected = _evaluate_stream(user, iter_encode_frames(frames, poses), poses)
+        except (EncoderBusy, EncoderTimeout) as e:
+            return _busy_response(e)
+        if not face:
+            if rejected is not None:
+                return _quality_response(rejected)
             return JsonResponse({'ok': False, 'error': 'Rostro no detectado'}, status=400)
 
-        # Comparación de embeddings con colección de muestras
-        match = _compare_to_collection(user, live_emb)
-
-        # Validación de posición: exige coincidencia con alguna posición registrada
-        position_ok = _validate_position_collection(user, position)
-
         if match and position_ok:
-            auth_login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-            user.failed_attempts = 0
-            user.save(update_fields=['failed_attempts'])
-            return JsonResponse({'ok': True, 'redirect': '/mantenimiento/'})
+            # Sesión + un único UPDATE de failed_attempts y last_login
+            with metrics.stage('session'):
+                login_success(request, user)
+            metrics.incr('login_ok')
+            return JsonResponse(_login_ok_payload(data, index))
         else:
-            # Mensajes específicos
-            msg = 'Acceso denegado. Credenciales no coinciden'
-            if match and not position_ok:
-                msg = 'Posición incorrecta. Colóquese exactamente como durante su registro'
-            elif (not match) and position_ok:
-                msg = 'Usuario no reconocido'
-
-            # Tolerancia adaptativa (solo para falsos negativos):
-            user.failed_attempts = min(user.failed_attempts + 1, 5)
-            user.save(update_fields=['failed_attempts'])
+            msg = _denied_message(match, position_ok)
+            _count_denied(match, position_ok)
+
+            # Tolerancia adaptativa (solo para falsos negativos): incremento atómico con tope
+            with metrics.stage('db_save'):
+                record_failure(user)
             return JsonResponse({'ok': False, 'error': msg}, status=401)
     except Exception as e:
-        log.exception(f'api_login: excepción inesperada {e}')
+        log.exception('api_login: excepción inesperada %s', e)
+        return JsonResponse({'ok': False, 'error': 'Error interno'}, status=500)
+
+
+def _login_frames(data, frame):
+    """Frames y poses del login, en orden: `facial_frames` + `positions` (o una sola
+    position_data para todos), o el par clásico facial_frame + position_data.
+    Lanza ValueError si la lista no es válida.
+    """
+    frames = data.get('facial_frames')
+    if frames is None:
+        return [frame], [data.get('position_data')]
+    max_frames = getattr(settings, 'FACIAL_LOGIN_MAX_FRAMES', 7)
+    if not isinstance(frames, list) or not 1 <= len(frames) <= max_frames:
+        raise ValueError(f'facial_frames debe ser una lista de 1 a {max_frames} frames')
+    poses = data.get('positions')
+    if poses is None:
+        poses = [data.get('position_data')] * len(frames)
+    if not isinstance(poses, list) or len(poses) != len(frames):
+        raise ValueError('positions debe traer una posición por frame')
+    return frames, poses
+
+
+def _evaluate_stream(user, stream, poses):
+    """Recorre (índice, embedding) en orden y se detiene en el primer frame que pasa
+    la comparación y la posición; cerrar el flujo cancela la codificación pendiente.
+    Devuelve (índice | None, hubo_rostro, match, position_ok, motivo de calidad); si
+    ninguno pasa, match y position_ok indican si algún frame pasó cada prueba y el
+    motivo es el del primer frame rechazado por calidad (para el mensaje).
+    """
+    face = any_match = any_position = False
+    rejected = None
+    try:
+        for index, live_emb, reason in stream:
+            if live_emb is None:
+                rejected = rejected or reason
+                continue
+            face = True
+            # Comparación de embeddings con colección de muestras
+            with metrics.stage('compare'):
+                match = _compare_to_collection(user, live_emb)
+            # Validación de posición: exige coincidencia con alguna posición registrada
+            with metrics.stage('position'):
+                position_ok = _validate_position_collection(user, poses[index])
+            if match and position_ok:
+                metrics.incr('login_frames_skipped', len(poses) - index - 1)
+                return index, True, True, True, None
+            any_match = any_match or match
+            any_position = any_position or position_ok
+    finally:
+        stream.close()
+    return None, face, any_match, any_position, rejected
+
+
+def _login_ok_payload(data, index):
+    payload = {'ok': True, 'redirect': '/mantenimiento/'}
+    if data.get('facial_frames') is not None:
+        # Frame de la lista que autenticó
+        payload['frame'] = index
+    return payload
+
+
+def _count_denied(match, position_ok):
+    """Contadores de rechazo: rostro distinto y/o posición incorrecta."""
+    if not match:
+        metrics.incr('mismatch')
+    if not position_ok:
+        metrics.incr('position')
+
+
+def _denied_message(match, position_ok):
+    """Mensaje específico para un intento de login rechazado."""
+    if match and not position_ok:
+        return 'Posición incorrecta. Colóquese exactamente como durante su registro'
+    if (not match) and position_ok:
+        return 'Usuario no reconocido'
+    return 'Acceso denegado. Credenciales no coinciden'
+
+
+# Columnas que usa api_identify; embeddings y posiciones salen de la caché por versión
+IDENTIFY_FIELDS = ('id', 'email', 'nombres', 'apellidos', 'is_active', 'failed_attempts', 'embeddings_version')
+
+
+@require_POST
+@csrf_exempt
+@admission_control
+def api_identify(request):
+    """Identificación 1:N: devuelve el usuario registrado más parecido al frame.
+    Solo requiere facial_frame; si llega position_data se exige además coincidencia de posición.
+    """
+    log = logging.getLogger('facial')
+    try:
+        try:
+            data, frame = _read_frame_request(request)
+        except _FrameTooLarge:
+            return _too_large_response()
+        except Exception:
+            return JsonResponse({'ok': False, 'error': 'JSON inválido'}, status=400)
+
+        position = data.get('position_data')
+        if not frame:
+            return JsonResponse({'ok': False, 'error': 'Parámetros incompletos'}, status=400)
+
+        try:
+            live_emb = _compute_embedding(frame, position)
+        except (EncoderBusy, EncoderTimeout) as e:
+            return _busy_response(e)
+        except PoorQualityFrame as e:
+            return _quality_response(e.reason)
+        if live_emb is None:
+            return JsonResponse({'ok': False, 'error': 'Rostro no detectado'}, status=400)
+
+        thr = match_threshold(getattr(settings, 'FACIAL_IDENTIFY_THRESHOLD', 0.45))
+        k = getattr(settings, 'FACIAL_IDENTIFY_TOP_K', 5)
+        with metrics.stage('search'):
+            candidates = [(uid, dist) for uid, dist in get_index().search(live_emb, k=k) if dist < thr]
+        log.debug('api_identify: candidatos=%s', candidates)
+        if not candidates:
+            metrics.incr('mismatch')
+            return JsonResponse({'ok': False, 'error': 'Usuario no reconocido'}, status=404)
+
+        with metrics.stage('db_user'):
+            users = Usuario.objects.only(*IDENTIFY_FIELDS).in_bulk([uid for uid, _ in candidates])
+        eligible = [(users[uid], dist) for uid, dist in candidates if uid in users and users[uid].is_active]
+        if position and eligible:
+            # Una sola validación vectorizada para todos los candidatos
+            with metrics.stage('position'):
+                passed = _validate_position_many([user for user, _ in eligible], position)
+            eligible = [candidate for candidate, ok in zip(eligible, passed) if ok]
+        if eligible:
+            user, dist = eligible[0]
+            metrics.incr('identify_ok')
+            return JsonResponse({
+                'ok': True,
+                'distance': round(dist, 4),
+                'user': {
+                    'id': user.pk,
+                    'email': user.email,
+                    'nombres': user.nombres,
+                    'apellidos': user.apellidos,
+                },
+            })
+        metrics.incr('position')
+        return JsonResponse({'ok': False, 'error': 'Posición incorrecta'}, status=401)
+    except Exception as e:
+        log.exception('api_identify: excepción inesperada %s', e)
         return JsonResponse({'ok': False, 'error': 'Error interno'}, status=500)
 
 
@@ -281,7 +526,7 @@ def api_register_basic(request):
 
         return JsonResponse({'ok': True, 'created': created})
     except Exception as e:
-        logging.getLogger('facial').exception(f'api_register_basic: excepción {e}')
+        logging.getLogger('facial').exception('api_register_basic: excepción %s', e)
         return JsonResponse({'ok': False, 'error': 'Error interno'}, status=500)
 
 
@@ -296,6 +541,35 @@ def logout_view(request):
     return redirect('login')
 
 
+def metrics_view(request):
+    """Histogramas de etapas y contadores del proceso en formato de texto de Prometheus."""
+    if not getattr(settings, 'FACIAL_METRICS_ENABLED', True):
+        return JsonResponse({'ok': False, 'error': 'Métricas desactivadas'}, status=404)
+    body = metrics.render_prometheus()
+    cache = frame_cache_info()
+    if cache.get('backend'):
+        body += (
+            '# TYPE facial_frame_cache_requests_total counter\n'
+            f'facial_frame_cache_requests_total{{result="hit"}} {cache["hits"]}\n'
+            f'facial_frame_cache_requests_total{{result="miss"}} {cache["misses"]}\n'
+        )
+    admission = admission_info()
+    if 'active' in admission:
+        body += (
+            '# TYPE facial_admission_requests gauge\n'
+            f'facial_admission_requests{{state="active"}} {admission["active"]}\n'
+            f'facial_admission_requests{{state="waiting"}} {admission["waiting"]}\n'
+        )
+    warmup = warmup_report()
+    if warmup:
+        steps = {f'import_{name}': ms for name, ms in warmup['imports'].items()}
+        steps.update((step, warmup[step]) for step in ('encode_cold', 'encode_warm', 'pool', 'total'))
+        body += '# TYPE facial_warmup_seconds gauge\n' + ''.join(
+            f'facial_warmup_seconds{{step="{step}"}} {ms / 1000}\n' for step, ms in steps.items() if ms is not None
+        )
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def db_check(request):
     """Verificación simple de conexión a base de datos."""
     try:
@@ -343,102 +617,161 @@ def api_validate_user(request):
             return JsonResponse({'ok': True})
         return JsonResponse({'ok': False, 'error': 'DNI no coincide'}, status=401)
     except Exception as e:
-        logging.getLogger('facial').exception(f'api_validate_user: excepción {e}')
+        logging.getLogger('facial').exception('api_validate_user: excepción %s', e)
         return JsonResponse({'ok': False, 'error': 'Error interno'}, status=500)
 
 
 @require_POST
 @csrf_exempt
+@admission_control
 def api_debug_decode(request):
     """Endpoint temporal de diagnóstico: evalúa un frame base64 y reporta métricas.
     No altera lógica de negocio.
     """
+    data = request_json(request)
+    payload, status = _debug_decode(data.get('facial_frame'))
+    return JsonResponse(payload, status=status)
+
+
+def _debug_decode(b64):
+    """Diagnóstico de un frame base64; devuelve (payload, status) para la respuesta JSON."""
     log = logging.getLogger('facial')
-    data = json.loads(request.body.decode('utf-8')) if request.body else request.POST
-    b64 = data.get('facial_frame')
     info = {
-        'has_numpy': bool(np is not None),
-        'has_cv2': bool(cv2 is not None),
-        'has_face_recognition': bool(face_recognition is not None),
+        'has_numpy': available(np),
+        'has_cv2': available(cv2),
+        'has_face_recognition': available(face_recognition),
         'b64_length': len(b64) if b64 else 0,
+        'frame_cache': frame_cache_info(),
+        'warmup': warmup_report(),
     }
     try:
         if not b64:
-            return JsonResponse({'ok': False, 'info': info, 'error': 'b64 vacío'}, status=400)
+            return {'ok': False, 'info': info, 'error': 'b64 vacío'}, 400
         header, encoded = b64.split(',') if ',' in b64 else ('', b64)
         img_bytes = base64.b64decode(encoded)
         arr = np.frombuffer(img_bytes, dtype=np.uint8)
         info['np_array_len'] = int(arr.size)
-        frame = cv2.imdecode(arr, cv2.IMREAD_COLOR) if cv2 is not None else None
+        frame = cv2.imdecode(arr, cv2.IMREAD_COLOR) if available(cv2) else None
         if frame is None:
             info['decoded'] = False
-            return JsonResponse({'ok': False, 'info': info, 'error': 'imdecode None'}, status=400)
+            return {'ok': False, 'info': info, 'error': 'imdecode None'}, 400
         h, w = frame.shape[:2]
         info['decoded'] = True
         info['shape'] = {'h': int(h), 'w': int(w)}
         info['mean_pixel'] = float(frame.mean())
-        if face_recognition is not None:
+        if available(face_recognition):
             rgb = frame[:, :, ::-1]
             boxes = face_recognition.face_locations(rgb, model='hog')
             info['boxes'] = len(boxes)
             if boxes:
                 encs = face_recognition.face_encodings(rgb, boxes)
                 info['encs'] = len(encs)
-        return JsonResponse({'ok': True, 'info': info})
+        return {'ok': True, 'info': info}, 200
     except Exception as e:
-        log.exception(f'api_debug_decode: excepción {e}')
-        return JsonResponse({'ok': False, 'info': info, 'error': str(e)}, status=500)
+        log.exception('api_debug_decode: excepción %s', e)
+        return {'ok': False, 'info': info, 'error': str(e)}, 500
 
 
-def _compute_embedding_from_b64(b64_str) -> Optional['np.ndarray']:
-    log = logging.getLogger('facial')
-    if not b64_str:
-        log.debug('compute_embedding: b64_str vacío')
-        return None
-    if np is None:
-        log.debug('compute_embedding: numpy no disponible')
-        return None
-    try:
-        header, encoded = b64_str.split(',') if ',' in b64_str else ('', b64_str)
-        img_bytes = base64.b64decode(encoded)
-        image = np.frombuffer(img_bytes, dtype=np.uint8)
-        frame = cv2.imdecode(image, cv2.IMREAD_COLOR)
-        if frame is None:
-            log.debug('compute_embedding: cv2.imdecode devolvió None')
-            return None
-        if face_recognition is not None:
-            rgb = frame[:, :, ::-1]
-            boxes = face_recognition.face_locations(rgb, model='hog')
-            log.debug(f'compute_embedding: boxes={len(boxes)}')
-            if not boxes:
-                return None
-            encs = face_recognition.face_encodings(rgb, boxes)
-            log.debug(f'compute_embedding: encs={len(encs)}')
-            if not encs:
-                return None
-            return np.array(encs[0], dtype=np.float32)
-        else:
-            # Fallback: usar promedio de píxeles de la región central como "huella" rudimentaria
-            h, w = frame.shape[:2]
-            cx, cy = w // 2, h // 2
-            crop = frame[max(cy-100,0):cy+100, max(cx-100,0):cx+100]
-            if crop.size == 0:
-                log.debug('compute_embedding: crop vacío en fallback')
-                return None
-            emb = cv2.resize(crop, (16, 16)).astype('float32').reshape(-1)
-            emb = emb / (np.linalg.norm(emb) + 1e-6)
-            return emb
-    except Exception as e:
-        logging.getLogger('facial').exception(f'compute_embedding: excepción {e}')
-        return None
+def _compute_embedding(frame, position=None) -> Optional['np.ndarray']:
+    """Calcula el embedding en el pool de codificación (ver services.encoder).
+    `frame` son los bytes subidos o el data URL base64 del JSON.
+    `position` (position_data) puede traer la caja del rostro para limitar la detección.
+    Puede lanzar EncoderBusy/EncoderTimeout cuando el pool está saturado y
+    PoorQualityFrame si el frame no pasa el control de calidad.
+    """
+    return encode_frame(frame, position)
+
+
+# Tipos de contenido aceptados como cuerpo binario: el frame es el cuerpo completo
+RAW_FRAME_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'application/octet-stream'}
+
+
+class _FrameTooLarge(Exception):
+    """Un frame binario supera FACIAL_MAX_UPLOAD_BYTES."""
+
+
+def _max_upload_bytes():
+    return getattr(settings, 'FACIAL_MAX_UPLOAD_BYTES', 4 * 1024 * 1024)
+
+
+def _uploaded_frames(request, field):
+    """Bytes de los archivos subidos en `field` (multipart), validando el tamaño de cada uno."""
+    uploads = request.FILES.getlist(field)
+    limit = _max_upload_bytes()
+    if any(upload.size > limit for upload in uploads):
+        raise _FrameTooLarge()
+    return [upload.read() for upload in uploads]
+
+
+def _read_frame_request(request):
+    """Devuelve (data, frame) para las tres formas de envío:
+    - JSON (compatibilidad): facial_frame es un data URL base64.
+    - multipart/form-data: archivo facial_frame (o facial_frames para lotes) y
+      position_data/positions como campos JSON.
+    - cuerpo image/jpeg (png, webp u octet-stream): el frame es el cuerpo y
+      email/position_data van en la query string.
+    En los modos binarios `frame` son los bytes subidos, sin base64 ni JSON.
+    Lanza _FrameTooLarge (413) o ValueError si el JSON es inválido.
+    """
+    limit = _max_upload_bytes()
+    content_type = request.content_type
+    if content_type in RAW_FRAME_TYPES:
+        if int(request.META.get('CONTENT_LENGTH') or 0) > limit:
+            raise _FrameTooLarge()
+        # Se lee del stream con tope propio (request.body copiaría y aplicaría otro límite)
+        frame = request.read(limit + 1)
+        if len(frame) > limit:
+            raise _FrameTooLarge()
+        data = request.GET.dict()
+    elif content_type == 'multipart/form-data':
+        data = request.POST.dict()
+        uploaded = _uploaded_frames(request, 'facial_frame')
+        frame = uploaded[0] if uploaded else data.get('facial_frame')
+        batch = _uploaded_frames(request, 'facial_frames')
+        if batch:
+            data['facial_frames'] = batch
+    else:
+        # Ya decodificado si el control de admisión leyó el email
+        data = request_json(request)
+        return data, data.get('facial_frame')
+    for key in ('position_data', 'positions'):
+        if isinstance(data.get(key), str):
+            data[key] = json.loads(data[key])
+    return data, frame
+
+
+def _too_large_response():
+    limit = _max_upload_bytes()
+    return JsonResponse({'ok': False, 'error': f'Frame demasiado grande (máx. {limit} bytes)'}, status=413)
+
+
+def _busy_response(exc):
+    """503 rápido cuando el pool de codificación no tiene cupo o el trabajo expiró."""
+    response = JsonResponse({'ok': False, 'error': 'Servidor ocupado, intente nuevamente'}, status=503)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+# Mensaje por motivo de rechazo del control de calidad (services.quality)
+QUALITY_MESSAGES = {
+    'too_dark': 'Imagen demasiado oscura. Mejore la iluminación',
+    'too_bright': 'Imagen sobreexpuesta. Evite la luz directa sobre la cámara',
+    'low_contrast': 'Imagen sin contraste suficiente. Mejore la iluminación',
+    'blurry': 'Imagen borrosa. Mantenga la cámara quieta',
+}
+
+
+def _quality_response(reason):
+    """400 con el motivo (`code`) cuando el frame se rechaza antes de la detección."""
+    return JsonResponse({'ok': False, 'error': QUALITY_MESSAGES[reason], 'code': reason}, status=400)
 
 
 def _compare_embeddings(stored_bytes: bytes, live_emb) -> bool:
-    if stored_bytes is None or live_emb is None or np is None:
+    if stored_bytes is None or live_emb is None or not available(np):
         return False
     try:
         stored = np.frombuffer(stored_bytes, dtype=np.float32)
-        if face_recognition is not None and stored.shape[0] in (128, 129):
+        if available(face_recognition) and stored.shape[0] in (128, 129):
             # distancia euclidiana típica < 0.6
             dist = np.linalg.norm(stored[:128] - live_emb[:128])
             return dist < 0.6
@@ -456,28 +789,23 @@ def _compare_to_collection(user: Usuario, live_emb) -> bool:
     """Compara el embedding vivo contra la colección de embeddings del usuario.
     Mantiene la lógica: si no hay colección, usa el método de compatibilidad _compare_embeddings.
     Usa umbral estricto base 0.45 con leve adaptación hasta 0.55 por intentos fallidos.
+    La colección se compara como una matriz cacheada por usuario y versión (ver services.embeddings).
     """
     try:
         if live_emb is None:
             return False
-        if np is None:
+        if not available(np):
             # Sin numpy no podemos comparar colecciones; usar compatibilidad
             return _compare_embeddings(user.facial_data, live_emb)
+        # Matriz (muestras x 128) cacheada por usuario y versión; una sola operación vectorizada
+        gallery = get_gallery(user)
         # Si no hay colección, caer al camino de compatibilidad
-        if not user.facial_embeddings:
+        if gallery is None:
             return _compare_embeddings(user.facial_data, live_emb)
 
         base_thr = 0.45
-        thr = min(base_thr + (user.failed_attempts or 0) * 0.03, 0.55)
-
-        live = np.array(live_emb, dtype=np.float32)
-        for emb_list in user.facial_embeddings:
-            stored = np.array(emb_list, dtype=np.float32)
-            # Euclidiana en primeras 128 dims (face_recognition)
-            dist = float(np.linalg.norm(stored[:128] - live[:128]))
-            if dist < thr:
-                return True
-        return False
+        thr = match_threshold(min(base_thr + (user.failed_attempts or 0) * 0.03, 0.55))
+        return min_distance(gallery, live_emb) < thr
     except Exception:
         return False
 
@@ -486,66 +814,38 @@ def _validate_position_collection(user: Usuario, live_pos) -> bool:
     """Valida la posición contra alguna de las posiciones registradas en el usuario.
     Si no hay colección, usa la posición de compatibilidad existente.
     Tolerancias estrictas y ligera adaptación por intentos fallidos.
+    Las posiciones se comparan como matrices float64 cacheadas por usuario (ver services.positions).
     """
     try:
-        if not live_pos:
-            return False
-        positions = user.positions or ([] if user.position_data is None else [user.position_data])
-        if not positions:
+        if not live_pos or not available(np):
             return False
-
-        # Tolerancias base
-        attempts = user.failed_attempts or 0
-        tol_xy = max(0.05, 0.10 - attempts * 0.01)      # 0.10 -> 0.05
-        tol_scale = max(0.08, 0.15 - attempts * 0.01)   # 0.15 -> 0.08
-
-        for p in positions:
-            # Formato {x,y,scale}
-            if all(k in p for k in ('x', 'y', 'scale')) and all(k in live_pos for k in ('x', 'y', 'scale')):
-                if (
-                    abs(p['x'] - live_pos['x']) <= tol_xy and
-                    abs(p['y'] - live_pos['y']) <= tol_xy and
-                    abs(p['scale'] - live_pos['scale']) <= tol_scale
-                ):
-                    return True
-            # Formato angular {roll,pitch,yaw,dist}
-            if all(k in p for k in ('roll', 'pitch', 'yaw', 'dist')) and all(k in live_pos for k in ('roll', 'pitch', 'yaw', 'dist')):
-                tol_ang = max(8, 15 - attempts * 1)
-                tol_dist = max(0.12, 0.22 - attempts * 0.02)
-                if (
-                    abs(p['roll'] - live_pos['roll']) <= tol_ang and
-                    abs(p['pitch'] - live_pos['pitch']) <= tol_ang and
-                    abs(p['yaw'] - live_pos['yaw']) <= tol_ang and
-                    abs(p['dist'] - live_pos['dist']) <= tol_dist
-                ):
-                    return True
-        return False
+        return positions.matches(get_poses(user), live_pos, attempts=user.failed_attempts)
     except Exception:
         return False
 
+
+def _validate_position_many(users, live_pos):
+    """Versión por lotes de _validate_position_collection: un bool por usuario, en orden."""
+    try:
+        if not live_pos or not available(np):
+            return [False] * len(users)
+        pose_sets = [get_poses(user) for user in users]
+        return positions.match_many(pose_sets, live_pos, [user.failed_attempts for user in users]).tolist()
+    except Exception:
+        return [False] * len(users)
+
+
+# Tolerancias fijas de la validación de una sola posición (xys: 0.12/0.20; ángulos: 15°/0.25)
+_SINGLE_POSITION_TOL = ((0.12, 0.12, 0.20), (15, 15, 15, 0.25))
+
+
 def _validate_position(stored_pos, live_pos) -> bool:
     try:
         # posición esperada: dict con {x,y,scale} o {roll,pitch,yaw,dist}
-        keys = ('x', 'y', 'scale')
-        if all(k in stored_pos for k in keys) and all(k in live_pos for k in keys):
-            tol_xy = 0.12
-            tol_scale = 0.20
-            ok = (
-                abs(stored_pos['x'] - live_pos['x']) <= tol_xy and
-                abs(stored_pos['y'] - live_pos['y']) <= tol_xy and
-                abs(stored_pos['scale'] - live_pos['scale']) <= tol_scale
-            )
-            return ok
-        angles = ('roll', 'pitch', 'yaw', 'dist')
-        if all(k in stored_pos for k in angles) and all(k in live_pos for k in angles):
-            tol_ang = 15  # grados
-            tol_dist = 0.25
-            return (
-                abs(stored_pos['roll'] - live_pos['roll']) <= tol_ang and
-                abs(stored_pos['pitch'] - live_pos['pitch']) <= tol_ang and
-                abs(stored_pos['yaw'] - live_pos['yaw']) <= tol_ang and
-                abs(stored_pos['dist'] - live_pos['dist']) <= tol_dist
-            )
-        return False
+        poses = positions.poses_from_list([stored_pos])
+        if poses.xys.size and positions.live_vectors(live_pos)[0] is not None:
+            # Si ambas traen {x,y,scale} solo se evalúa ese formato
+            poses = poses._replace(angles=poses.angles[:0])
+        return positions.matches(poses, live_pos, tol=_SINGLE_POSITION_TOL)
     except Exception:
         return False